@@ -0,0 +1,134 @@
+"""
+BM25 检索微基准：对比 rank_bm25.BM25Okapi（全量 get_scores + 排序）、
+BM25Index.get_scores（NumPy 全量打分 + argpartition）、BM25Index.top_k（倒排表 MaxScore 精确 Top-K）
+与 SparseBM25Scorer（稀疏矩阵，单条 / 批量查询）。
+语料为按 Zipf 分布生成的合成分词文档，不依赖 Milvus / OpenAI。
+用法：
+  cd rag && python bench_bm25.py
+  python bench_bm25.py --sizes 10000,100000 --queries 50 --top-k 10
+注意：1M 文档时 rank_bm25 需为每个文档构建 dict，内存占用可达数 GB，可用 --max-rank-bm25-docs 跳过。
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bm25_index import BM25Index
+
+
+def make_corpus(n_docs: int, vocab_size: int, avg_len: int, seed: int = 0) -> list:
+    """按 Zipf 分布生成分词语料（高频词近似中文语料中的标点与虚词）"""
+    rng = np.random.default_rng(seed)
+    ranks = np.arange(1, vocab_size + 1, dtype=np.float64)
+    probs = 1.0 / ranks
+    probs /= probs.sum()
+    lengths = rng.poisson(avg_len, size=n_docs).clip(min=1)
+    token_ids = rng.choice(vocab_size, size=int(lengths.sum()), p=probs)
+    vocab = [f"t{i}" for i in range(vocab_size)]
+    corpus = []
+    pos = 0
+    for length in lengths:
+        corpus.append([vocab[t] for t in token_ids[pos : pos + length]])
+        pos += length
+    return corpus
+
+
+def make_queries(n_queries: int, vocab_size: int, seed: int = 1) -> list:
+    """查询：1 个高频词 + 2~4 个中低频词，模拟「症状词 + 虚词/标点」的问句"""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(n_queries):
+        head = [f"t{rng.integers(0, 20)}"]
+        tail = [f"t{t}" for t in rng.integers(20, vocab_size, size=int(rng.integers(2, 5)))]
+        queries.append(head + tail)
+    return queries
+
+
+def _time_per_query(fn, queries: list) -> float:
+    start = time.perf_counter()
+    for q in queries:
+        fn(q)
+    return (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def bench_size(n_docs: int, args) -> dict:
+    print(f"\n===== {n_docs} 文档 =====")
+    corpus = make_corpus(n_docs, args.vocab_size, args.avg_len)
+    queries = make_queries(args.queries, args.vocab_size)
+    k = args.top_k
+    row = {"n_docs": n_docs}
+
+    start = time.perf_counter()
+    docs = [{"id": str(i)} for i in range(n_docs)]
+    index = BM25Index.build(docs, corpus)
+    row["index_build_s"] = time.perf_counter() - start
+
+    def exhaustive(q):
+        scores = index.get_scores(q)
+        top = np.argpartition(-scores, k)[:k]
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    row["numpy_full_ms"] = _time_per_query(exhaustive, queries)
+    row["maxscore_ms"] = _time_per_query(lambda q: index.top_k(q, k), queries)
+
+    scorer = index.sparse_scorer()
+    row["sparse_ms"] = _time_per_query(lambda q: scorer.top_k(q, k), queries)
+    start = time.perf_counter()
+    scorer.top_k_batch(queries, k)
+    row["sparse_batch_ms"] = (time.perf_counter() - start) * 1000 / len(queries)
+
+    # 正确性：MaxScore 的 Top-K 分数与全量打分一致
+    for q in queries:
+        full = np.sort(index.get_scores(q))[::-1][:k]
+        _, top_scores = index.top_k(q, k)
+        assert np.allclose(full[: len(top_scores)], top_scores), f"MaxScore 结果与全量打分不一致: {q}"
+
+    if n_docs <= args.max_rank_bm25_docs:
+        from rank_bm25 import BM25Okapi
+
+        start = time.perf_counter()
+        bm25 = BM25Okapi(corpus)
+        row["rank_bm25_build_s"] = time.perf_counter() - start
+
+        def rank_bm25_topk(q):
+            scores = bm25.get_scores(q)
+            return sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
+
+        rank_queries = queries[: max(1, args.queries // 5)] if n_docs >= 1_000_000 else queries
+        row["rank_bm25_ms"] = _time_per_query(rank_bm25_topk, rank_queries)
+        del bm25
+
+    for key, val in row.items():
+        if key != "n_docs":
+            print(f"  {key}: {val:.3f}")
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BM25 检索微基准（rank_bm25 vs 倒排表 MaxScore）")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="文档数，逗号分隔")
+    parser.add_argument("--queries", type=int, default=50, help="每个规模的查询条数")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--vocab-size", type=int, default=50000)
+    parser.add_argument("--avg-len", type=int, default=60, help="平均文档长度（词数）")
+    parser.add_argument("--max-rank-bm25-docs", type=int, default=1_000_000, help="超过该文档数时跳过 rank_bm25")
+    args = parser.parse_args()
+
+    rows = [bench_size(int(n), args) for n in args.sizes.split(",") if n.strip()]
+
+    print("\n========== 单次查询耗时（ms） ==========")
+    print(f"{'文档数':>10} {'rank_bm25':>12} {'numpy 全量':>12} {'MaxScore':>12} {'sparse':>12} {'sparse 批量':>12}")
+    for row in rows:
+        rank = f"{row['rank_bm25_ms']:.2f}" if "rank_bm25_ms" in row else "-"
+        print(
+            f"{row['n_docs']:>10} {rank:>12} {row['numpy_full_ms']:>12.2f} {row['maxscore_ms']:>12.2f}"
+            f" {row['sparse_ms']:>12.2f} {row['sparse_batch_ms']:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,850 @@
+"""
+BM25 关键词索引模块
+以数组形式保存分词语料（文档 → 词频）、倒排表（词 → 文档）、词项统计与文档库，
+并支持落盘为版本化快照：worker 启动时通过 mmap 直接加载，无需从 Milvus 拉取全量数据再分词；
+支持单文档级的增量新增 / 更新 / 删除。
+打分公式与 rank_bm25.BM25Okapi 保持一致（k1=1.5, b=0.75, 负 idf 以 epsilon * 平均 idf 兜底）。
+"""
+import os
+import json
+import mmap
+import time
+import shutil
+import hashlib
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
+
+import numpy as np
+
+# 快照格式版本：数组布局变化时递增，旧版本快照会被忽略并重建
+SNAPSHOT_FORMAT_VERSION = 2
+# 指向当前有效快照目录的指针文件
+SNAPSHOT_POINTER_FILE = "CURRENT"
+SNAPSHOT_LOCK_FILE = ".lock"
+
+# 与 rank_bm25.BM25Okapi 默认参数一致
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+
+class DocStore:
+    """
+    只读文档库：docs.jsonl + 行偏移数组，底层 mmap，按下标懒加载单条文档。
+    支持 len()、下标访问与迭代，可直接替代原来的 List[dict]。
+    """
+
+    def __init__(self, path: str, offsets: np.ndarray):
+        self._offsets = offsets
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else None
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        n = len(self)
+        if idx < 0:
+            idx += n
+        if not 0 <= idx < n:
+            raise IndexError(idx)
+        start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+        return json.loads(self._mm[start:end])
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._file.close()
+
+
+class AppendableDocs:
+    """只读文档库（如 mmap 的 DocStore）+ 内存追加段，供增量新增文档使用"""
+
+    def __init__(self, base: Any):
+        self._base = base
+        self._extra: List[Dict[str, Any]] = []
+
+    def append(self, doc: Dict[str, Any]):
+        self._extra.append(doc)
+
+    def __len__(self) -> int:
+        return len(self._base) + len(self._extra)
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        n_base = len(self._base)
+        if idx < 0:
+            idx += len(self)
+        return self._base[idx] if idx < n_base else self._extra[idx - n_base]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        yield from self._base
+        yield from self._extra
+
+
+# 切分块 id 的格式：{原文档 id}_chunk_{i}（见 KnowledgeBase.split_documents）
+CHUNK_ID_SEPARATOR = "_chunk_"
+
+
+def parent_doc_id(doc_id: str) -> str:
+    """切分块 id 对应的原文档 id；不是切分块 id 时返回自身"""
+    head, sep, tail = doc_id.rpartition(CHUNK_ID_SEPARATOR)
+    return head if sep and head and tail.isdigit() else doc_id
+
+
+class DocIdMap:
+    """
+    文档 id → 槽位下标，同时按原文档 id 索引其切分块。
+    增量接口收到的是原文档 id，索引中保存的是切分块 id，按原文档 id 删除时用 expand 展开为全部块。
+    """
+
+    def __init__(self, doc_ids: Iterable[Optional[str]] = ()):
+        self._idx: Dict[str, int] = {}
+        self._chunks: Dict[str, set] = {}
+        for i, doc_id in enumerate(doc_ids):
+            if doc_id:
+                self.set(doc_id, i)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._idx
+
+    def get(self, doc_id: str) -> Optional[int]:
+        return self._idx.get(doc_id)
+
+    def set(self, doc_id: str, idx: int):
+        self._idx[doc_id] = idx
+        parent = parent_doc_id(doc_id)
+        if parent != doc_id:
+            self._chunks.setdefault(parent, set()).add(doc_id)
+
+    def pop(self, doc_id: str) -> Optional[int]:
+        idx = self._idx.pop(doc_id, None)
+        parent = parent_doc_id(doc_id)
+        chunks = self._chunks.get(parent)
+        if chunks is not None:
+            chunks.discard(doc_id)
+            if not chunks:
+                del self._chunks[parent]
+        return idx
+
+    def expand(self, doc_ids: Iterable[str]) -> List[str]:
+        """文档 id 本身（若已索引）及其全部切分块 id，去重保序"""
+        expanded: Dict[str, None] = {}
+        for doc_id in doc_ids:
+            if doc_id in self._idx:
+                expanded[doc_id] = None
+            for chunk_id in sorted(self._chunks.get(doc_id, ())):
+                expanded[chunk_id] = None
+        return list(expanded)
+
+
+class DocMaskCache:
+    """
+    文档槽位位图缓存（元数据过滤用）：按过滤条件的 key 缓存命中文档的布尔数组，长度为文档槽位数。
+    过滤条件需提供 key、fields（用到的文档字段）与 matches(doc)；首次使用时把这些字段投影成内存列表
+    （mmap 文档库只解析一遍），之后新的过滤条件只在投影上求值。
+    新增文档时只对新槽位补算，文档重编号（compact）后整体清空；位图不含删除标记，使用时与 live 相与。
+    """
+
+    MAX_MASKS = 256
+
+    def __init__(self):
+        self._fields: Tuple[str, ...] = ()
+        self._rows: List[Dict[str, Any]] = []
+        self._masks: Dict[Any, Tuple[Any, np.ndarray]] = {}
+
+    def _project(self, docs: Any, fields: Tuple[str, ...]):
+        if set(fields) - set(self._fields):
+            self._fields = tuple(sorted(set(self._fields) | set(fields)))
+            self._rows = [{f: doc.get(f) for f in self._fields} for doc in docs]
+
+    def get(self, doc_filter: Any, docs: Any) -> np.ndarray:
+        entry = self._masks.get(doc_filter.key)
+        if entry is not None:
+            return entry[1]
+        self._project(docs, tuple(doc_filter.fields))
+        mask = np.fromiter((doc_filter.matches(row) for row in self._rows), dtype=bool, count=len(self._rows))
+        if len(self._masks) >= self.MAX_MASKS:
+            self._masks.pop(next(iter(self._masks)))
+        self._masks[doc_filter.key] = (doc_filter, mask)
+        return mask
+
+    def extend(self, docs: Any, start: int):
+        """docs[start:] 为新追加的文档：补充投影与已缓存的位图"""
+        if not self._fields:
+            return
+        new_rows = [{f: docs[i].get(f) for f in self._fields} for i in range(start, len(docs))]
+        self._rows.extend(new_rows)
+        for key, (doc_filter, mask) in self._masks.items():
+            added = np.fromiter((doc_filter.matches(row) for row in new_rows), dtype=bool, count=len(new_rows))
+            self._masks[key] = (doc_filter, np.concatenate([mask, added]))
+
+    def clear(self):
+        self._fields = ()
+        self._rows = []
+        self._masks.clear()
+
+
+class BM25Index:
+    """
+    基于 NumPy 数组的 BM25 索引
+    - 分词语料：doc_ptr / doc_terms / doc_tfs（CSR，每行一个文档的词袋）
+    - 倒排表：term_ptr / post_docs / post_tfs（CSR，每行一个词项的 postings，文档号递增）
+    - 词项统计：df、doc_len、avgdl、idf
+    检索：get_scores 为全量打分；top_k 基于倒排表做 MaxScore 精确 Top-K，只访问查询词的 postings。
+    增量更新：新增文档写入内存增量段（文档号接在基础段之后），删除只打墓碑标记，
+    df、文档长度、avgdl、idf 随每次更新精确维护；增量段或墓碑累积到一定比例时 compact 合并为新的基础段。
+    """
+
+    # 增量段文档 + 墓碑数超过基础段该比例时自动合并
+    COMPACT_RATIO = 0.2
+
+    def __init__(
+        self,
+        terms: List[str],
+        doc_ptr: np.ndarray,
+        doc_terms: np.ndarray,
+        doc_tfs: np.ndarray,
+        term_ptr: np.ndarray,
+        post_docs: np.ndarray,
+        post_tfs: np.ndarray,
+        doc_len: np.ndarray,
+        df: np.ndarray,
+        docs: Any,
+        doc_ids: Optional[List[str]] = None,
+        generation: Optional[str] = None,
+    ):
+        self.terms = terms
+        self.vocab: Dict[str, int] = {t: i for i, t in enumerate(terms)}
+        self.generation = generation
+        self._lock = threading.RLock()
+        self._sparse_scorer = None
+        self._masks = DocMaskCache()
+        if doc_ids is None:
+            doc_ids = [doc.get("id") for doc in docs]
+        self._set_base(doc_ptr, doc_terms, doc_tfs, term_ptr, post_docs, post_tfs, doc_len, df, docs, doc_ids)
+
+    def _set_base(self, doc_ptr, doc_terms, doc_tfs, term_ptr, post_docs, post_tfs, doc_len, df, docs, doc_ids):
+        """设置基础段（只读，可能为 mmap），并重置增量段与可变统计"""
+        self.doc_ptr = doc_ptr
+        self.doc_terms = doc_terms
+        self.doc_tfs = doc_tfs
+        self.term_ptr = term_ptr
+        self.post_docs = post_docs
+        self.post_tfs = post_tfs
+        self.docs = docs
+        self.doc_ids: List[Optional[str]] = list(doc_ids)
+        self._id_map = DocIdMap(self.doc_ids)
+        self.n_base_docs = len(doc_len)
+        self.n_base_terms = len(term_ptr) - 1
+
+        # 可变统计：从只读数组复制一份，增量更新时原地维护
+        self.doc_len = np.array(doc_len, dtype=np.int32)
+        self.df = np.array(df, dtype=np.int32)
+        self.live = np.ones(self.n_base_docs, dtype=bool)
+        self.n_docs = self.n_base_docs
+        self.total_len = int(self.doc_len.sum())
+
+        # 增量段：词项 → (文档号列表, 词频列表)；文档号 → [(词项, 词频)]
+        self._delta_postings: Dict[int, Tuple[List[int], List[int]]] = {}
+        self._delta_bags: Dict[int, List[Tuple[int, int]]] = {}
+        # 文档重编号后元数据过滤位图作废
+        self._masks.clear()
+
+        self._compute_bounds()
+        self._compute_idf()
+
+    # ---------- 构建 ----------
+
+    @staticmethod
+    def _invert(doc_ptr: np.ndarray, doc_terms: np.ndarray, doc_tfs: np.ndarray, n_terms: int):
+        """文档主序 → 词项主序：稳定排序保证每个词项的 postings 按文档号递增"""
+        n_docs = len(doc_ptr) - 1
+        order = np.argsort(doc_terms, kind="stable")
+        owner = np.repeat(np.arange(n_docs, dtype=np.int32), np.diff(doc_ptr))
+        post_docs = owner[order]
+        post_tfs = doc_tfs[order]
+        df = np.bincount(doc_terms, minlength=n_terms).astype(np.int32)
+        term_ptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(df, out=term_ptr[1:])
+        return term_ptr, post_docs, post_tfs, df
+
+    @classmethod
+    def build(cls, docs: List[Dict[str, Any]], tokenized_docs: List[List[str]], generation: Optional[str] = None) -> "BM25Index":
+        """由文档与对应分词结果构建索引"""
+        vocab: Dict[str, int] = {}
+        terms: List[str] = []
+        doc_ptr = [0]
+        doc_terms: List[int] = []
+        doc_tfs: List[int] = []
+        doc_len: List[int] = []
+        for tokens in tokenized_docs:
+            for tok, tf in Counter(tokens).items():
+                tid = vocab.get(tok)
+                if tid is None:
+                    tid = vocab[tok] = len(terms)
+                    terms.append(tok)
+                doc_terms.append(tid)
+                doc_tfs.append(tf)
+            doc_ptr.append(len(doc_terms))
+            doc_len.append(len(tokens))
+
+        doc_ptr_arr = np.asarray(doc_ptr, dtype=np.int64)
+        doc_terms_arr = np.asarray(doc_terms, dtype=np.int32)
+        doc_tfs_arr = np.asarray(doc_tfs, dtype=np.int32)
+        term_ptr, post_docs, post_tfs, df = cls._invert(doc_ptr_arr, doc_terms_arr, doc_tfs_arr, len(terms))
+
+        return cls(
+            terms=terms,
+            doc_ptr=doc_ptr_arr,
+            doc_terms=doc_terms_arr,
+            doc_tfs=doc_tfs_arr,
+            term_ptr=term_ptr,
+            post_docs=post_docs,
+            post_tfs=post_tfs,
+            doc_len=np.asarray(doc_len, dtype=np.int32),
+            df=df,
+            docs=list(docs),
+            generation=generation,
+        )
+
+    def _compute_bounds(self):
+        """
+        每个词项 postings 中的最大词频与最短文档长度：饱和项随 tf 增大、随 dl 减小，
+        因此 idf * norm(max_tf, min_dl) 是该词项对任意文档贡献的上界（MaxScore 用）。
+        删除文档后不回收，仍是合法上界；新增文档时按增量更新。
+        """
+        n_terms = len(self.terms)
+        self.max_tf = np.zeros(n_terms, dtype=np.int32)
+        self.min_dl = np.full(n_terms, np.iinfo(np.int32).max, dtype=np.int32)
+        counts = np.diff(self.term_ptr)
+        nonempty = np.flatnonzero(counts > 0)
+        if len(nonempty):
+            starts = self.term_ptr[:-1][nonempty]
+            self.max_tf[nonempty] = np.maximum.reduceat(self.post_tfs, starts)
+            self.min_dl[nonempty] = np.minimum.reduceat(self.doc_len[self.post_docs], starts)
+
+    def _compute_idf(self):
+        """按当前存活文档计算 avgdl 与 idf（与 BM25Okapi._calc_idf 一致，只统计 df > 0 的词项）"""
+        self.avgdl = self.total_len / self.n_docs if self.n_docs else 0.0
+        df = self.df.astype(np.float64)
+        present = df > 0
+        idf = np.log(self.n_docs - df + 0.5) - np.log(df + 0.5) if self.n_docs else np.zeros_like(df)
+        average_idf = float(idf[present].mean()) if present.any() else 0.0
+        idf[idf < 0] = BM25_EPSILON * average_idf
+        self.idf = idf
+
+    # ---------- 增量更新 ----------
+
+    def add_documents(self, docs: List[Dict[str, Any]], tokenized_docs: List[List[str]]):
+        """
+        新增文档（id 已存在时先删除旧文档，即 upsert 语义）。
+        只处理这些文档的词项，代价与新增文档规模成正比。
+        """
+        with self._lock:
+            bags = [Counter(tokens) for tokens in tokenized_docs]
+            # 先登记新词项并一次性扩展词项级数组
+            n_terms_before = len(self.terms)
+            for bag in bags:
+                for tok in bag:
+                    if tok not in self.vocab:
+                        self.vocab[tok] = len(self.terms)
+                        self.terms.append(tok)
+            n_new_terms = len(self.terms) - n_terms_before
+            if n_new_terms:
+                self.df = np.concatenate([self.df, np.zeros(n_new_terms, dtype=np.int32)])
+                self.max_tf = np.concatenate([self.max_tf, np.zeros(n_new_terms, dtype=np.int32)])
+                self.min_dl = np.concatenate([self.min_dl, np.full(n_new_terms, np.iinfo(np.int32).max, dtype=np.int32)])
+
+            for doc in docs:
+                old_idx = self._id_map.get(doc.get("id"))
+                if old_idx is not None:
+                    self._delete_one(old_idx)
+
+            if not isinstance(self.docs, (list, AppendableDocs)):
+                self.docs = AppendableDocs(self.docs)
+            new_lens = []
+            first_idx = len(self.doc_len)
+            for offset, (doc, tokens, bag) in enumerate(zip(docs, tokenized_docs, bags)):
+                idx = first_idx + offset
+                dl = len(tokens)
+                items = []
+                for tok, tf in bag.items():
+                    tid = self.vocab[tok]
+                    items.append((tid, tf))
+                    postings = self._delta_postings.setdefault(tid, ([], []))
+                    postings[0].append(idx)
+                    postings[1].append(tf)
+                    self.df[tid] += 1
+                    if tf > self.max_tf[tid]:
+                        self.max_tf[tid] = tf
+                    if dl < self.min_dl[tid]:
+                        self.min_dl[tid] = dl
+                self._delta_bags[idx] = items
+                self.docs.append(doc)
+                self.doc_ids.append(doc.get("id"))
+                if doc.get("id"):
+                    self._id_map.set(doc["id"], idx)
+                new_lens.append(dl)
+
+            self.doc_len = np.concatenate([self.doc_len, np.asarray(new_lens, dtype=np.int32)])
+            self.live = np.concatenate([self.live, np.ones(len(new_lens), dtype=bool)])
+            self._masks.extend(self.docs, first_idx)
+            self.n_docs += len(new_lens)
+            self.total_len += int(sum(new_lens))
+            self._after_update()
+
+    def delete_documents(self, doc_ids: List[str]) -> int:
+        """按文档 id 删除（打墓碑），原文档 id 连同其全部切分块一起删除，返回实际删除条数"""
+        with self._lock:
+            deleted = 0
+            for doc_id in self._id_map.expand(doc_ids):
+                idx = self._id_map.get(doc_id)
+                if idx is not None:
+                    self._delete_one(idx)
+                    deleted += 1
+            if deleted:
+                self._after_update()
+            return deleted
+
+    def _delete_one(self, idx: int):
+        if not self.live[idx]:
+            return
+        self.live[idx] = False
+        doc_id = self.doc_ids[idx]
+        if doc_id and self._id_map.get(doc_id) == idx:
+            self._id_map.pop(doc_id)
+        if idx < self.n_base_docs:
+            tids = np.asarray(self.doc_terms[self.doc_ptr[idx] : self.doc_ptr[idx + 1]])
+        else:
+            tids = np.asarray([tid for tid, _ in self._delta_bags[idx]], dtype=np.int64)
+        # 同一文档内词项唯一，可直接花式索引自减
+        self.df[tids] -= 1
+        self.n_docs -= 1
+        self.total_len -= int(self.doc_len[idx])
+
+    def _after_update(self):
+        self._compute_idf()
+        # 稀疏矩阵的权重依赖 avgdl，更新后作废，下次使用时重建
+        self._sparse_scorer = None
+        n_dirty = len(self._delta_bags) + int(self.n_base_docs - self.live[: self.n_base_docs].sum())
+        if n_dirty > self.COMPACT_RATIO * max(self.n_base_docs, 1):
+            self.compact()
+
+    @property
+    def is_dirty(self) -> bool:
+        """是否存在未合并的增量段或墓碑"""
+        return bool(self._delta_bags) or not self.live.all()
+
+    def compact(self):
+        """将增量段与墓碑合并为新的基础段（文档号按原顺序重新编号）"""
+        with self._lock:
+            if not self.is_dirty:
+                return
+            live_idx = np.flatnonzero(self.live)
+            nb = self.n_base_docs
+
+            base_counts = np.diff(self.doc_ptr)
+            owner = np.repeat(np.arange(nb), base_counts)
+            entry_mask = self.live[:nb][owner]
+            parts_terms = [np.asarray(self.doc_terms)[entry_mask]]
+            parts_tfs = [np.asarray(self.doc_tfs)[entry_mask]]
+            counts = [base_counts[live_idx[live_idx < nb]]]
+
+            delta_live = live_idx[live_idx >= nb]
+            if len(delta_live):
+                bags = [self._delta_bags[int(i)] for i in delta_live]
+                parts_terms.append(np.asarray([tid for bag in bags for tid, _ in bag], dtype=np.int32))
+                parts_tfs.append(np.asarray([tf for bag in bags for _, tf in bag], dtype=np.int32))
+                counts.append(np.asarray([len(bag) for bag in bags], dtype=np.int64))
+
+            doc_terms = np.concatenate(parts_terms).astype(np.int32)
+            doc_tfs = np.concatenate(parts_tfs).astype(np.int32)
+            doc_ptr = np.zeros(len(live_idx) + 1, dtype=np.int64)
+            np.cumsum(np.concatenate(counts), out=doc_ptr[1:])
+            term_ptr, post_docs, post_tfs, df = self._invert(doc_ptr, doc_terms, doc_tfs, len(self.terms))
+
+            self._set_base(
+                doc_ptr, doc_terms, doc_tfs, term_ptr, post_docs, post_tfs,
+                self.doc_len[live_idx],
+                df,
+                [self.docs[int(i)] for i in live_idx],
+                [self.doc_ids[int(i)] for i in live_idx],
+            )
+            self._sparse_scorer = None
+
+    # ---------- 打分 ----------
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def _term_norms(self, doc_ids: np.ndarray, tfs: np.ndarray) -> np.ndarray:
+        """BM25 词频饱和项 tf*(k1+1) / (tf + k1*(1-b+b*dl/avgdl))"""
+        return self._saturation(tfs, self.doc_len[doc_ids])
+
+    def _saturation(self, tfs: np.ndarray, dl: np.ndarray) -> np.ndarray:
+        tfs = tfs.astype(np.float64)
+        return tfs * (BM25_K1 + 1) / (tfs + BM25_K1 * (1 - BM25_B + BM25_B * dl / self.avgdl))
+
+    def _postings(self, tid: int) -> Tuple[np.ndarray, np.ndarray]:
+        """基础段 postings 与增量段 postings 拼接（增量段文档号更大，拼接后仍有序）"""
+        if tid < self.n_base_terms:
+            start, end = self.term_ptr[tid], self.term_ptr[tid + 1]
+            docs, tfs = self.post_docs[start:end], self.post_tfs[start:end]
+        else:
+            docs, tfs = np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        delta = self._delta_postings.get(tid)
+        if delta:
+            docs = np.concatenate([docs, np.asarray(delta[0], dtype=np.int32)])
+            tfs = np.concatenate([tfs, np.asarray(delta[1], dtype=np.int32)])
+        return docs, tfs
+
+    def get_scores(self, query_tokens: List[str]) -> np.ndarray:
+        """对全部文档打分，返回长度为文档槽位数的分数数组（语义同 BM25Okapi.get_scores，已删除文档为 0）"""
+        with self._lock:
+            scores = np.zeros(len(self.doc_len), dtype=np.float64)
+            for tok in query_tokens:
+                tid = self.vocab.get(tok)
+                if tid is None:
+                    continue
+                doc_ids, tfs = self._postings(tid)
+                scores[doc_ids] += self.idf[tid] * self._term_norms(doc_ids, tfs)
+            scores[~self.live] = 0.0
+            return scores
+
+    def _score_candidates(self, cand: np.ndarray, query_terms: List[Tuple[int, float]]) -> np.ndarray:
+        """对候选文档按全部查询词精确打分：在每个词项的有序 postings 中二分查找候选文档"""
+        scores = np.zeros(len(cand), dtype=np.float64)
+        for tid, weight in query_terms:
+            docs, tfs = self._postings(tid)
+            pos = np.searchsorted(docs, cand)
+            pos_clipped = np.minimum(pos, len(docs) - 1)
+            found = (pos < len(docs)) & (docs[pos_clipped] == cand)
+            if found.any():
+                scores[found] += weight * self._term_norms(cand[found], tfs[pos_clipped[found]])
+        return scores
+
+    def filter_mask(self, doc_filter: Any) -> np.ndarray:
+        """元数据过滤条件对应的文档位图（已与 live 相与），按条件缓存"""
+        with self._lock:
+            return self._masks.get(doc_filter, self.docs) & self.live
+
+    def top_k(self, query_tokens: List[str], k: int, doc_filter: Any = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        精确 Top-K（MaxScore 词项划分）：
+        按词项上界从大到小逐个把词项加入「必要集合」，只对必要词项 postings 的并集打精确分；
+        当剩余非必要词项的上界之和小于当前第 K 名分数时，只出现在非必要词项中的文档不可能进入 Top-K，停止扩展。
+        查询代价取决于查询词的 postings 长度，而非语料规模。
+        doc_filter 给定时只对过滤位图内的文档打分（上界对子集同样成立，结果仍为子集内的精确 Top-K）。
+        返回 (文档下标数组, 分数数组)，按分数降序、同分按文档下标升序（与全量排序结果一致）。
+        """
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        with self._lock:
+            if k <= 0 or not self.n_docs:
+                return empty
+            allowed = self.filter_mask(doc_filter) if doc_filter else self.live
+
+            qtf = Counter(self.vocab[tok] for tok in query_tokens if tok in self.vocab)
+            # (词项, 查询词频 * idf, 上界)，按上界降序；df 为 0 的词项（文档均已删除）不参与
+            query_terms = []
+            for tid, cnt in qtf.items():
+                if self.df[tid] <= 0:
+                    continue
+                weight = cnt * float(self.idf[tid])
+                bound = weight * float(self._saturation(np.asarray(self.max_tf[tid]), np.asarray(self.min_dl[tid])))
+                query_terms.append((tid, weight, bound))
+            if not query_terms:
+                return empty
+            query_terms.sort(key=lambda x: x[2], reverse=True)
+            remaining_bounds = np.cumsum([b for _, _, b in query_terms][::-1])[::-1]
+            scoring_terms = [(tid, weight) for tid, weight, _ in query_terms]
+
+            cand = np.empty(0, dtype=np.int64)
+            cand_scores = np.empty(0, dtype=np.float64)
+            for i, (tid, _, _) in enumerate(query_terms):
+                docs, _ = self._postings(tid)
+                new_docs = np.setdiff1d(docs, cand, assume_unique=True).astype(np.int64)
+                new_docs = new_docs[allowed[new_docs]]
+                if len(new_docs):
+                    cand = np.concatenate([cand, new_docs])
+                    cand_scores = np.concatenate([cand_scores, self._score_candidates(new_docs, scoring_terms)])
+                if i + 1 < len(query_terms) and len(cand) >= k:
+                    theta = np.partition(cand_scores, len(cand_scores) - k)[len(cand_scores) - k]
+                    if remaining_bounds[i + 1] < theta:
+                        break
+
+            order = np.lexsort((cand, -cand_scores))[:k]
+            return cand[order], cand_scores[order]
+
+    def search(self, query_tokens: List[str], k: int, doc_filter: Any = None) -> List[Tuple[Dict[str, Any], float]]:
+        """MaxScore Top-K 并在同一把锁内取回文档，避免与 compact 的文档重编号交错"""
+        with self._lock:
+            doc_ids, scores = self.top_k(query_tokens, k, doc_filter)
+            return [(self.docs[int(i)], float(s)) for i, s in zip(doc_ids, scores)]
+
+    def get_documents(self, doc_ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """按文档 id 取回文档（已删除或不存在的返回 None）"""
+        with self._lock:
+            result = []
+            for doc_id in doc_ids:
+                idx = self._id_map.get(doc_id)
+                result.append(self.docs[idx] if idx is not None and self.live[idx] else None)
+            return result
+
+    def iter_live_documents(self) -> Iterator[Dict[str, Any]]:
+        """遍历当前未删除的文档（先在锁内取快照下标，避免与 compact 交错）"""
+        with self._lock:
+            docs = self.docs
+            live_idx = np.flatnonzero(self.live).tolist()
+        for idx in live_idx:
+            yield docs[idx]
+
+    def sparse_scorer(self) -> "SparseBM25Scorer":
+        """懒构建并缓存稀疏矩阵打分器（有未合并的增量更新时先 compact）"""
+        with self._lock:
+            if self._sparse_scorer is None:
+                self.compact()
+                self._sparse_scorer = SparseBM25Scorer(self)
+            return self._sparse_scorer
+
+    # ---------- 快照 ----------
+
+    def save_snapshot(self, root: str, generation: Optional[str] = None) -> str:
+        """
+        将索引写为版本化快照目录，并原子更新 CURRENT 指针。
+        返回快照目录路径。
+        """
+        with self._lock:
+            self.compact()
+            return self._write_snapshot(root, generation if generation is not None else self.generation)
+
+    def _write_snapshot(self, root: str, generation: Optional[str]) -> str:
+        os.makedirs(root, exist_ok=True)
+        name = f"v{SNAPSHOT_FORMAT_VERSION}-{_generation_digest(generation)}"
+        target = os.path.join(root, name)
+        tmp = f"{target}.tmp-{os.getpid()}"
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+
+        arrays = {
+            "doc_ptr": self.doc_ptr,
+            "doc_terms": self.doc_terms,
+            "doc_tfs": self.doc_tfs,
+            "term_ptr": self.term_ptr,
+            "post_docs": self.post_docs,
+            "post_tfs": self.post_tfs,
+            "doc_len": self.doc_len,
+            "df": self.df,
+        }
+        for key, arr in arrays.items():
+            np.save(os.path.join(tmp, f"{key}.npy"), np.ascontiguousarray(arr))
+
+        with open(os.path.join(tmp, "terms.json"), "w", encoding="utf-8") as f:
+            json.dump(self.terms, f, ensure_ascii=False)
+        with open(os.path.join(tmp, "doc_ids.json"), "w", encoding="utf-8") as f:
+            json.dump(self.doc_ids, f, ensure_ascii=False)
+
+        write_doc_store(tmp, self.docs)
+
+        meta = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "generation": generation,
+            "n_docs": int(self.n_docs),
+            "n_terms": len(self.terms),
+            "created_at": int(time.time()),
+        }
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.replace(tmp, target)
+
+        pointer_tmp = os.path.join(root, f"{SNAPSHOT_POINTER_FILE}.tmp-{os.getpid()}")
+        with open(pointer_tmp, "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(pointer_tmp, os.path.join(root, SNAPSHOT_POINTER_FILE))
+
+        # 清理旧版本快照（当前已加载旧快照的进程仍持有 mmap，删除目录不影响其读取）
+        for entry in os.listdir(root):
+            path = os.path.join(root, entry)
+            if entry != name and entry.startswith("v") and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+        return target
+
+    @classmethod
+    def load_snapshot(cls, root: str, generation: Optional[str] = None) -> Optional["BM25Index"]:
+        """
+        通过 mmap 加载 CURRENT 指向的快照。
+        快照不存在、格式版本不符或 generation 与期望不一致时返回 None。
+        """
+        try:
+            with open(os.path.join(root, SNAPSHOT_POINTER_FILE), "r", encoding="utf-8") as f:
+                name = f.read().strip()
+            path = os.path.join(root, name)
+            with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if meta.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+            return None
+        if generation is not None and meta.get("generation") != generation:
+            return None
+
+        def _load(key: str) -> np.ndarray:
+            return np.load(os.path.join(path, f"{key}.npy"), mmap_mode="r")
+
+        with open(os.path.join(path, "terms.json"), "r", encoding="utf-8") as f:
+            terms = json.load(f)
+        with open(os.path.join(path, "doc_ids.json"), "r", encoding="utf-8") as f:
+            doc_ids = json.load(f)
+
+        return cls(
+            terms=terms,
+            doc_ptr=_load("doc_ptr"),
+            doc_terms=_load("doc_terms"),
+            doc_tfs=_load("doc_tfs"),
+            term_ptr=_load("term_ptr"),
+            post_docs=_load("post_docs"),
+            post_tfs=_load("post_tfs"),
+            doc_len=_load("doc_len"),
+            df=_load("df"),
+            docs=load_doc_store(path),
+            doc_ids=doc_ids,
+            generation=meta.get("generation"),
+        )
+
+
+class SparseBM25Scorer:
+    """
+    向量化 BM25 打分器（稀疏矩阵后端）
+    预计算稀疏矩阵 W（行 = 文档，列 = 词项，值 = BM25 饱和项），查询向量取 查询词频 * idf，
+    单条查询为一次稀疏矩阵 × 向量，多条查询为一次稀疏矩阵 × 矩阵，Top-K 用 argpartition 选取。
+    """
+
+    def __init__(self, index: BM25Index):
+        from scipy import sparse
+
+        self._sparse = sparse
+        self.index = index
+        # 固定构建时的词表规模、idf 与文档槽位数，索引后续增量更新不影响已构建的矩阵
+        self.n_terms = n_terms = len(index.terms)
+        self.n_docs = index.n_docs
+        self.idf = index.idf.copy()
+        # 构建后文档库只会追加或被 compact 整体替换，持有当前引用即可保证下标一致
+        self.docs = index.docs
+        data = index._term_norms(np.asarray(index.post_docs), np.asarray(index.post_tfs))
+        # 倒排表即 W 的按列压缩表示：按列切片只需读取查询词的 postings，
+        # 比 CSR 按列切片（需扫描全部非零元）快一个数量级，因此直接以 CSC 存储
+        self.matrix = sparse.csc_matrix(
+            (data, np.asarray(index.post_docs), np.asarray(index.term_ptr)),
+            shape=(index.n_docs, n_terms),
+        )
+
+    # 批量查询按块做矩阵乘，限制稠密中间结果（文档数 × 块大小）的内存
+    BATCH_CHUNK_SIZE = 64
+
+    def _query_matrix(self, queries: List[List[str]]) -> np.ndarray:
+        """构造 词项数 × 查询数 的查询矩阵，值为 查询词频 * idf"""
+        q = np.zeros((self.n_terms, len(queries)), dtype=np.float64)
+        for j, tokens in enumerate(queries):
+            for tok in tokens:
+                tid = self.index.vocab.get(tok)
+                if tid is not None and tid < self.n_terms:
+                    q[tid, j] += self.idf[tid]
+        return q
+
+    def get_scores(self, query_tokens: List[str]) -> np.ndarray:
+        """单条查询：一次稀疏矩阵 × 向量，返回全部文档分数"""
+        return self.get_scores_batch([query_tokens])[:, 0]
+
+    def get_scores_batch(self, queries: List[List[str]]) -> np.ndarray:
+        """多条查询一次稀疏矩阵 × 矩阵：返回 文档数 × 查询数 的分数矩阵"""
+        if not queries:
+            return np.zeros((self.n_docs, 0), dtype=np.float64)
+        q = self._query_matrix(queries)
+        # 只取查询中出现的词项列参与乘法，计算量与查询词的 postings 成正比
+        cols = np.flatnonzero(q.any(axis=1))
+        if not len(cols):
+            return np.zeros((self.n_docs, len(queries)), dtype=np.float64)
+        return np.asarray(self.matrix[:, cols] @ q[cols])
+
+    def top_k(self, query_tokens: List[str], k: int, doc_filter: Any = None) -> Tuple[np.ndarray, np.ndarray]:
+        return self.top_k_batch([query_tokens], k, doc_filter)[0]
+
+    def search_batch(self, queries: List[List[str]], k: int, doc_filter: Any = None) -> List[List[Tuple[Dict[str, Any], float]]]:
+        """批量 Top-K 并取回文档：每条查询返回 [(文档, 分数), ...]"""
+        return [
+            [(self.docs[int(i)], float(s)) for i, s in zip(doc_ids, scores)]
+            for doc_ids, scores in self.top_k_batch(queries, k, doc_filter)
+        ]
+
+    def top_k_batch(self, queries: List[List[str]], k: int, doc_filter: Any = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        多条查询分块批量打分，逐列 argpartition 取 Top-K；只返回分数大于 0 的文档。
+        doc_filter 给定时，过滤位图外的文档分数置 0（所有查询共用同一过滤条件）。
+        """
+        if k <= 0 or not self.n_docs:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)) for _ in queries]
+        k = min(k, self.n_docs)
+        allowed = self.index.filter_mask(doc_filter)[: self.n_docs] if doc_filter else None
+        results = []
+        for start in range(0, len(queries), self.BATCH_CHUNK_SIZE):
+            scores = self.get_scores_batch(queries[start : start + self.BATCH_CHUNK_SIZE])
+            if allowed is not None:
+                scores[~allowed] = 0.0
+            for j in range(scores.shape[1]):
+                col = scores[:, j]
+                top = np.argpartition(-col, k - 1)[:k]
+                # 与第 K 名同分的文档全部纳入后再截断，同分按文档下标升序（与 BM25Index.top_k 一致）
+                top = np.flatnonzero(col >= max(col[top].min(), np.nextafter(0, 1)))
+                top = top[np.lexsort((top, -col[top]))][:k]
+                results.append((top.astype(np.int64), col[top]))
+        return results
+
+
+def write_doc_store(directory: str, docs: Iterable[Dict[str, Any]]):
+    """写出 docs.jsonl + doc_offsets.npy，供 DocStore / load_doc_store 以 mmap 方式读取"""
+    offsets = [0]
+    with open(os.path.join(directory, "docs.jsonl"), "wb") as f:
+        for doc in docs:
+            line = json.dumps(doc, ensure_ascii=False).encode("utf-8") + b"\n"
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    np.save(os.path.join(directory, "doc_offsets.npy"), np.asarray(offsets, dtype=np.int64))
+
+
+def load_doc_store(directory: str) -> DocStore:
+    return DocStore(os.path.join(directory, "docs.jsonl"), np.load(os.path.join(directory, "doc_offsets.npy"), mmap_mode="r"))
+
+
+def _generation_digest(generation: Optional[str]) -> str:
+    return hashlib.sha1(str(generation).encode("utf-8")).hexdigest()[:16]
+
+
+@contextmanager
+def snapshot_lock(root: str):
+    """
+    快照目录的进程间互斥锁：多个 worker 同时启动时只有一个去构建，其余等待后直接加载。
+    不支持 fcntl 的平台上退化为无锁。
+    """
+    os.makedirs(root, exist_ok=True)
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(os.path.join(root, SNAPSHOT_LOCK_FILE), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
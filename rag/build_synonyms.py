@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+从 data/medical.txt（JSONL 病症数据）挖掘「口语 → 规范表述」同义词表，供 query_optimizer 的单遍规范化使用。
+规范词条取自每条病症的 name（疾病名）、symptom（症状）、acompany（并发症）；
+对每个词条按 COLLOQUIAL_VARIANTS 把其中的规范说法替换成常见口语说法，生成口语变体 → 规范词条；
+词条中「A（B）」形式的括注别名生成 B → A，变体按 A 生成。
+- 变体本身就是某个规范词条时不收录（避免把一个规范词改写成另一个）
+- 同一变体对应多个规范词条时取出现次数最多的一个
+使用方法：python build_synonyms.py [medical.txt 路径] [输出路径]
+默认：data/medical.txt → MEDICAL_SYNONYMS_PATH（data/medical_synonyms.json）
+"""
+
+import json
+import os
+import re
+import sys
+from collections import Counter
+from typing import Dict, Iterable, List, Set
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import settings, resolve_path
+
+# 词条中的规范说法 → 口语说法（按顺序依次替换，前面规则生成的变体会继续应用后面的规则）
+COLLOQUIAL_VARIANTS = [
+    ("腹泻", ("拉肚子", "拉稀", "闹肚子")),
+    ("高热", ("高烧",)),
+    ("低热", ("低烧",)),
+    ("发热", ("发烧",)),
+    ("呕吐", ("吐",)),
+    ("恶心", ("反胃", "想吐")),
+    ("乏力", ("没劲", "没力气", "浑身没劲")),
+    ("心悸", ("心慌",)),
+    ("失眠", ("睡不着", "睡不着觉")),
+    ("瘙痒", ("痒",)),
+    ("食欲不振", ("没胃口", "不想吃饭")),
+    ("食欲减退", ("没胃口", "胃口差")),
+    ("便秘", ("大便干", "拉不出")),
+    ("鼻塞", ("鼻子堵", "鼻子不通气")),
+    ("咽痛", ("嗓子痛", "喉咙痛")),
+    ("咽喉", ("嗓子", "喉咙")),
+    ("腹痛", ("肚子痛",)),
+    ("腹胀", ("肚子胀",)),
+    ("痛", ("疼",)),
+]
+
+MIN_TERM_LEN = 2
+MAX_VARIANTS_PER_TERM = 32
+# 括注别名最长字数（更长的多为说明文字而非别名）
+MAX_ALIAS_LEN = 8
+_ALIAS_PATTERN = re.compile(r"^(.+?)[（(]([^（）()]+)[）)]$")
+
+
+def iter_terms(file_path: str) -> Iterable[str]:
+    """逐条产出 medical.txt 中 name / symptom / acompany 的词条"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                raw = json.loads(line)
+            except ValueError as e:
+                print(f"⚠️  第 {line_no} 行解析失败，跳过: {e}")
+                continue
+            if raw.get("name"):
+                yield str(raw["name"]).strip()
+            for field in ("symptom", "acompany"):
+                values = raw.get(field) or []
+                if isinstance(values, str):
+                    values = [values]
+                for value in values:
+                    if str(value).strip():
+                        yield str(value).strip()
+
+
+def colloquial_variants(term: str) -> Set[str]:
+    """按 COLLOQUIAL_VARIANTS 生成词条的口语变体（不含词条本身）"""
+    variants = {term}
+    for canonical, colloquials in COLLOQUIAL_VARIANTS:
+        generated = {
+            variant.replace(canonical, colloquial)
+            for variant in variants
+            if canonical in variant
+            for colloquial in colloquials
+        }
+        variants |= generated
+        if len(variants) >= MAX_VARIANTS_PER_TERM:
+            break
+    variants.discard(term)
+    return variants
+
+
+def mine_synonyms(terms: List[str]) -> Dict[str, str]:
+    term_counts = Counter(terms)
+    canonical_terms = set(term_counts)
+    candidates: Dict[str, Counter] = {}
+
+    def propose(variant: str, canonical: str, weight: int):
+        if len(variant) < MIN_TERM_LEN or variant == canonical or variant in canonical_terms:
+            return
+        candidates.setdefault(variant, Counter())[canonical] += weight
+
+    for term in canonical_terms:
+        if len(term) < MIN_TERM_LEN:
+            continue
+        match = _ALIAS_PATTERN.match(term)
+        if match:
+            # 「A（B）」：B → A，变体按 A 生成
+            term, alias = match.group(1).strip(), match.group(2).strip()
+            if len(alias) <= MAX_ALIAS_LEN and not alias.isdigit():
+                propose(alias, term, term_counts[match.group(0)])
+        for variant in colloquial_variants(term):
+            propose(variant, term, term_counts[term] or 1)
+
+    return {variant: counts.most_common(1)[0][0] for variant, counts in sorted(candidates.items())}
+
+
+def main():
+    file_path = sys.argv[1] if len(sys.argv) > 1 else "data/medical.txt"
+    output_path = sys.argv[2] if len(sys.argv) > 2 else resolve_path(settings.medical_synonyms_path)
+
+    print("=" * 60)
+    print("  RAG智能问诊助手 - 同义词表构建（medical.txt）")
+    print("=" * 60)
+    print()
+    print(f"📄 数据文件: {file_path}")
+    print(f"💾 输出文件: {output_path}")
+    print()
+
+    if not os.path.isfile(file_path):
+        print(f"❌ 错误：文件不存在 {file_path}")
+        sys.exit(1)
+
+    try:
+        terms = list(iter_terms(file_path))
+        synonyms = mine_synonyms(terms)
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"source": os.path.basename(file_path), "terms": len(set(terms)), "synonyms": synonyms},
+                f,
+                ensure_ascii=False,
+                indent=1,
+            )
+        print(f"✅ 从 {len(set(terms))} 个规范词条生成 {len(synonyms)} 条同义词")
+        print()
+        print("🎉 同义词表构建完成！重启服务后生效")
+    except Exception as e:
+        print(f"❌ 错误：{e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
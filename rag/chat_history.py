@@ -2,94 +2,333 @@
 对话历史存储：使用 Redis 存储上下文，不依赖前端传 history。
 与 LangChain 的 ChatMessageHistory 语义一致（role + content），便于与 query_optimizer、prompt 等配合。
 调用方需传入 redis_client，避免循环依赖。
+同步函数配合 redis.Redis；a 前缀的异步函数配合 redis.asyncio.Redis（服务端使用，共享连接池，不阻塞事件循环）。
+
+存储结构：每个会话一个 Redis 列表（chat_messages:{session_id}），每条消息一个元素
+- 追加：RPUSH + LTRIM（只保留最近 max_messages 条）+ EXPIRE 在一次 pipeline 中完成，O(1) 且无读改写竞争
+- 读取：LRANGE 只取需要的最近 N 条
+- 超过 compress_min_bytes 的消息以 zlib 压缩 + base64 存储（带 "z:" 前缀），其余为 JSON
+- 兼容旧版整段 JSON 字符串（chat_history:{session_id}）：读取时拼在列表之前，不再写入，随 TTL 过期
+- 滚动摘要：会话元数据（chat_meta:{session_id}，hash）记录消息总数 total、摘要 summary 与已摘要的消息数 covered；
+  每轮追加后由调用方在后台调用 aupdate_summary，把滑出最近窗口的消息增量合并进摘要（一次 LLM 调用只处理新增部分），
+  提示词只带「摘要 + 最近几条」，长度不随会话变长而增长。读取时摘要作为 role="summary" 的消息排在最前
 """
+import base64
 import json
-from typing import List, Any
+import zlib
+from typing import Any, List, Optional
 
 # Redis key 前缀、默认 TTL（秒）
-CHAT_HISTORY_KEY_PREFIX = "chat_history:"
+CHAT_HISTORY_KEY_PREFIX = "chat_history:"  # 旧版：整段 JSON 字符串
+CHAT_MESSAGES_KEY_PREFIX = "chat_messages:"
+CHAT_META_KEY_PREFIX = "chat_meta:"
+CHAT_SUMMARY_LOCK_PREFIX = "chat_summary_lock:"
 DEFAULT_TTL = 86400  # 24 小时
+DEFAULT_MAX_MESSAGES = 50
+DEFAULT_COMPRESS_MIN_BYTES = 1024
+COMPRESSED_PREFIX = "z:"
+SUMMARY_ROLE = "summary"
 
 
-def _key(session_id: str) -> str:
+def _legacy_key(session_id: str) -> str:
     return f"{CHAT_HISTORY_KEY_PREFIX}{session_id}"
 
 
-def get_messages(session_id: str, redis_client: Any) -> List[dict]:
+def _key(session_id: str) -> str:
+    return f"{CHAT_MESSAGES_KEY_PREFIX}{session_id}"
+
+
+def _meta_key(session_id: str) -> str:
+    return f"{CHAT_META_KEY_PREFIX}{session_id}"
+
+
+def _text(raw: Any) -> str:
+    return raw.decode("utf-8") if isinstance(raw, bytes) else raw
+
+
+def encode_message(message: dict, compress_min_bytes: int = DEFAULT_COMPRESS_MIN_BYTES) -> str:
+    """单条消息的存储形式；compress_min_bytes <= 0 时不压缩"""
+    data = json.dumps(message, ensure_ascii=False)
+    if compress_min_bytes > 0 and len(data.encode("utf-8")) >= compress_min_bytes:
+        packed = base64.b64encode(zlib.compress(data.encode("utf-8"))).decode("ascii")
+        return COMPRESSED_PREFIX + packed
+    return data
+
+
+def decode_message(raw: Any) -> Optional[dict]:
+    if raw is None:
+        return None
+    text = _text(raw)
+    try:
+        if text.startswith(COMPRESSED_PREFIX):
+            text = zlib.decompress(base64.b64decode(text[len(COMPRESSED_PREFIX):])).decode("utf-8")
+        message = json.loads(text)
+    except (ValueError, zlib.error) as e:
+        print(f"⚠️ 对话消息解析失败: {e}")
+        return None
+    return message if isinstance(message, dict) else None
+
+
+def _parse_legacy(raw: Any) -> List[dict]:
+    if not raw:
+        return []
+    try:
+        data = json.loads(_text(raw))
+    except ValueError as e:
+        print(f"⚠️ 读取对话历史失败: {e}")
+        return []
+    return data if isinstance(data, list) else []
+
+
+# ---------- pipeline 组合（调用方可把历史读写与其他命令合并为一次往返） ----------
+
+def queue_read(pipe: Any, session_id: str, limit: Optional[int] = None) -> None:
+    """把读取最近 limit 条（None 为全部）消息与会话摘要的命令加入 pipeline，占用 3 个结果位，用 parse_read 解析"""
+    pipe.lrange(_key(session_id), -limit if limit else 0, -1)
+    pipe.get(_legacy_key(session_id))
+    pipe.hget(_meta_key(session_id), "summary")
+
+
+def parse_read(results: List[Any], limit: Optional[int] = None) -> List[dict]:
+    """解析 queue_read 对应的 3 个 pipeline 结果：摘要（若有）在前，其后为旧版历史与列表中的消息"""
+    items, legacy_raw, summary = results
+    messages = [m for m in (decode_message(raw) for raw in items or []) if m is not None]
+    if legacy_raw:
+        messages = _parse_legacy(legacy_raw) + messages
+    messages = messages[-limit:] if limit else messages
+    if summary:
+        messages = [{"role": SUMMARY_ROLE, "content": _text(summary)}] + messages
+    return messages
+
+
+def queue_append(
+    pipe: Any,
+    session_id: str,
+    messages: List[dict],
+    ttl: int = DEFAULT_TTL,
+    max_messages: int = DEFAULT_MAX_MESSAGES,
+    compress_min_bytes: int = DEFAULT_COMPRESS_MIN_BYTES,
+) -> None:
+    """把追加消息的 RPUSH / LTRIM / EXPIRE（及元数据中的消息总数）加入 pipeline"""
+    key = _key(session_id)
+    pipe.rpush(key, *(encode_message(m, compress_min_bytes) for m in messages))
+    if max_messages > 0:
+        pipe.ltrim(key, -max_messages, -1)
+    pipe.expire(key, ttl)
+    pipe.hincrby(_meta_key(session_id), "total", len(messages))
+    pipe.expire(_meta_key(session_id), ttl)
+
+
+# ---------- 同步接口 ----------
+
+def get_messages(session_id: str, redis_client: Any, limit: Optional[int] = None) -> List[dict]:
     """
-    从 Redis 读取该会话的历史消息。
+    从 Redis 读取该会话最近 limit 条（None 为全部保留的）历史消息。
     返回 [{"role": "user"|"assistant", "content": "..."}, ...]，按时间顺序。
     """
     if not redis_client:
         return []
     try:
-        raw = redis_client.get(_key(session_id))
-        if not raw:
-            return []
-        data = json.loads(raw)
-        return data if isinstance(data, list) else []
+        pipe = redis_client.pipeline(transaction=False)
+        queue_read(pipe, session_id, limit)
+        return parse_read(pipe.execute(), limit)
     except Exception as e:
         print(f"⚠️ 读取对话历史失败: {e}")
         return []
 
 
-def add_user_message(session_id: str, content: str, redis_client: Any, ttl: int = DEFAULT_TTL) -> None:
+def _append(session_id: str, messages: List[dict], redis_client: Any, ttl: int, **options) -> None:
+    pipe = redis_client.pipeline(transaction=False)
+    queue_append(pipe, session_id, messages, ttl, **options)
+    pipe.execute()
+
+
+def add_user_message(session_id: str, content: str, redis_client: Any, ttl: int = DEFAULT_TTL, **options) -> None:
     """追加一条用户消息并刷新 TTL"""
     if not redis_client:
         return
-    key = _key(session_id)
     try:
-        messages = get_messages(session_id, redis_client)
-        messages.append({"role": "user", "content": content})
-        redis_client.setex(key, ttl, json.dumps(messages, ensure_ascii=False))
+        _append(session_id, [{"role": "user", "content": content}], redis_client, ttl, **options)
     except Exception as e:
         print(f"⚠️ 写入用户消息失败: {e}")
 
 
-def add_ai_message(session_id: str, content: str, redis_client: Any, ttl: int = DEFAULT_TTL) -> None:
+def add_ai_message(session_id: str, content: str, redis_client: Any, ttl: int = DEFAULT_TTL, **options) -> None:
     """追加一条助手消息并刷新 TTL"""
     if not redis_client:
         return
-    key = _key(session_id)
     try:
-        messages = get_messages(session_id, redis_client)
-        messages.append({"role": "assistant", "content": content})
-        redis_client.setex(key, ttl, json.dumps(messages, ensure_ascii=False))
+        _append(session_id, [{"role": "assistant", "content": content}], redis_client, ttl, **options)
     except Exception as e:
         print(f"⚠️ 写入助手消息失败: {e}")
 
 
-def append_turn(session_id: str, user_content: str, ai_content: str, redis_client: Any, ttl: int = DEFAULT_TTL) -> None:
-    """一次性追加一轮对话（用户问 + 助手答），减少两次 Redis 读写"""
+def append_turn(session_id: str, user_content: str, ai_content: str, redis_client: Any, ttl: int = DEFAULT_TTL, **options) -> None:
+    """一次性追加一轮对话（用户问 + 助手答），一次 pipeline 往返"""
     if not redis_client:
         return
-    key = _key(session_id)
     try:
-        messages = get_messages(session_id, redis_client)
-        messages.append({"role": "user", "content": user_content})
-        messages.append({"role": "assistant", "content": ai_content})
-        redis_client.setex(key, ttl, json.dumps(messages, ensure_ascii=False))
+        _append(
+            session_id,
+            [{"role": "user", "content": user_content}, {"role": "assistant", "content": ai_content}],
+            redis_client,
+            ttl,
+            **options,
+        )
     except Exception as e:
         print(f"⚠️ 写入对话轮次失败: {e}")
 
 
 def clear_history(session_id: str, redis_client: Any) -> None:
-    """清空该会话历史"""
+    """清空该会话历史（含旧版存储）"""
     if not redis_client:
         return
     try:
-        redis_client.delete(_key(session_id))
+        redis_client.delete(_key(session_id), _legacy_key(session_id), _meta_key(session_id))
     except Exception as e:
         print(f"⚠️ 清空对话历史失败: {e}")
 
 
-def messages_to_history_list(messages: List[dict], max_turns: int = 6) -> List[dict]:
+# ---------- 异步接口 ----------
+
+async def aget_messages(session_id: str, redis_client: Any, limit: Optional[int] = None) -> List[dict]:
+    """get_messages 的异步版本"""
+    if not redis_client:
+        return []
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            queue_read(pipe, session_id, limit)
+            return parse_read(await pipe.execute(), limit)
+    except Exception as e:
+        print(f"⚠️ 读取对话历史失败: {e}")
+        return []
+
+
+async def aappend_turn(session_id: str, user_content: str, ai_content: str, redis_client: Any, ttl: int = DEFAULT_TTL, **options) -> None:
+    """append_turn 的异步版本"""
+    if not redis_client:
+        return
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            queue_append(
+                pipe,
+                session_id,
+                [{"role": "user", "content": user_content}, {"role": "assistant", "content": ai_content}],
+                ttl,
+                **options,
+            )
+            await pipe.execute()
+    except Exception as e:
+        print(f"⚠️ 写入对话轮次失败: {e}")
+
+
+async def aclear_history(session_id: str, redis_client: Any) -> None:
+    """clear_history 的异步版本"""
+    if not redis_client:
+        return
+    try:
+        await redis_client.delete(_key(session_id), _legacy_key(session_id), _meta_key(session_id))
+    except Exception as e:
+        print(f"⚠️ 清空对话历史失败: {e}")
+
+
+# ---------- 滚动摘要 ----------
+
+def _build_summary_prompt(summary: str, messages: List[dict], max_chars: int) -> str:
+    lines = [
+        f"{'用户' if m.get('role') == 'user' else '助手'}：{(m.get('content') or '').strip()}"
+        for m in messages
+        if (m.get("content") or "").strip()
+    ]
+    return f"""你是医疗问诊对话的记录员。请把「已有摘要」与「新增对话」合并为一段新的对话摘要。
+
+要求：
+1. 保留用户的症状、部位、持续时间、严重程度、既往病史、用药与过敏情况，以及助手已给出的主要建议和仍待确认的信息；
+2. 去掉寒暄、重复内容和建议中的展开解释；
+3. 不超过 {max_chars} 字，只输出摘要正文。
+
+已有摘要：
+{summary or "（无）"}
+
+新增对话：
+{chr(10).join(lines)}
+
+新的对话摘要："""
+
+
+async def aupdate_summary(
+    session_id: str,
+    redis_client: Any,
+    llm: Any,
+    recent_messages: int = 6,
+    ttl: int = DEFAULT_TTL,
+    max_chars: int = 400,
+    lock_ttl: int = 60,
+) -> bool:
+    """
+    把已滑出最近 recent_messages 条窗口、尚未摘要的消息增量合并进会话摘要（后台调用）。
+    同一会话同时只有一个更新在执行（SET NX 锁），未抢到锁时跳过，由下一轮追加后补上。返回是否更新了摘要。
+    """
+    if not redis_client:
+        return False
+    lock_key = f"{CHAT_SUMMARY_LOCK_PREFIX}{session_id}"
+    try:
+        if not await redis_client.set(lock_key, "1", nx=True, ex=lock_ttl):
+            return False
+    except Exception as e:
+        print(f"⚠️ 对话摘要更新失败: {e}")
+        return False
+    try:
+        # 元数据与整段列表在同一事务中读取，保证消息序号与列表下标对应
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.hmget(_meta_key(session_id), "total", "covered", "summary")
+            pipe.lrange(_key(session_id), 0, -1)
+            (total, covered, summary), items = await pipe.execute()
+        total, covered = int(total or 0), int(covered or 0)
+        end = total - recent_messages  # 序号小于 end 的消息应已进入摘要
+        if end - covered < 2:
+            return False
+        first_seq = total - len(items)  # 列表首元素的序号（更早的已被 LTRIM 截掉）
+        start = max(covered, first_seq)
+        new_messages = [m for m in (decode_message(raw) for raw in items[start - first_seq:end - first_seq]) if m is not None]
+        if new_messages:
+            response = await llm.ainvoke(_build_summary_prompt(_text(summary) if summary else "", new_messages, max_chars))
+            summary = (response.content or "").strip()[:max_chars]
+            if not summary:
+                return False
+        async with redis_client.pipeline(transaction=False) as pipe:
+            mapping = {"covered": end}
+            if summary:
+                mapping["summary"] = _text(summary)
+            pipe.hset(_meta_key(session_id), mapping=mapping)
+            pipe.expire(_meta_key(session_id), ttl)
+            await pipe.execute()
+        print(f"📝 会话 {session_id} 摘要已更新（覆盖 {end} 条消息）")
+        return True
+    except Exception as e:
+        print(f"⚠️ 对话摘要更新失败: {e}")
+        return False
+    finally:
+        try:
+            await redis_client.delete(lock_key)
+        except Exception:
+            pass
+
+
+def messages_to_history_list(messages: List[dict], max_turns: int = 6, max_chars: Optional[int] = None) -> List[dict]:
     """
-    将 Redis 中的 messages 转为 query_optimizer / build_prompt 使用的「最近 N 条」列表。
-    每条为 {"role": "user"|"assistant", "content": "..."}。
+    将 Redis 中的 messages 转为 query_optimizer / build_prompt 使用的「摘要 + 最近 N 条」列表。
+    每条为 {"role": "user"|"assistant"|"summary", "content": "..."}；max_chars 给定时截断过长的单条消息。
     """
     if not messages:
         return []
+    summary = [m for m in messages if m.get("role") == SUMMARY_ROLE][-1:]
+    dialog = [m for m in messages if m.get("role") != SUMMARY_ROLE]
     # 取最近 max_turns 条（按条数，不是按轮数）
-    recent = messages[-max_turns:] if len(messages) > max_turns else messages
-    return recent
+    recent = dialog[-max_turns:] if len(dialog) > max_turns else dialog
+    if max_chars:
+        recent = [
+            {**m, "content": m["content"][:max_chars] + "…"} if len(m.get("content") or "") > max_chars else m
+            for m in recent
+        ]
+    return summary + recent
@@ -8,6 +8,14 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# 项目根目录（rag/）：相对路径的数据文件按此解析，与启动时的工作目录无关
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def resolve_path(path: str) -> str:
+    """相对路径按项目根目录解析为绝对路径，绝对路径原样返回"""
+    return path if os.path.isabs(path) else os.path.join(PROJECT_ROOT, path)
+
 
 class Settings(BaseSettings):
     """应用配置"""
@@ -22,6 +30,20 @@ class Settings(BaseSettings):
     milvus_host: str = os.getenv("MILVUS_HOST", "localhost")
     milvus_port: int = int(os.getenv("MILVUS_PORT", "19530"))
     milvus_collection_name: str = os.getenv("MILVUS_COLLECTION_NAME", "medical_knowledge")
+    # Milvus 向量索引：类型 FLAT / IVF_FLAT / IVF_SQ8 / IVF_PQ / HNSW，度量 L2 / IP / COSINE
+    # 建索引 / 搜索参数为 JSON（如 '{"nlist": 1024}'、'{"nprobe": 16}'），留空按索引类型取默认值；
+    # 索引类型与建索引参数在新建 collection 时生效，可用 tune_milvus_index.py 压测选择
+    milvus_index_type: str = os.getenv("MILVUS_INDEX_TYPE", "IVF_FLAT").upper()
+    milvus_metric_type: str = os.getenv("MILVUS_METRIC_TYPE", "L2").upper()
+    milvus_index_params: str = os.getenv("MILVUS_INDEX_PARAMS", "")
+    milvus_search_params: str = os.getenv("MILVUS_SEARCH_PARAMS", "")
+    # 病症库以 category_primary 作为 partition key（按分类过滤时只搜索对应分区），新建 collection 时生效
+    milvus_category_partition_key: bool = os.getenv("MILVUS_CATEGORY_PARTITION_KEY", "true").lower() in ("1", "true", "yes")
+    milvus_num_partitions: int = int(os.getenv("MILVUS_NUM_PARTITIONS", "64"))
+    # 科室过滤下推为按元素匹配的 like 表达式（需 Milvus 2.3+）；默认不下推，检索时多取 OVERFETCH 倍再精确后过滤，
+    # 过滤后不足 top_k 时按同一倍数扩大 limit 重试
+    milvus_department_pushdown: bool = os.getenv("MILVUS_DEPARTMENT_PUSHDOWN", "false").lower() in ("1", "true", "yes")
+    milvus_filter_overfetch: int = int(os.getenv("MILVUS_FILTER_OVERFETCH", "4"))
     
     # Redis配置
     redis_host: str = os.getenv("REDIS_HOST", "localhost")
@@ -32,17 +54,102 @@ class Settings(BaseSettings):
     bing_search_api_key: str = os.getenv("BING_SEARCH_API_KEY", "")
     bing_search_endpoint: str = os.getenv("BING_SEARCH_ENDPOINT", "https://api.bing.microsoft.com/v7.0/search")
     
+    # 向量检索后端：milvus / flat（进程内精确检索，mmap 向量矩阵）/ hnsw（进程内 HNSW，需 hnswlib）
+    # flat / hnsw 从 Milvus（或无 Milvus 时由知识库构建流程写出的）快照加载，可完全不依赖 Milvus 运行
+    vector_backend: str = os.getenv("VECTOR_BACKEND", "milvus").lower()
+    vector_index_dir: str = os.getenv("VECTOR_INDEX_DIR", "data/vector_index")
+    hnsw_m: int = int(os.getenv("HNSW_M", "16"))
+    hnsw_ef_construction: int = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+    hnsw_ef_search: int = int(os.getenv("HNSW_EF_SEARCH", "64"))
+    
     # 检索配置
     top_k_retrieval: int = int(os.getenv("TOP_K_RETRIEVAL", "10"))
     top_k_rerank: int = int(os.getenv("TOP_K_RERANK", "3"))
     similarity_threshold: float = float(os.getenv("SIMILARITY_THRESHOLD", "0.7"))
+    # 多路召回并行：每路召回的超时（秒，超时路径降级为其他路径结果）与线程池大小
+    retrieval_path_timeout: float = float(os.getenv("RETRIEVAL_PATH_TIMEOUT", "3.0"))
+    retrieval_max_workers: int = int(os.getenv("RETRIEVAL_MAX_WORKERS", "16"))
+    # 批量检索接口单次最多查询条数
+    retrieve_batch_max_queries: int = int(os.getenv("RETRIEVE_BATCH_MAX_QUERIES", "256"))
+    # 跨请求微批处理：并发请求的查询向量化 / 向量搜索在窗口内（毫秒）攒批，满 MICRO_BATCH_MAX_SIZE 条立即发出
+    enable_micro_batching: bool = os.getenv("ENABLE_MICRO_BATCHING", "true").lower() in ("1", "true", "yes")
+    micro_batch_max_size: int = int(os.getenv("MICRO_BATCH_MAX_SIZE", "32"))
+    micro_batch_wait_ms: float = float(os.getenv("MICRO_BATCH_WAIT_MS", "5"))
+
+    # BM25 快照（分词语料 + 词项统计 + 文档库落盘，worker 启动时 mmap 加载，collection 变化时才重建）
+    enable_bm25_snapshot: bool = os.getenv("ENABLE_BM25_SNAPSHOT", "true").lower() in ("1", "true", "yes")
+    bm25_snapshot_dir: str = os.getenv("BM25_SNAPSHOT_DIR", "data/bm25_snapshot")
+    # 关键词检索后端：maxscore（倒排表精确 Top-K）/ sparse（SciPy 稀疏矩阵向量化打分，支持批量查询）
+    keyword_search_backend: str = os.getenv("KEYWORD_SEARCH_BACKEND", "maxscore").lower()
+
+    # 多路召回融合：none（内容去重后直接交给 LLM 重排）/ rrf（加权倒数排名融合）/ linear（分数归一化加权）
+    fusion_method: str = os.getenv("FUSION_METHOD", "none").lower()
+    rrf_k: int = int(os.getenv("RRF_K", "60"))
+    fusion_weight_vector: float = float(os.getenv("FUSION_WEIGHT_VECTOR", "1.0"))
+    fusion_weight_keyword: float = float(os.getenv("FUSION_WEIGHT_KEYWORD", "1.0"))
+    fusion_weight_rule: float = float(os.getenv("FUSION_WEIGHT_RULE", "0.5"))
+    # 重排方式：llm（chat completion 输出序号）/ learned（进程内逻辑回归，无网络调用）/ none（直接取融合 Top-K）
+    rerank_method: str = os.getenv("RERANK_METHOD", "llm").lower()
+    learned_reranker_path: str = os.getenv("LEARNED_RERANKER_PATH", "data/reranker_weights.json")
+
+    # 查询向量缓存（进程内 LRU + Redis 两级，key 为 embedding 模型 + 规范化查询的摘要）
+    enable_embedding_cache: bool = os.getenv("ENABLE_EMBEDDING_CACHE", "true").lower() in ("1", "true", "yes")
+    embedding_cache_max_items: int = int(os.getenv("EMBEDDING_CACHE_MAX_ITEMS", "10000"))
+    embedding_cache_max_mb: int = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "64"))
+    embedding_cache_ttl: int = int(os.getenv("EMBEDDING_CACHE_TTL", "604800"))  # 秒，默认 7 天
+
+    # 问诊响应缓存：Redis 一级之前再加进程内 LRU（热点回答不走网络、不重复解析）；知识库变更时经 pub/sub 失效
+    response_cache_ttl: int = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # 秒
+    response_cache_local_max_items: int = int(os.getenv("RESPONSE_CACHE_LOCAL_MAX_ITEMS", "1000"))
+    response_cache_local_max_mb: int = int(os.getenv("RESPONSE_CACHE_LOCAL_MAX_MB", "32"))
+    response_cache_local_ttl: int = int(os.getenv("RESPONSE_CACHE_LOCAL_TTL", "300"))  # 秒，订阅断开时旧条目最长存活时间
+
+    # 检索结果缓存（进程内 LRU + Redis 两级，跨用户共享；key 含检索配置与知识库版本，知识库更新后自动失效）
+    enable_retrieval_cache: bool = os.getenv("ENABLE_RETRIEVAL_CACHE", "true").lower() in ("1", "true", "yes")
+    retrieval_cache_max_items: int = int(os.getenv("RETRIEVAL_CACHE_MAX_ITEMS", "2000"))
+    retrieval_cache_ttl: int = int(os.getenv("RETRIEVAL_CACHE_TTL", "3600"))  # 秒
+    # 各 worker 重新读取知识库版本计数器的间隔（秒），即其他 worker 更新知识库后旧结果最多再命中的时长
+    retrieval_cache_version_check_interval: float = float(os.getenv("RETRIEVAL_CACHE_VERSION_CHECK_INTERVAL", "1.0"))
+
+    # 语义答案缓存：无历史对话的问题按 embedding 余弦相似度复用近义问题的回答（不调用 LLM）
+    # off（关闭）/ shadow（只记录「本会命中」的相似度，用于调阈值）/ on（命中时直接返回缓存回答）
+    semantic_cache_mode: str = os.getenv("SEMANTIC_CACHE_MODE", "off").lower()
+    semantic_cache_threshold: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+    semantic_cache_max_items: int = int(os.getenv("SEMANTIC_CACHE_MAX_ITEMS", "5000"))
+    semantic_cache_ttl: int = int(os.getenv("SEMANTIC_CACHE_TTL", "86400"))  # 秒
 
     # 提问优化（Query Rewriting + 关键词规范化，仅用于检索，回答与缓存仍用原问题）
     enable_query_rewrite: bool = os.getenv("ENABLE_QUERY_REWRITE", "true").lower() in ("1", "true", "yes")
     enable_query_normalize: bool = os.getenv("ENABLE_QUERY_NORMALIZE", "true").lower() in ("1", "true", "yes")
+    # 同义词规范化的生成词表（python build_synonyms.py 从 medical.txt 挖掘），不存在时只用内置词表
+    medical_synonyms_path: str = os.getenv("MEDICAL_SYNONYMS_PATH", "data/medical_synonyms.json")
+    # 自适应改写：只有含指代 / 省略式追问（有历史时）或较长的口语描述才调用 LLM 改写；false 时每次都改写
+    query_rewrite_adaptive: bool = os.getenv("QUERY_REWRITE_ADAPTIVE", "true").lower() in ("1", "true", "yes")
+    query_rewrite_short_chars: int = int(os.getenv("QUERY_REWRITE_SHORT_CHARS", "8"))  # 有历史时不超过该字数视为追问
+    query_rewrite_long_chars: int = int(os.getenv("QUERY_REWRITE_LONG_CHARS", "40"))  # 达到该字数的问题总是改写
+    # 推测式检索：需要 LLM 改写时，改写与「规范化原问题」的检索并发；改写与原问题相似度 ≥ KEEP_SIMILARITY 时直接采用推测结果，
+    # 否则再用改写检索并与推测结果合并（推测结果权重 MERGE_WEIGHT）
+    enable_speculative_retrieval: bool = os.getenv("ENABLE_SPECULATIVE_RETRIEVAL", "true").lower() in ("1", "true", "yes")
+    speculative_keep_similarity: float = float(os.getenv("SPECULATIVE_KEEP_SIMILARITY", "0.8"))
+    speculative_merge_weight: float = float(os.getenv("SPECULATIVE_MERGE_WEIGHT", "0.5"))
+    # 改写缓存（进程内 LRU + Redis，key 为规范化问题 + 对话历史摘要）
+    rewrite_cache_max_items: int = int(os.getenv("REWRITE_CACHE_MAX_ITEMS", "5000"))
+    rewrite_cache_ttl: int = int(os.getenv("REWRITE_CACHE_TTL", "86400"))  # 秒
+
+    # 服务端异步 Redis 客户端（响应缓存 + 对话历史）共享连接池：连接数上限与取连接的最长等待（秒）
+    redis_max_connections: int = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+    redis_pool_timeout: float = float(os.getenv("REDIS_POOL_TIMEOUT", "5.0"))
 
     # 对话历史（Redis 存储，按 session_id 读写）
     chat_history_ttl: int = int(os.getenv("CHAT_HISTORY_TTL", "86400"))  # 秒，默认 24 小时
+    # 每个会话最多保留的消息条数（Redis 列表 LTRIM），以及超过该字节数的单条消息压缩存储（0 为不压缩）
+    chat_history_max_messages: int = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "50"))
+    chat_history_compress_min_bytes: int = int(os.getenv("CHAT_HISTORY_COMPRESS_MIN_BYTES", "1024"))
+    # 提示词 / 改写只带最近 N 条原文（单条超过 MAX_CHARS 截断），更早的对话由后台滚动摘要覆盖
+    chat_history_recent_messages: int = int(os.getenv("CHAT_HISTORY_RECENT_MESSAGES", "6"))
+    chat_history_message_max_chars: int = int(os.getenv("CHAT_HISTORY_MESSAGE_MAX_CHARS", "500"))
+    enable_history_summary: bool = os.getenv("ENABLE_HISTORY_SUMMARY", "true").lower() in ("1", "true", "yes")
+    chat_summary_max_chars: int = int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "400"))
     
     # 向量维度
     embedding_dim: int = 1536  # text-embedding-ada-002的维度
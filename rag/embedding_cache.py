@@ -0,0 +1,170 @@
+"""
+查询向量缓存：进程内 LRU + Redis 共享两级缓存，挡在 embed_query 前面。
+- key：embedding 模型名 + 规范化后查询文本的稳定摘要（模型切换后旧向量自动失效）
+- 值：float32 小端字节（1536 维约 6KB），比 JSON 浮点列表小约 3 倍
+- Redis 不可用时退化为仅进程内缓存，不影响检索
+"""
+import asyncio
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from caching import LRUCache, normalize_query, stable_digest
+
+EMBEDDING_CACHE_KEY_PREFIX = "emb:"
+
+
+def _encode(vector: List[float]) -> bytes:
+    return np.asarray(vector, dtype="<f4").tobytes()
+
+
+def _decode(raw: bytes) -> List[float]:
+    return np.frombuffer(raw, dtype="<f4").tolist()
+
+
+class EmbeddingCache:
+    """两级查询向量缓存，统计各级命中/未命中次数"""
+
+    def __init__(
+        self,
+        model: str,
+        redis_client: Any = None,
+        max_items: int = 10000,
+        max_bytes: Optional[int] = 64 * 1024 * 1024,
+        ttl: int = 7 * 86400,
+    ):
+        self.model = model
+        self.ttl = ttl
+        # 进程内缓存同样保存 float32 字节，按实际字节数计入上限
+        self.local = LRUCache(max_items=max_items, max_bytes=max_bytes, ttl=ttl, sizeof=len)
+        # 需使用 decode_responses=False 的客户端，否则二进制向量会被按 UTF-8 解码
+        self.redis = redis_client
+        self.redis_hits = 0
+        self.redis_misses = 0
+
+    def key(self, query: str) -> str:
+        return f"{EMBEDDING_CACHE_KEY_PREFIX}{stable_digest(self.model, normalize_query(query))}"
+
+    def get(self, query: str) -> Optional[List[float]]:
+        key = self.key(query)
+        raw = self.local.get(key)
+        if raw is None and self.redis is not None:
+            try:
+                raw = self.redis.get(key)
+            except Exception as e:
+                print(f"⚠️  向量缓存读取失败: {e}")
+                raw = None
+            if raw is None:
+                self.redis_misses += 1
+            else:
+                self.redis_hits += 1
+                self.local.set(key, raw)
+        return _decode(raw) if raw is not None else None
+
+    def set(self, query: str, vector: List[float]) -> None:
+        key = self.key(query)
+        raw = _encode(vector)
+        self.local.set(key, raw)
+        if self.redis is not None:
+            try:
+                self.redis.setex(key, self.ttl, raw)
+            except Exception as e:
+                print(f"⚠️  向量缓存写入失败: {e}")
+
+    def get_many(self, queries: List[str]) -> List[Optional[List[float]]]:
+        """批量读取：进程内未命中的 key 用一次 Redis MGET 取回"""
+        keys = [self.key(q) for q in queries]
+        raws = [self.local.get(key) for key in keys]
+        missing = [i for i, raw in enumerate(raws) if raw is None]
+        if missing and self.redis is not None:
+            try:
+                fetched = self.redis.mget([keys[i] for i in missing])
+            except Exception as e:
+                print(f"⚠️  向量缓存读取失败: {e}")
+                fetched = [None] * len(missing)
+            for i, raw in zip(missing, fetched):
+                if raw is None:
+                    self.redis_misses += 1
+                else:
+                    self.redis_hits += 1
+                    self.local.set(keys[i], raw)
+                    raws[i] = raw
+        return [_decode(raw) if raw is not None else None for raw in raws]
+
+    def set_many(self, queries: List[str], vectors: List[List[float]]) -> None:
+        """批量回填：Redis 写入走一次 pipeline"""
+        items = [(self.key(q), _encode(v)) for q, v in zip(queries, vectors)]
+        for key, raw in items:
+            self.local.set(key, raw)
+        if self.redis is not None and items:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for key, raw in items:
+                    pipe.setex(key, self.ttl, raw)
+                pipe.execute()
+            except Exception as e:
+                print(f"⚠️  向量缓存写入失败: {e}")
+
+    def _pending(self, queries: List[str], vectors: List[Optional[List[float]]]) -> Dict[str, List[int]]:
+        """未命中的查询按缓存 key 去重：{规范化查询: [在 queries 中的下标]}"""
+        pending: Dict[str, List[int]] = {}
+        for i, (query, vector) in enumerate(zip(queries, vectors)):
+            if vector is None:
+                pending.setdefault(normalize_query(query), []).append(i)
+        return pending
+
+    def embed_many(self, queries: List[str], embed_batch_fn: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """批量向量化：命中缓存的直接返回，未命中的（去重后）一次 embed_batch_fn 调用并回填"""
+        vectors = self.get_many(queries)
+        pending = self._pending(queries, vectors)
+        if pending:
+            texts = list(pending)
+            embedded = embed_batch_fn(texts)
+            for text, vector in zip(texts, embedded):
+                for i in pending[text]:
+                    vectors[i] = vector
+            self.set_many(texts, embedded)
+        return vectors
+
+    async def aembed_many(self, queries: List[str], aembed_batch_fn: Callable[[List[str]], Any]) -> List[List[float]]:
+        """embed_many 的异步版本"""
+        vectors = await asyncio.to_thread(self.get_many, queries)
+        pending = self._pending(queries, vectors)
+        if pending:
+            texts = list(pending)
+            embedded = await aembed_batch_fn(texts)
+            for text, vector in zip(texts, embedded):
+                for i in pending[text]:
+                    vectors[i] = vector
+            await asyncio.to_thread(self.set_many, texts, embedded)
+        return vectors
+
+    def embed(self, query: str, embed_fn: Callable[[str], List[float]]) -> List[float]:
+        """命中缓存直接返回，否则调用 embed_fn 并回填两级缓存"""
+        vector = self.get(query)
+        if vector is None:
+            vector = embed_fn(query)
+            self.set(query, vector)
+        return vector
+
+    async def aembed(self, query: str, aembed_fn: Callable[[str], Any]) -> List[float]:
+        """embed 的异步版本：Redis 读写放到线程中，embedding 调用 await aembed_fn"""
+        vector = await asyncio.to_thread(self.get, query)
+        if vector is None:
+            vector = await aembed_fn(query)
+            await asyncio.to_thread(self.set, query, vector)
+        return vector
+
+    def stats(self) -> Dict[str, Any]:
+        local = self.local.stats()
+        redis_total = self.redis_hits + self.redis_misses
+        return {
+            "model": self.model,
+            "local": local,
+            "redis": {
+                "enabled": self.redis is not None,
+                "hits": self.redis_hits,
+                "misses": self.redis_misses,
+                "hit_rate": self.redis_hits / redis_total if redis_total else 0.0,
+            },
+        }
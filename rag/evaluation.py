@@ -4,10 +4,12 @@ RAG 评估脚本：使用 RAGAS 对医疗问答 RAG 系统进行自动化评估
 用法：
   cd rag && python evaluation.py
   python evaluation.py --data data/eval_questions.json --output results/eval_result.json
+  python evaluation.py --benchmark-fusion   # 对比 LLM 重排与 RRF / 线性融合的 Top-3 命中率与耗时（不跑 RAGAS）
 """
 import json
 import argparse
 import sys
+import time
 from pathlib import Path
 
 # 确保项目根在 path 中
@@ -38,10 +40,12 @@ _patch_pydantic_output_parser()
 from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings  # Embeddings 供 RAGAS 指标使用
 
-from config import settings
+from config import settings, resolve_path
 from retriever import MultiPathRetriever
 from query_optimizer import optimize as optimize_query
 from models import KnowledgeSource
+from fusion import fuse
+from learned_reranker import LearnedReranker, is_relevant
 
 
 def build_prompt_for_eval(question: str, knowledge_sources: list) -> tuple:
@@ -62,16 +66,19 @@ def build_prompt_for_eval(question: str, knowledge_sources: list) -> tuple:
     return system_prompt, user_prompt
 
 
-def run_rag_pipeline(question: str, retriever: MultiPathRetriever, llm: ChatOpenAI) -> tuple:
-    """对单条问题跑一遍 RAG：检索 + 生成，返回 (answer, contexts)。评估时不走 MCP 兜底以保持可复现。"""
-    history = []
-    retrieval_query = optimize_query(
+def optimize_for_eval(question: str) -> str:
+    """评估用的检索查询（无对话历史）"""
+    return optimize_query(
         question,
-        history=history,
+        history=[],
         enable_rewrite=settings.enable_query_rewrite,
         enable_normalize=settings.enable_query_normalize,
+        adaptive_rewrite=settings.query_rewrite_adaptive,
     )
-    knowledge_sources = retriever.retrieve(retrieval_query)
+
+
+def generate_answer(question: str, knowledge_sources: list, llm: ChatOpenAI) -> tuple:
+    """基于检索结果生成回答，返回 (answer, contexts)"""
     contexts = [getattr(s, "content", "") or "" for s in knowledge_sources]
     if not contexts:
         contexts = [""]
@@ -81,6 +88,12 @@ def run_rag_pipeline(question: str, retriever: MultiPathRetriever, llm: ChatOpen
     return answer, contexts
 
 
+def run_rag_pipeline(question: str, retriever: MultiPathRetriever, llm: ChatOpenAI) -> tuple:
+    """对单条问题跑一遍 RAG：检索 + 生成，返回 (answer, contexts)。评估时不走 MCP 兜底以保持可复现。"""
+    knowledge_sources = retriever.retrieve(optimize_for_eval(question))
+    return generate_answer(question, knowledge_sources, llm)
+
+
 def load_eval_data(path: str) -> list:
     """加载评估数据：每项需包含 question，可选 ground_truth。"""
     path = Path(path)
@@ -94,16 +107,22 @@ def load_eval_data(path: str) -> list:
 
 
 def collect_rag_samples(eval_data: list, retriever: MultiPathRetriever, llm: ChatOpenAI) -> list:
-    """对每条评估问题跑 RAG，收集 RAGAS 所需的样本（user_input, retrieved_contexts, response, reference）。"""
+    """
+    对每条评估问题跑 RAG，收集 RAGAS 所需的样本（user_input, retrieved_contexts, response, reference）。
+    检索阶段整批执行（retrieve_batch：一次 embedding 请求 + 一次多向量搜索），再逐条生成回答。
+    """
+    items = [item for item in eval_data if (item.get("question") or "").strip()]
+    questions = [item["question"].strip() for item in items]
+    print(f"  批量检索 {len(questions)} 条问题...")
+    retrieval_queries = [optimize_for_eval(question) for question in questions]
+    batch_sources = retriever.retrieve_batch(retrieval_queries)
+
     samples = []
-    for i, item in enumerate(eval_data):
-        question = (item.get("question") or "").strip()
-        if not question:
-            continue
+    for i, (item, question, knowledge_sources) in enumerate(zip(items, questions, batch_sources)):
         ground_truth = (item.get("ground_truth") or "").strip() or None
-        print(f"  [{i+1}/{len(eval_data)}] 运行 RAG: {question[:50]}...")
+        print(f"  [{i+1}/{len(items)}] 生成回答: {question[:50]}...")
         try:
-            answer, contexts = run_rag_pipeline(question, retriever, llm)
+            answer, contexts = generate_answer(question, knowledge_sources, llm)
         except Exception as e:
             print(f"    ⚠️ 失败: {e}")
             answer, contexts = "", [""]
@@ -204,10 +223,79 @@ def run_ragas_evaluation(samples: list, output_path: str = None) -> dict:
     return summary
 
 
+# 融合基准对比的策略：(名称, 融合方式, 重排方式)
+FUSION_BENCHMARK_STRATEGIES = [
+    ("llm_rerank", "none", "llm"),
+    ("rrf", "rrf", "none"),
+    ("linear", "linear", "none"),
+    ("rrf+llm_rerank", "rrf", "llm"),
+    ("rrf+learned", "rrf", "learned"),
+]
+
+
+def _is_hit(item: dict, sources: list) -> bool:
+    """Top-K 命中判定：任一结果被标注为相关（见 learned_reranker.is_relevant）"""
+    return any(is_relevant(item, s) for s in sources)
+
+
+def benchmark_fusion(eval_data: list, retriever: MultiPathRetriever, top_k: int = 3, output_path: str = None) -> dict:
+    """
+    每条问题只做一次多路召回，再分别用各策略产出 Top-K，统计命中率与「融合 + 重排」阶段耗时。
+    """
+    stats = {name: {"hits": 0, "latency_ms": []} for name, _, _ in FUSION_BENCHMARK_STRATEGIES}
+    weights = retriever._fusion_weights()
+    learned_reranker = retriever.learned_reranker or LearnedReranker.load(resolve_path(settings.learned_reranker_path))
+    questions = [item for item in eval_data if (item.get("question") or "").strip()]
+    retrieval_queries = [optimize_for_eval(item["question"].strip()) for item in questions]
+    # 整批召回一次，各策略共用召回结果
+    batch_results = retriever.recall_paths_batch(retrieval_queries)
+    for i, (item, retrieval_query, results) in enumerate(zip(questions, retrieval_queries, batch_results)):
+        print(f"  [{i+1}/{len(questions)}] {item['question'].strip()[:50]}...")
+        for name, method, rerank_method in FUSION_BENCHMARK_STRATEGIES:
+            start = time.perf_counter()
+            if method == "none":
+                seen, candidates = set(), []
+                for source in results["vector"] + results["keyword"] + results["rule"]:
+                    if source.content not in seen:
+                        seen.add(source.content)
+                        candidates.append(source)
+            else:
+                candidates = fuse(method, results, weights=weights, rrf_k=settings.rrf_k)[:settings.top_k_retrieval]
+            if rerank_method == "llm" and len(candidates) > top_k:
+                final = retriever.rerank(retrieval_query, candidates, top_k)
+            elif rerank_method == "learned":
+                final = learned_reranker.rerank(retrieval_query, candidates, top_k)
+            else:
+                final = candidates[:top_k]
+            stats[name]["latency_ms"].append((time.perf_counter() - start) * 1000)
+            stats[name]["hits"] += int(_is_hit(item, final))
+
+    summary = {}
+    for name, row in stats.items():
+        latencies = sorted(row["latency_ms"]) or [0.0]
+        summary[name] = {
+            f"top{top_k}_hit_rate": row["hits"] / max(1, len(questions)),
+            "latency_ms_mean": sum(latencies) / len(latencies),
+            "latency_ms_p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        }
+
+    print(f"\n========== 融合 / 重排对比（Top-{top_k}，{len(questions)} 条问题） ==========")
+    print(f"{'策略':<18} {'命中率':>8} {'平均耗时ms':>12} {'P95耗时ms':>12}")
+    for name, row in summary.items():
+        print(f"{name:<18} {row[f'top{top_k}_hit_rate']:>8.2%} {row['latency_ms_mean']:>12.1f} {row['latency_ms_p95']:>12.1f}")
+    if output_path:
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump({"fusion_benchmark": summary}, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入: {output_path}")
+    return summary
+
+
 def main():
     parser = argparse.ArgumentParser(description="RAG 医疗问答系统 RAGAS 评估")
     parser.add_argument("--data", default="data/eval_questions.json", help="评估问题 JSON 路径")
     parser.add_argument("--output", default="", help="评估结果输出 JSON 路径（不填则只打印）")
+    parser.add_argument("--benchmark-fusion", action="store_true", help="对比 LLM 重排、学习型重排与 RRF / 线性融合的 Top-3 命中率与耗时")
     args = parser.parse_args()
 
     data_path = Path(args.data)
@@ -223,6 +311,9 @@ def main():
 
     print("初始化检索器与 LLM...")
     retriever = MultiPathRetriever()
+    if args.benchmark_fusion:
+        benchmark_fusion(eval_data, retriever, top_k=3, output_path=output_path or None)
+        return
     llm = ChatOpenAI(
         openai_api_key=settings.openai_api_key,
         openai_api_base=settings.openai_api_base,
@@ -0,0 +1,120 @@
+"""
+多路召回融合模块
+按排名/分数融合向量、关键词、规则各路召回结果，可替代（或前置于）LLM 重排：
+- rrf：加权倒数排名融合 score(d) = Σ w_path / (k + rank_path(d))，只看排名，不受各路分数量纲影响
+- linear：各路分数 min-max 归一化到 [0, 1] 后加权求和
+同一文档在多路中出现时按文档 id（无 id 时按内容）合并。
+融合分写入 metadata["fusion_score"]（各路排名 / 原始分数见 fusion_ranks / fusion_path_scores），不覆盖原始 score（MCP 兜底等下游逻辑仍按原始相似度判断）。
+"""
+from typing import Dict, List, Optional
+
+from models import KnowledgeSource
+
+FUSION_METHODS = ("none", "rrf", "linear")
+DEFAULT_RRF_K = 60
+
+
+def doc_key(source: KnowledgeSource):
+    """合并 / 去重用的文档标识：有 id 按 id，否则按内容"""
+    doc_id = (source.metadata or {}).get("id")
+    return ("id", doc_id) if doc_id is not None else ("content", source.content)
+
+
+def _path_scores(results: Dict[str, List[KnowledgeSource]]) -> Dict[tuple, Dict[str, float]]:
+    """每个文档在各路中的原始分数（同一路重复出现时取首次），供学习型重排提取特征"""
+    path_scores: Dict[tuple, Dict[str, float]] = {}
+    for path, sources in results.items():
+        for source in sources:
+            path_scores.setdefault(doc_key(source), {}).setdefault(path, float(source.score or 0.0))
+    return path_scores
+
+
+def _fuse(
+    scored: Dict[tuple, float],
+    first_seen: Dict[tuple, KnowledgeSource],
+    ranks: Dict[tuple, Dict[str, int]],
+    results: Dict[str, List[KnowledgeSource]],
+) -> List[KnowledgeSource]:
+    ordered = sorted(scored, key=lambda key: scored[key], reverse=True)
+    path_scores = _path_scores(results)
+    fused = []
+    for key in ordered:
+        source = first_seen[key]
+        metadata = dict(source.metadata or {})
+        metadata["fusion_score"] = scored[key]
+        metadata["fusion_ranks"] = ranks[key]
+        metadata["fusion_path_scores"] = path_scores[key]
+        fused.append(source.model_copy(update={"metadata": metadata}))
+    return fused
+
+
+def reciprocal_rank_fusion(
+    results: Dict[str, List[KnowledgeSource]],
+    weights: Optional[Dict[str, float]] = None,
+    k: int = DEFAULT_RRF_K,
+) -> List[KnowledgeSource]:
+    """
+    加权 RRF。results 为 {路径名: 按相关性降序的结果}，weights 缺省为各路 1.0。
+    返回按融合分降序的去重结果；保留文档首次出现时的 KnowledgeSource（路径顺序即 results 的顺序）。
+    """
+    weights = weights or {}
+    scored: Dict[tuple, float] = {}
+    first_seen: Dict[tuple, KnowledgeSource] = {}
+    ranks: Dict[tuple, Dict[str, int]] = {}
+    for path, sources in results.items():
+        weight = weights.get(path, 1.0)
+        seen_in_path = set()
+        for rank, source in enumerate(sources, 1):
+            key = doc_key(source)
+            if key in seen_in_path:
+                continue
+            seen_in_path.add(key)
+            first_seen.setdefault(key, source)
+            ranks.setdefault(key, {})[path] = rank
+            scored[key] = scored.get(key, 0.0) + weight / (k + rank)
+    return _fuse(scored, first_seen, ranks, results)
+
+
+def linear_fusion(
+    results: Dict[str, List[KnowledgeSource]],
+    weights: Optional[Dict[str, float]] = None,
+) -> List[KnowledgeSource]:
+    """
+    分数归一化线性融合：每路分数 min-max 归一化后加权求和（某路分数全相同时该路各结果记 1.0）。
+    """
+    weights = weights or {}
+    scored: Dict[tuple, float] = {}
+    first_seen: Dict[tuple, KnowledgeSource] = {}
+    ranks: Dict[tuple, Dict[str, int]] = {}
+    for path, sources in results.items():
+        if not sources:
+            continue
+        weight = weights.get(path, 1.0)
+        path_scores = [source.score or 0.0 for source in sources]
+        low, high = min(path_scores), max(path_scores)
+        span = high - low
+        seen_in_path = set()
+        for rank, (source, score) in enumerate(zip(sources, path_scores), 1):
+            key = doc_key(source)
+            if key in seen_in_path:
+                continue
+            seen_in_path.add(key)
+            first_seen.setdefault(key, source)
+            ranks.setdefault(key, {})[path] = rank
+            normalized = (score - low) / span if span > 0 else 1.0
+            scored[key] = scored.get(key, 0.0) + weight * normalized
+    return _fuse(scored, first_seen, ranks, results)
+
+
+def fuse(
+    method: str,
+    results: Dict[str, List[KnowledgeSource]],
+    weights: Optional[Dict[str, float]] = None,
+    rrf_k: int = DEFAULT_RRF_K,
+) -> List[KnowledgeSource]:
+    """按 method（rrf / linear）融合各路结果"""
+    if method == "rrf":
+        return reciprocal_rank_fusion(results, weights, k=rrf_k)
+    if method == "linear":
+        return linear_fusion(results, weights)
+    raise ValueError(f"未知的融合方式: {method}，可选 {', '.join(FUSION_METHODS)}")
@@ -12,6 +12,10 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from config import settings
 from models import Document
+from bm25_index import CHUNK_ID_SEPARATOR, snapshot_lock
+from vector_index import vector_index_class, vector_index_params
+from milvus_index import build_index_params
+from metadata_filter import like_pattern, quote_literal
 
 # medical.txt 单条用于向量检索的文本最大长度（避免超长）
 MEDICAL_CONTENT_MAX_LEN = 6000
@@ -32,6 +36,15 @@ MEDICAL_FIELD_MAX_LEN = {
 }
 
 
+def collection_generation(collection: Collection) -> str:
+    """
+    collection 的「代」标识：collection_id + 行数。
+    重建 collection 会换 id，插入/更新会增加行数（删除在 compaction 前不减少），据此判断本地快照是否过期。
+    """
+    info = collection.describe()
+    return f"{collection.name}:{info.get('collection_id')}:{collection.num_entities}"
+
+
 class KnowledgeBase:
     """医疗知识库管理"""
     
@@ -78,14 +91,10 @@ class KnowledgeBase:
         schema = CollectionSchema(fields=fields, description="医疗知识库")
         collection = Collection(name=self.collection_name, schema=schema)
         
-        # 创建向量索引
-        index_params = {
-            "index_type": "IVF_FLAT",
-            "metric_type": "L2",
-            "params": {"nlist": 128}
-        }
+        # 创建向量索引（类型 / 度量 / 参数见 Settings.milvus_index_*）
+        index_params = build_index_params()
         collection.create_index(field_name="embedding", index_params=index_params)
-        print(f"✅ 已创建collection: {self.collection_name}")
+        print(f"✅ 已创建collection: {self.collection_name}（索引 {index_params['index_type']} / {index_params['metric_type']}）")
     
     def _create_medical_collection(self):
         """
@@ -99,7 +108,8 @@ class KnowledgeBase:
             FieldSchema(name="name", dtype=DataType.VARCHAR, max_length=L["name"]),
             FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=L["content"]),
             FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=settings.embedding_dim),
-            FieldSchema(name="category_primary", dtype=DataType.VARCHAR, max_length=L["category_primary"]),
+            # 分类作为 partition key：按分类过滤时 Milvus 只搜索对应分区
+            FieldSchema(name="category_primary", dtype=DataType.VARCHAR, max_length=L["category_primary"], is_partition_key=settings.milvus_category_partition_key),
             FieldSchema(name="symptoms", dtype=DataType.VARCHAR, max_length=L["symptoms"]),
             FieldSchema(name="cure_department", dtype=DataType.VARCHAR, max_length=L["cure_department"]),
             FieldSchema(name="cure_way", dtype=DataType.VARCHAR, max_length=L["cure_way"]),
@@ -108,15 +118,20 @@ class KnowledgeBase:
         ]
         
         schema = CollectionSchema(fields=fields, description="病症库 medical.txt")
-        collection = Collection(name=self.collection_name, schema=schema)
+        if settings.milvus_category_partition_key:
+            collection = Collection(name=self.collection_name, schema=schema, num_partitions=settings.milvus_num_partitions)
+        else:
+            collection = Collection(name=self.collection_name, schema=schema)
         
-        index_params = {
-            "index_type": "IVF_FLAT",
-            "metric_type": "L2",
-            "params": {"nlist": 256}
-        }
+        index_params = build_index_params(defaults={"nlist": 256})
         collection.create_index(field_name="embedding", index_params=index_params)
-        print(f"✅ 已创建病症库 collection: {self.collection_name}")
+        # 分类 / 科室标量索引，加速元数据过滤（旧版 Milvus 不支持 VARCHAR 标量索引时跳过）
+        for field in ("category_primary", "cure_department"):
+            try:
+                collection.create_index(field_name=field, index_name=f"{field}_idx")
+            except Exception as e:
+                print(f"⚠️  标量索引 {field} 创建失败，过滤时退化为扫描: {e}")
+        print(f"✅ 已创建病症库 collection: {self.collection_name}（索引 {index_params['index_type']} / {index_params['metric_type']}）")
     
     def load_documents(self, file_path: str) -> List[Document]:
         """
@@ -209,15 +224,19 @@ class KnowledgeBase:
             print(f"❌ 向量化失败: {e}")
             return documents
     
-    def insert_documents(self, documents: List[Document]):
-        """插入文档到Milvus"""
+    def insert_documents(self, documents: List[Document]) -> int:
+        """插入文档到Milvus，返回成功插入的条数"""
         if not self.collection:
+            if settings.vector_backend != "milvus":
+                # 无 Milvus 的本地部署：文档只写入检索器的本地向量索引
+                print(f"💡 Milvus 不可用，{len(documents)} 条文档仅写入本地向量索引")
+                return len(documents)
             print("❌ Collection未初始化")
-            return
+            return 0
         
         if not documents:
             print("⚠️  没有文档需要插入")
-            return
+            return 0
         
         # 准备数据
         ids = [doc.id for doc in documents]
@@ -232,8 +251,28 @@ class KnowledgeBase:
             self.collection.insert(entities)
             self.collection.flush()
             print(f"✅ 成功插入 {len(documents)} 条文档到Milvus")
+            return len(documents)
         except Exception as e:
             print(f"❌ 插入文档失败: {e}")
+            return 0
+    
+    def documents_to_rows(self, documents: List[Document]) -> List[Dict[str, Any]]:
+        """将 Document 转为与病症库 schema 字段一致的行（含 embedding），供检索器的 BM25 / 本地向量索引增量写入"""
+        return [
+            {
+                "id": doc.id,
+                "embedding": doc.embedding,
+                "content": doc.content,
+                "name": doc.metadata.get("title") or doc.metadata.get("name") or "",
+                "category_primary": doc.metadata.get("category"),
+                "symptoms": doc.metadata.get("symptoms"),
+                "cure_department": doc.metadata.get("cure_department"),
+                "cure_way": doc.metadata.get("cure_way"),
+                "get_way": doc.metadata.get("get_way"),
+                "cured_prob": doc.metadata.get("cured_prob"),
+            }
+            for doc in documents
+        ]
     
     def _build_medical_content(self, raw: Dict[str, Any]) -> str:
         """根据 medical.txt 单条 JSON 拼接用于向量检索的 content（名称+描述+症状+病因+预防+治疗等）"""
@@ -356,14 +395,17 @@ class KnowledgeBase:
             print(f"❌ 向量化失败: {e}")
             return rows
     
-    def insert_medical_rows(self, rows: List[Dict[str, Any]]):
-        """将病症行分批插入当前 collection，避免 gRPC 单次消息超过 67MB 限制"""
+    def insert_medical_rows(self, rows: List[Dict[str, Any]]) -> int:
+        """将病症行分批插入当前 collection，避免 gRPC 单次消息超过 67MB 限制；返回成功插入的条数"""
         if not self.collection:
+            if settings.vector_backend != "milvus":
+                print(f"💡 Milvus 不可用，{len(rows)} 条病症仅写入本地向量索引")
+                return len(rows)
             print("❌ Collection 未初始化")
-            return
+            return 0
         if not rows:
             print("⚠️  没有数据需要插入")
-            return
+            return 0
         total = len(rows)
         batch_size = MEDICAL_INSERT_BATCH_SIZE
         inserted = 0
@@ -388,32 +430,58 @@ class KnowledgeBase:
             print(f"✅ 成功插入 {inserted} 条病症到 Milvus")
         except Exception as e:
             print(f"❌ 插入病症失败: {e}")
+        return inserted
     
-    def build_medical_knowledge_base(self, file_path: str):
+    def build_medical_knowledge_base(self, file_path: str) -> List[Dict[str, Any]]:
         """
         使用 medical.txt 构建病症库：若已存在同名 collection 则先删除再创建新 schema，再加载、向量化、入库。
+        VECTOR_BACKEND 为 flat / hnsw 时同时写出本地向量索引快照（Milvus 不可用时只写本地索引）。
+        返回已入库的病症行（含 embedding，供检索器直接重建 BM25，无需再从 Milvus 拉取）。
         """
         print("🚀 开始从 medical.txt 构建病症库...")
         try:
-            connections.connect(alias="default", host=settings.milvus_host, port=settings.milvus_port)
-        except Exception:
-            pass
-        if utility.has_collection(self.collection_name):
-            utility.drop_collection(self.collection_name)
-            print(f"🗑️  已删除旧 collection: {self.collection_name}")
-        self._create_medical_collection()
-        self.collection = Collection(self.collection_name)
-        self.collection.load()
+            try:
+                connections.connect(alias="default", host=settings.milvus_host, port=settings.milvus_port)
+            except Exception:
+                pass
+            if utility.has_collection(self.collection_name):
+                utility.drop_collection(self.collection_name)
+                print(f"🗑️  已删除旧 collection: {self.collection_name}")
+            self._create_medical_collection()
+            self.collection = Collection(self.collection_name)
+            self.collection.load()
+        except Exception as e:
+            if settings.vector_backend == "milvus":
+                raise
+            print(f"⚠️  Milvus 不可用，仅构建本地向量索引: {e}")
+            self.collection = None
         
         rows = self.load_medical_txt(file_path)
         if not rows:
-            return
+            return []
         rows = self.embed_medical_rows(rows)
-        self.insert_medical_rows(rows)
-        self.collection.load()
+        inserted = self.insert_medical_rows(rows)
+        if self.collection:
+            self.collection.load()
+        self.save_local_vector_index(rows[:inserted])
         print("✅ 病症库构建完成！")
+        return rows[:inserted]
+    
+    def save_local_vector_index(self, rows: List[Dict[str, Any]]):
+        """VECTOR_BACKEND 为 flat / hnsw 时，用已向量化的行构建本地向量索引并写快照（代标识与 collection 一致）"""
+        index_cls = vector_index_class(settings.vector_backend)
+        if index_cls is None or not rows:
+            return
+        try:
+            generation = collection_generation(self.collection) if self.collection else None
+            index = index_cls.build(rows, settings.embedding_dim, generation=generation, **vector_index_params())
+            with snapshot_lock(settings.vector_index_dir):
+                index.save(settings.vector_index_dir)
+            print(f"💾 本地向量索引（{settings.vector_backend}）已写入: {settings.vector_index_dir}")
+        except Exception as e:
+            print(f"⚠️  本地向量索引写入失败: {e}")
     
-    def build_knowledge_base(self, file_path: str):
+    def build_knowledge_base(self, file_path: str) -> List[Document]:
         """
         构建知识库完整流程（旧版 JSON 格式，如 medical_knowledge.json）
         1. 加载文档
@@ -421,13 +489,14 @@ class KnowledgeBase:
         3. 切分
         4. 向量化
         5. 入库
+        返回成功入库的文档（切分后）。
         """
         print("🚀 开始构建知识库...")
         
         # 加载文档
         documents = self.load_documents(file_path)
         if not documents:
-            return
+            return []
         
         # 切分文档
         split_docs = self.split_documents(documents)
@@ -436,39 +505,51 @@ class KnowledgeBase:
         embedded_docs = self.embed_documents(split_docs)
         
         # 入库
-        self.insert_documents(embedded_docs)
+        if not self.insert_documents(embedded_docs):
+            return []
         
         print("✅ 知识库构建完成！")
+        return embedded_docs
+    
+    @staticmethod
+    def _delete_expr(ids: List[str]) -> str:
+        """按原文档 id 删除的表达式：id 本身及其切分块（{id}_chunk_{i}，前缀匹配；id 与分隔符中的 % / _ 按字面匹配）"""
+        terms = [f"id in [{', '.join(quote_literal(doc_id) for doc_id in ids)}]"]
+        terms += [f"id like {quote_literal(like_pattern(doc_id + CHUNK_ID_SEPARATOR) + '%')}" for doc_id in ids]
+        return " or ".join(terms)
     
-    def incremental_update(self, documents: List[Document], update_type: str = "add"):
+    def incremental_update(self, documents: List[Document], update_type: str = "add") -> List[Document]:
         """
         增量更新知识库
         支持：add/update/delete
+        返回本次新写入的文档（切分后），delete 时为空列表。
         """
         print(f"🔄 执行增量更新，类型: {update_type}")
+        inserted_docs: List[Document] = []
         
         if update_type == "delete":
-            # 删除文档
+            # 删除文档（连同其切分块）
             ids = [doc.id for doc in documents]
-            expr = f"id in {ids}"
-            self.collection.delete(expr)
+            if self.collection:
+                self.collection.delete(self._delete_expr(ids))
             print(f"✅ 删除了 {len(ids)} 条文档")
         
         elif update_type in ["add", "update"]:
-            if update_type == "update":
-                # 先删除旧数据
+            if update_type == "update" and self.collection:
+                # 先删除旧数据（旧版本切出的块数可能更多，按前缀删除全部块）
                 ids = [doc.id for doc in documents]
-                expr = f"id in {ids}"
-                self.collection.delete(expr)
+                self.collection.delete(self._delete_expr(ids))
             
             # 切分和向量化
             split_docs = self.split_documents(documents)
             embedded_docs = self.embed_documents(split_docs)
             
             # 插入新数据
-            self.insert_documents(embedded_docs)
+            if self.insert_documents(embedded_docs):
+                inserted_docs = embedded_docs
         
         print("✅ 增量更新完成")
+        return inserted_docs
 
 
 if __name__ == "__main__":
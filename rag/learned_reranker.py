@@ -0,0 +1,205 @@
+"""
+学习型重排模块
+在进程内对候选逐条打分（pointwise 逻辑回归），替代「让 LLM 输出序号」的重排，无网络调用，
+20 条候选的重排耗时在亚毫秒级。
+特征均来自召回阶段已有的信息：
+- vector_sim：向量相似度（未被向量路召回为 0）
+- bm25：log1p(BM25 分数)（未被关键词路召回为 0）
+- name_in_query：疾病名是否出现在查询中
+- symptom_hits：log1p(查询中完整出现的症状条数)
+- symptom_overlap：查询实词（≥2 字）中出现在症状字段里的比例
+- department_match：查询是否提及就诊科室（如「儿科」「呼吸内科」/「呼吸」）
+模型权重由 train_reranker.py 离线训练，保存为 JSON；权重文件不存在时使用内置的经验权重。
+"""
+import json
+import math
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import jieba
+import numpy as np
+
+from models import KnowledgeSource
+from rule_matcher import split_field
+
+FEATURE_NAMES = [
+    "vector_sim",
+    "bm25",
+    "name_in_query",
+    "symptom_hits",
+    "symptom_overlap",
+    "department_match",
+]
+
+# 未训练时的经验权重（特征未标准化：mean=0, std=1）
+DEFAULT_MODEL = {
+    "features": FEATURE_NAMES,
+    "weights": [3.0, 0.8, 2.5, 1.0, 1.5, 0.5],
+    "bias": -3.0,
+    "mean": [0.0] * len(FEATURE_NAMES),
+    "std": [1.0] * len(FEATURE_NAMES),
+}
+
+_DEPARTMENT_SUFFIXES = ("内科", "外科", "科")
+
+
+def _path_scores(source: KnowledgeSource) -> Dict[str, float]:
+    """各路原始分数：取合并阶段记录的 fusion_path_scores（FUSION_METHOD 为 none / rrf / linear 时均有），缺失时按 retrieval_type 取自身分数"""
+    metadata = source.metadata or {}
+    if metadata.get("fusion_path_scores"):
+        return metadata["fusion_path_scores"]
+    return {metadata.get("retrieval_type") or "": float(source.score or 0.0)}
+
+
+def extract_features(query: str, query_terms: List[str], source: KnowledgeSource) -> List[float]:
+    """为单个候选提取特征，顺序与 FEATURE_NAMES 一致；query_terms 为查询中 ≥2 字的分词结果"""
+    metadata = source.metadata or {}
+    path_scores = _path_scores(source)
+    name = metadata.get("name") or ""
+
+    symptoms = split_field(metadata.get("symptoms"))
+    symptom_text = "、".join(symptoms)
+    symptom_hits = sum(1 for symptom in symptoms if symptom in query)
+    overlap = sum(1 for term in query_terms if term in symptom_text) / len(query_terms) if query_terms else 0.0
+
+    department_match = 0.0
+    for department in split_field(metadata.get("cure_department")):
+        stem = department
+        for suffix in _DEPARTMENT_SUFFIXES:
+            if stem.endswith(suffix) and len(stem) - len(suffix) >= 2:
+                stem = stem[: -len(suffix)]
+                break
+        if department in query or stem in query:
+            department_match = 1.0
+            break
+
+    return [
+        float(path_scores.get("vector", 0.0)),
+        math.log1p(max(0.0, float(path_scores.get("keyword", 0.0)))),
+        1.0 if name and name in query else 0.0,
+        math.log1p(symptom_hits),
+        overlap,
+        department_match,
+    ]
+
+
+def query_terms(query: str) -> List[str]:
+    return [token for token in jieba.cut(query or "") if len(token.strip()) >= 2]
+
+
+def is_relevant(item: Dict[str, Any], source: KnowledgeSource) -> bool:
+    """
+    训练 / 评估标注：评估项提供 relevant_names（相关疾病名列表）时按名称精确匹配；
+    否则退化为「疾病名出现在问题或参考答案中」。
+    """
+    name = (source.metadata or {}).get("name") or ""
+    if not name:
+        return False
+    relevant = item.get("relevant_names")
+    if relevant:
+        return name in relevant
+    return name in (item.get("question") or "") + (item.get("ground_truth") or "")
+
+
+class LearnedReranker:
+    """逻辑回归重排器：score = sigmoid(w · (x - mean) / std + b)"""
+
+    def __init__(self, model: Optional[Dict[str, Any]] = None):
+        model = model or DEFAULT_MODEL
+        if list(model.get("features", [])) != FEATURE_NAMES:
+            raise ValueError(f"重排模型特征不匹配: {model.get('features')}")
+        self.weights = np.asarray(model["weights"], dtype=np.float64)
+        self.bias = float(model["bias"])
+        self.mean = np.asarray(model["mean"], dtype=np.float64)
+        self.std = np.asarray(model["std"], dtype=np.float64)
+        self.trained = model is not DEFAULT_MODEL
+
+    @classmethod
+    def load(cls, path: str) -> "LearnedReranker":
+        """加载 JSON 权重；文件不存在或格式不符时使用内置经验权重"""
+        if path and Path(path).exists():
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    reranker = cls(json.load(f))
+                print(f"✅ 已加载学习型重排模型: {path}")
+                return reranker
+            except Exception as e:
+                print(f"⚠️  重排模型加载失败，使用默认权重: {e}")
+        return cls()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "features": FEATURE_NAMES,
+            "weights": self.weights.tolist(),
+            "bias": self.bias,
+            "mean": self.mean.tolist(),
+            "std": self.std.tolist(),
+        }
+
+    def save(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        z = ((features - self.mean) / self.std) @ self.weights + self.bias
+        return 1.0 / (1.0 + np.exp(-z))
+
+    def score(self, query: str, sources: List[KnowledgeSource]) -> np.ndarray:
+        terms = query_terms(query)
+        features = np.array([extract_features(query, terms, source) for source in sources], dtype=np.float64)
+        return self.predict(features.reshape(len(sources), len(FEATURE_NAMES)))
+
+    def rerank(self, query: str, sources: List[KnowledgeSource], top_k: int = 3) -> List[KnowledgeSource]:
+        """按模型分数降序取 top_k；同分时保持原有（融合）顺序"""
+        if not sources:
+            return []
+        scores = self.score(query, sources)
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        reranked = []
+        for idx in order:
+            source = sources[idx]
+            metadata = dict(source.metadata or {})
+            metadata["rerank_score"] = float(scores[idx])
+            reranked.append(source.model_copy(update={"metadata": metadata}))
+        print(f"📊 学习型重排后返回 {len(reranked)} 条结果")
+        return reranked
+
+    @classmethod
+    def fit(
+        cls,
+        features: np.ndarray,
+        labels: np.ndarray,
+        epochs: int = 500,
+        learning_rate: float = 0.1,
+        l2: float = 1e-3,
+    ) -> "LearnedReranker":
+        """
+        批量梯度下降训练逻辑回归（特征先标准化，正负样本按频率加权以应对类别不平衡）。
+        """
+        features = np.asarray(features, dtype=np.float64)
+        labels = np.asarray(labels, dtype=np.float64)
+        mean = features.mean(axis=0)
+        std = features.std(axis=0)
+        std[std < 1e-9] = 1.0
+        x = (features - mean) / std
+
+        n_pos = labels.sum()
+        n_neg = len(labels) - n_pos
+        sample_weight = np.where(labels > 0, len(labels) / (2 * max(n_pos, 1)), len(labels) / (2 * max(n_neg, 1)))
+
+        weights = np.zeros(x.shape[1])
+        bias = 0.0
+        for _ in range(epochs):
+            pred = 1.0 / (1.0 + np.exp(-(x @ weights + bias)))
+            err = (pred - labels) * sample_weight
+            weights -= learning_rate * (x.T @ err / len(labels) + l2 * weights)
+            bias -= learning_rate * err.mean()
+
+        return cls({
+            "features": FEATURE_NAMES,
+            "weights": weights.tolist(),
+            "bias": bias,
+            "mean": mean.tolist(),
+            "std": std.tolist(),
+        })
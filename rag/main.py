@@ -2,39 +2,49 @@
 RAG智能问诊助手 - 主服务
 FastAPI + SSE流式输出
 """
-import json
 import asyncio
-from typing import List, AsyncGenerator
+import json
+from typing import List, Optional, Tuple, AsyncGenerator
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
-import redis
+import redis.asyncio as aioredis
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 
 from config import settings
-from models import ConsultRequest, ConsultResponse, KnowledgeSource, IncrementalUpdate, Document
+from models import ConsultRequest, ConsultResponse, KnowledgeSource, IncrementalUpdate, Document, BatchRetrieveRequest, BatchRetrieveResponse
 from retriever import MultiPathRetriever
 from mcp_tools import MCPToolManager
 from knowledge_base import KnowledgeBase
-from query_optimizer import optimize as optimize_query
-from chat_history import get_messages, append_turn, messages_to_history_list
+from query_optimizer import aoptimize as optimize_query, normalize_question, should_rewrite, rewrite_stats
+from caching import stable_digest
+from response_cache import ResponseCache
+from rewrite_cache import RewriteCache
+from metadata_filter import MetadataFilter
+from semantic_cache import SemanticCache, SEMANTIC_CACHE_MODES
+from speculative_retrieval import aretrieve_speculative, speculative_stats
+from chat_history import aget_messages, aappend_turn, aupdate_summary, queue_read, parse_read, messages_to_history_list, SUMMARY_ROLE
 
 
 # 全局对象
 retriever = None
 mcp_manager = None
 redis_client = None
+redis_pool = None
 knowledge_base = None
+semantic_cache = None
+response_cache = None
+rewrite_cache = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
-    global retriever, mcp_manager, redis_client, knowledge_base
+    global retriever, mcp_manager, redis_client, redis_pool, knowledge_base, semantic_cache, response_cache, rewrite_cache
     
     print("🚀 启动RAG智能问诊助手...")
     
@@ -43,28 +53,63 @@ async def lifespan(app: FastAPI):
     mcp_manager = MCPToolManager()
     knowledge_base = KnowledgeBase()
     
-    # 初始化Redis
+    # 语义答案缓存（SEMANTIC_CACHE_MODE=shadow / on）
+    if settings.semantic_cache_mode not in SEMANTIC_CACHE_MODES:
+        print(f"⚠️  未知的 SEMANTIC_CACHE_MODE: {settings.semantic_cache_mode}，语义缓存不启用")
+    elif settings.semantic_cache_mode != "off":
+        semantic_cache = SemanticCache(
+            threshold=settings.semantic_cache_threshold,
+            max_items=settings.semantic_cache_max_items,
+            ttl=settings.semantic_cache_ttl,
+        )
+        print(f"✅ 语义答案缓存已启用（{settings.semantic_cache_mode}，阈值 {settings.semantic_cache_threshold}）")
+    
+    # 初始化Redis（异步客户端，响应缓存与对话历史共用一个有上限的连接池；连接耗尽时排队等待而非报错）
     try:
-        redis_client = redis.Redis(
+        redis_pool = aioredis.BlockingConnectionPool(
             host=settings.redis_host,
             port=settings.redis_port,
             db=settings.redis_db,
-            decode_responses=True
+            decode_responses=True,
+            max_connections=settings.redis_max_connections,
+            timeout=settings.redis_pool_timeout,
         )
-        redis_client.ping()
-        print("✅ Redis连接成功")
+        redis_client = aioredis.Redis(connection_pool=redis_pool)
+        await redis_client.ping()
+        print(f"✅ Redis连接成功（连接池上限 {settings.redis_max_connections}）")
     except Exception as e:
         print(f"⚠️  Redis连接失败: {e}")
         redis_client = None
     
+    # 响应缓存（进程内 LRU + Redis，订阅失效频道）
+    response_cache = ResponseCache(
+        redis_client=redis_client,
+        ttl=settings.response_cache_ttl,
+        local_max_items=settings.response_cache_local_max_items,
+        local_max_bytes=settings.response_cache_local_max_mb * 1024 * 1024,
+        local_ttl=settings.response_cache_local_ttl,
+    )
+    await response_cache.start()
+    
+    # 查询改写缓存（进程内 LRU + Redis）
+    rewrite_cache = RewriteCache(
+        redis_client=redis_client,
+        model=settings.openai_model,
+        max_items=settings.rewrite_cache_max_items,
+        ttl=settings.rewrite_cache_ttl,
+    )
+    
     print("✅ 系统启动完成")
     
     yield
     
     # 清理资源
     print("👋 关闭系统...")
+    await response_cache.stop()
     if redis_client:
-        redis_client.close()
+        await redis_client.aclose()
+    if redis_pool:
+        await redis_pool.disconnect()
 
 
 app = FastAPI(
@@ -101,54 +146,200 @@ llm = ChatOpenAI(
 )
 
 
-def get_cache_key(user_id: str, question: str) -> str:
-    """生成缓存key"""
-    return f"consult:{user_id}:{hash(question)}"
+# 对话摘要使用的 LLM（非流式、低温度）
+summary_llm = ChatOpenAI(
+    openai_api_key=settings.openai_api_key,
+    openai_api_base=settings.openai_api_base,
+    model=settings.openai_model,
+    temperature=0.1,
+)
+
+# 提示词 / 改写使用的最近历史消息条数（更早的内容由滚动摘要覆盖）
+HISTORY_WINDOW_MESSAGES = settings.chat_history_recent_messages
 
+# 后台任务引用（避免未完成的任务被回收）
+_background_tasks = set()
 
-def check_cache(cache_key: str) -> ConsultResponse:
-    """检查缓存"""
-    if not redis_client:
+
+def get_cache_key(user_id: str, question: str, metadata_filter: MetadataFilter = None) -> str:
+    """
+    生成缓存key：规范化问题（全半角、空白、标点、同义词）的稳定摘要，跨 worker / 重启一致；
+    限定科室 / 分类的请求单独缓存
+    """
+    digest = stable_digest(normalize_question(question), metadata_filter.key if metadata_filter else None)
+    return f"consult:{user_id}:{digest}"
+
+
+async def check_cache(cache_key: str) -> ConsultResponse:
+    """检查缓存（先查进程内一级，未命中再经 redis.asyncio 异步读 Redis）"""
+    if response_cache is None:
         return None
-    
-    try:
-        cached = redis_client.get(cache_key)
-        if cached:
-            print("💾 命中缓存")
-            data = json.loads(cached)
-            return ConsultResponse(**data)
-    except Exception as e:
-        print(f"⚠️  缓存读取失败: {e}")
-    
-    return None
+    cached = await response_cache.get(cache_key)
+    if cached:
+        print("💾 命中缓存")
+    return cached
 
 
-def set_cache(cache_key: str, response: ConsultResponse, ttl: int = 3600):
+async def set_cache(cache_key: str, response: ConsultResponse, ttl: int = None):
     """设置缓存"""
-    if not redis_client:
+    if response_cache is None:
         return
-    
+    await response_cache.set(cache_key, response, ttl)
+    print("💾 已缓存结果")
+
+
+async def invalidate_answer_caches():
+    """知识库构建 / 增量更新后，使检索结果、响应与语义答案缓存失效（检索缓存走同步 Redis，放到线程中执行）"""
+    await asyncio.to_thread(retriever.invalidate_retrieval_cache)
+    if response_cache is not None:
+        await response_cache.invalidate()
+    if semantic_cache is not None:
+        semantic_cache.clear()
+
+
+async def semantic_lookup(question: str, history: List, metadata_filter: MetadataFilter = None) -> Tuple[Optional[ConsultResponse], Optional[List[float]]]:
+    """
+    语义答案缓存查找，返回 (可直接返回的回答, 问题 embedding)。
+    回答依赖历史对话时不适用（只查无历史的问题）；shadow 模式只记录相似度，不返回回答。
+    """
+    if semantic_cache is None or history:
+        return None, None
     try:
-        redis_client.setex(
-            cache_key,
-            ttl,
-            json.dumps(response.model_dump(), ensure_ascii=False)
-        )
-        print("💾 已缓存结果")
+        embedding = await retriever.aembed_query(question)
     except Exception as e:
-        print(f"⚠️  缓存写入失败: {e}")
+        print(f"⚠️  语义缓存向量化失败: {e}")
+        return None, None
+    hit = semantic_cache.lookup(question, embedding, metadata_filter.key if metadata_filter else None)
+    if hit is None or settings.semantic_cache_mode != "on":
+        return None, embedding
+    return hit[0], embedding
 
 
-def get_request_history(request: ConsultRequest) -> List[dict]:
+def semantic_store(question: str, embedding: Optional[List[float]], response: ConsultResponse, metadata_filter: MetadataFilter = None):
+    """生成完成后写入语义缓存（仅无历史对话、已完成查找的问题）"""
+    if semantic_cache is not None and embedding is not None and response.answer:
+        semantic_cache.add(question, embedding, response, metadata_filter.key if metadata_filter else None)
+
+
+async def cached_events(response: ConsultResponse) -> AsyncGenerator[str, None]:
+    """以 SSE 事件回放缓存的完整响应"""
+    yield f"data: {json.dumps({'type': 'cached', 'message': '使用缓存结果'}, ensure_ascii=False)}\n\n"
+    yield f"data: {json.dumps({'type': 'content', 'content': response.answer}, ensure_ascii=False)}\n\n"
+    yield f"data: {json.dumps({'type': 'suggestions', 'suggestions': response.suggestions}, ensure_ascii=False)}\n\n"
+    yield f"data: {json.dumps({'type': 'done'}, ensure_ascii=False)}\n\n"
+
+
+async def get_request_history(request: ConsultRequest) -> List[dict]:
     """从 Redis 按 session_id 读取对话历史（不依赖前端传 history）"""
     if not request.session_id or not redis_client:
         return []
-    raw = get_messages(request.session_id, redis_client)
-    return messages_to_history_list(raw, max_turns=6)
+    raw = await aget_messages(request.session_id, redis_client, limit=HISTORY_WINDOW_MESSAGES)
+    return to_prompt_history(raw)
+
+
+def to_prompt_history(messages: List[dict]) -> List[dict]:
+    """摘要 + 最近 HISTORY_WINDOW_MESSAGES 条，过长的单条消息截断"""
+    return messages_to_history_list(
+        messages, max_turns=HISTORY_WINDOW_MESSAGES, max_chars=settings.chat_history_message_max_chars
+    )
+
+
+async def save_turn(request: ConsultRequest, answer: str):
+    """将本轮对话追加到 Redis 会话历史（若有 session_id）"""
+    if request.session_id and redis_client:
+        await aappend_turn(
+            request.session_id,
+            request.question,
+            answer,
+            redis_client,
+            ttl=settings.chat_history_ttl,
+            max_messages=settings.chat_history_max_messages,
+            compress_min_bytes=settings.chat_history_compress_min_bytes,
+        )
+        if settings.enable_history_summary:
+            # 摘要更新不阻塞本轮响应
+            task = asyncio.create_task(aupdate_summary(
+                request.session_id,
+                redis_client,
+                summary_llm,
+                recent_messages=HISTORY_WINDOW_MESSAGES,
+                ttl=settings.chat_history_ttl,
+                max_chars=settings.chat_summary_max_chars,
+            ))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+
+async def load_cache_and_history(request: ConsultRequest, cache_key: Optional[str]) -> Tuple[Optional[ConsultResponse], Optional[List[dict]]]:
+    """
+    读取响应缓存与对话历史，返回 (缓存的响应, 历史)；缓存命中时不需要历史，返回 None。
+    两者都需要读 Redis 时合并为一次 pipeline 往返。
+    """
+    if not (cache_key and request.session_id and redis_client and response_cache):
+        cached = await check_cache(cache_key) if cache_key else None
+        if cached:
+            return cached, None
+        return None, await get_request_history(request)
+    
+    cached = response_cache.get_local(cache_key)
+    if cached:
+        print("💾 命中缓存")
+        return cached, None
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.get(response_cache.redis_key(cache_key))
+            queue_read(pipe, request.session_id, HISTORY_WINDOW_MESSAGES)
+            results = await pipe.execute()
+    except Exception as e:
+        response_cache.redis_counter.error()
+        print(f"⚠️  缓存 / 对话历史读取失败: {e}")
+        return None, []
+    cached = response_cache.accept(cache_key, results[0])
+    if cached:
+        print("💾 命中缓存")
+        return cached, None
+    return None, to_prompt_history(parse_read(results[1:], HISTORY_WINDOW_MESSAGES))
+
+
+async def retrieve_for_question(question: str, history: List, metadata_filter: MetadataFilter = None) -> Tuple[str, List[KnowledgeSource], dict]:
+    """
+    提问优化 + 检索，返回 (检索问句, 知识来源, 耗时统计)。
+    需要 LLM 改写且开启推测式检索时，改写与「规范化原问题」的检索并发执行（见 speculative_retrieval）。
+    """
+    def rewrite(decision: bool):
+        return optimize_query(
+            question,
+            history=history,
+            enable_normalize=settings.enable_query_normalize,
+            rewrite_decision=decision,
+            cache=rewrite_cache,
+        )
+
+    # 门控只判定一次（同时计入改写统计），推测检索与改写共用这一决定
+    will_rewrite = should_rewrite(
+        question,
+        history,
+        enable_rewrite=settings.enable_query_rewrite,
+        adaptive_rewrite=settings.query_rewrite_adaptive,
+    )
+    if will_rewrite and settings.enable_speculative_retrieval:
+        return await aretrieve_speculative(
+            retriever,
+            await rewrite(False),
+            rewrite(True),
+            settings.top_k_rerank,
+            metadata_filter=metadata_filter,
+            keep_similarity=settings.speculative_keep_similarity,
+            merge_weight=settings.speculative_merge_weight,
+            rrf_k=settings.rrf_k,
+        )
+    retrieval_query = await rewrite(will_rewrite)
+    knowledge_sources, timings = await retriever.aretrieve_with_timings(retrieval_query, metadata_filter=metadata_filter)
+    return retrieval_query, knowledge_sources, timings
 
 
 def build_prompt(question: str, knowledge_sources: List[KnowledgeSource], history: List) -> str:
-    """构建问诊提示词（history 为服务端从 Redis 拉取的最近几轮，格式 [{"role":"user"|"assistant","content":"..."}]）"""
+    """构建问诊提示词（history 为服务端从 Redis 拉取的摘要 + 最近几条，格式 [{"role":"user"|"assistant"|"summary","content":"..."}]）"""
     
     # 整理知识来源
     knowledge_text = ""
@@ -163,10 +354,12 @@ def build_prompt(question: str, knowledge_sources: List[KnowledgeSource], histor
         for msg in history:
             role = (msg.get("role") or "").strip()
             content = (msg.get("content") or "").strip()
-            if role and content:
+            if role == SUMMARY_ROLE and content:
+                history_block += f"此前对话摘要：\n{content}\n\n"
+            elif role and content:
                 lines.append(f"{'用户' if role == 'user' else '助手'}：{content}")
         if lines:
-            history_block = "历史对话：\n" + "\n".join(lines) + "\n\n"
+            history_block += "历史对话：\n" + "\n".join(lines) + "\n\n"
     
     # 构建提示词
     system_prompt = """你是一个专业的医疗问诊助手，具备丰富的医学知识。你的任务是：
@@ -215,22 +408,28 @@ def extract_suggestions(answer: str) -> List[str]:
     return suggestions[:5]  # 最多返回5条
 
 
-async def stream_response(request: ConsultRequest) -> AsyncGenerator[str, None]:
-    """SSE流式响应生成器"""
+async def stream_response(request: ConsultRequest, history: Optional[List[dict]] = None) -> AsyncGenerator[str, None]:
+    """SSE流式响应生成器（history 为调用方已读取的对话历史，None 时在此读取）"""
+    metadata_filter = MetadataFilter.from_request(request)
     
     try:
         # 0. 从 Redis 拉取对话历史（不依赖前端传 history）
-        history = get_request_history(request)
-
-        # 1. 提问优化（仅用于检索，回答与缓存仍用原问题）
-        retrieval_query = optimize_query(
-            request.question,
-            history=history,
-            enable_rewrite=settings.enable_query_rewrite,
-            enable_normalize=settings.enable_query_normalize,
-        )
+        if history is None:
+            history = await get_request_history(request)
+
+        # 语义答案缓存：近义问题已回答过时直接回放，不再检索与调用 LLM
+        semantic_hit, question_embedding = await semantic_lookup(request.question, history, metadata_filter)
+        if semantic_hit:
+            async for event in cached_events(semantic_hit):
+                yield event
+            await save_turn(request, semantic_hit.answer)
+            return
+
+        # 1. 提问优化（仅用于检索，回答与缓存仍用原问题）+ 检索
         yield f"data: {json.dumps({'type': 'status', 'message': '正在检索医疗知识...'}, ensure_ascii=False)}\n\n"
-        knowledge_sources = retriever.retrieve(retrieval_query)
+        retrieval_query, knowledge_sources, retrieval_timings = await retrieve_for_question(
+            request.question, history, metadata_filter
+        )
 
         # 2. MCP工具兜底
         if not knowledge_sources or (knowledge_sources and max([s.score for s in knowledge_sources if s.score], default=0) < 0.5):
@@ -247,7 +446,7 @@ async def stream_response(request: ConsultRequest) -> AsyncGenerator[str, None]:
             }
             for s in knowledge_sources
         ]
-        yield f"data: {json.dumps({'type': 'sources', 'sources': sources_data}, ensure_ascii=False)}\n\n"
+        yield f"data: {json.dumps({'type': 'sources', 'sources': sources_data, 'timings': retrieval_timings}, ensure_ascii=False)}\n\n"
         
         # 4. 构建提示词（使用服务端历史）
         system_prompt, user_prompt = build_prompt(request.question, knowledge_sources, history)
@@ -273,19 +472,19 @@ async def stream_response(request: ConsultRequest) -> AsyncGenerator[str, None]:
         yield f"data: {json.dumps({'type': 'suggestions', 'suggestions': suggestions}, ensure_ascii=False)}\n\n"
         yield f"data: {json.dumps({'type': 'done'}, ensure_ascii=False)}\n\n"
         
-        # 8. 缓存结果（如果有user_id）
+        # 8. 缓存结果（如果有user_id）；无历史对话的问题同时写入语义缓存
+        response = ConsultResponse(
+            answer=full_answer,
+            sources=knowledge_sources,
+            suggestions=suggestions
+        )
         if request.user_id:
-            response = ConsultResponse(
-                answer=full_answer,
-                sources=knowledge_sources,
-                suggestions=suggestions
-            )
-            cache_key = get_cache_key(request.user_id, request.question)
-            set_cache(cache_key, response)
+            cache_key = get_cache_key(request.user_id, request.question, metadata_filter)
+            await set_cache(cache_key, response)
+        semantic_store(request.question, question_embedding, response, metadata_filter)
 
         # 9. 将本轮对话写入 Redis（若有 session_id）
-        if request.session_id and redis_client:
-            append_turn(request.session_id, request.question, full_answer, redis_client, ttl=settings.chat_history_ttl)
+        await save_turn(request, full_answer)
     
     except Exception as e:
         error_msg = f"生成回答时出错: {str(e)}"
@@ -303,35 +502,42 @@ async def root():
     }
 
 
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """缓存命中统计"""
+    embedding_cache = retriever.embedding_cache if retriever else None
+    retrieval_cache = retriever.retrieval_cache if retriever else None
+    return {
+        "response": response_cache.stats() if response_cache else None,
+        "embedding": embedding_cache.stats() if embedding_cache else None,
+        "retrieval": retrieval_cache.stats() if retrieval_cache else None,
+        "semantic": semantic_cache.stats() if semantic_cache else None,
+        "rewrite": {"gate": rewrite_stats(), "cache": rewrite_cache.stats() if rewrite_cache else None},
+    }
+
+
 @app.post("/api/consult/stream")
 async def consult_stream(request: ConsultRequest):
     """
     问诊接口（SSE流式）
     """
-    # 检查缓存
-    if request.user_id:
-        cache_key = get_cache_key(request.user_id, request.question)
-        cached_response = check_cache(cache_key)
-        if cached_response:
-            # 返回缓存的完整响应
-            async def cached_stream():
-                yield f"data: {json.dumps({'type': 'cached', 'message': '使用缓存结果'}, ensure_ascii=False)}\n\n"
-                yield f"data: {json.dumps({'type': 'content', 'content': cached_response.answer}, ensure_ascii=False)}\n\n"
-                yield f"data: {json.dumps({'type': 'suggestions', 'suggestions': cached_response.suggestions}, ensure_ascii=False)}\n\n"
-                yield f"data: {json.dumps({'type': 'done'}, ensure_ascii=False)}\n\n"
-            
-            return StreamingResponse(
-                cached_stream(),
-                media_type="text/event-stream",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                }
-            )
+    # 检查缓存，同时读取对话历史（一次 Redis 往返）
+    cache_key = get_cache_key(request.user_id, request.question, MetadataFilter.from_request(request)) if request.user_id else None
+    cached_response, history = await load_cache_and_history(request, cache_key)
+    if cached_response:
+        # 返回缓存的完整响应
+        return StreamingResponse(
+            cached_events(cached_response),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive",
+            }
+        )
     
     # 流式响应
     return StreamingResponse(
-        stream_response(request),
+        stream_response(request, history),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -346,25 +552,24 @@ async def consult(request: ConsultRequest):
     """
     问诊接口（非流式）
     """
-    # 检查缓存
-    if request.user_id:
-        cache_key = get_cache_key(request.user_id, request.question)
-        cached_response = check_cache(cache_key)
-        if cached_response:
-            return cached_response
+    metadata_filter = MetadataFilter.from_request(request)
+    
+    # 检查缓存，同时从 Redis 拉取对话历史（一次往返）
+    cache_key = get_cache_key(request.user_id, request.question, metadata_filter) if request.user_id else None
+    cached_response, history = await load_cache_and_history(request, cache_key)
+    if cached_response:
+        return cached_response
     
     try:
-        # 0. 从 Redis 拉取对话历史
-        history = get_request_history(request)
 
-        # 1. 提问优化（仅用于检索）
-        retrieval_query = optimize_query(
-            request.question,
-            history=history,
-            enable_rewrite=settings.enable_query_rewrite,
-            enable_normalize=settings.enable_query_normalize,
-        )
-        knowledge_sources = retriever.retrieve(retrieval_query)
+        # 语义答案缓存：近义问题已回答过时直接返回
+        semantic_hit, question_embedding = await semantic_lookup(request.question, history, metadata_filter)
+        if semantic_hit:
+            await save_turn(request, semantic_hit.answer)
+            return semantic_hit
+
+        # 1. 提问优化（仅用于检索）+ 检索
+        retrieval_query, knowledge_sources, _ = await retrieve_for_question(request.question, history, metadata_filter)
 
         # 2. MCP工具兜底
         knowledge_sources = await mcp_manager.enhance_retrieval(retrieval_query, knowledge_sources)
@@ -393,11 +598,11 @@ async def consult(request: ConsultRequest):
         
         # 7. 缓存结果
         if request.user_id:
-            set_cache(cache_key, result)
+            await set_cache(cache_key, result)
+        semantic_store(request.question, question_embedding, result, metadata_filter)
 
         # 8. 将本轮对话写入 Redis（若有 session_id）
-        if request.session_id and redis_client:
-            append_turn(request.session_id, request.question, answer, redis_client, ttl=settings.chat_history_ttl)
+        await save_turn(request, answer)
         
         return result
     
@@ -405,16 +610,51 @@ async def consult(request: ConsultRequest):
         raise HTTPException(status_code=500, detail=f"问诊失败: {str(e)}")
 
 
+@app.post("/api/retrieve/batch", response_model=BatchRetrieveResponse)
+async def retrieve_batch(request: BatchRetrieveRequest):
+    """
+    批量检索（评估 / 离线任务）：N 条查询一次 embedding 请求、一次多向量搜索、BM25 批量打分，
+    返回与 queries 一一对应的结果，不生成回答
+    """
+    if len(request.queries) > settings.retrieve_batch_max_queries:
+        raise HTTPException(status_code=400, detail=f"单次最多 {settings.retrieve_batch_max_queries} 条查询")
+    
+    try:
+        results, timings = await retriever.aretrieve_batch_with_timings(
+            request.queries,
+            top_k=request.top_k,
+            metadata_filter=MetadataFilter.from_request(request),
+        )
+        return BatchRetrieveResponse(results=results, timings=timings)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量检索失败: {str(e)}")
+
+
+@app.get("/api/retrieve/stats")
+async def retrieve_stats():
+    """跨请求微批处理统计（查询向量化 / 向量搜索的批次数与平均批大小）与推测式检索的采用情况"""
+    return {"micro_batch": retriever.micro_batch_stats() if retriever else {}, "speculative": speculative_stats()}
+
+
 @app.post("/api/knowledge/build")
-async def build_knowledge_base(file_path: str):
+async def build_knowledge_base(file_path: str, background_tasks: BackgroundTasks):
     """
     构建知识库（旧版 JSON 格式，如 data/medical_knowledge.json）
     """
-    try:
-        knowledge_base.build_knowledge_base(file_path)
+    def build():
+        inserted_docs = knowledge_base.build_knowledge_base(file_path)
         
-        # 重建BM25索引
-        retriever._build_bm25_index()
+        # 新文档增量写入BM25索引与本地向量索引（不重新拉取全量数据），快照在后台更新
+        rows = knowledge_base.documents_to_rows(inserted_docs)
+        retriever.update_keyword_index("add", [], rows)
+        retriever.update_vector_index("add", [], rows)
+    
+    try:
+        # 向量化、Milvus 写入与 BM25 分词均为同步阻塞操作，放到线程中执行，避免阻塞事件循环
+        await asyncio.to_thread(build)
+        await invalidate_answer_caches()
+        background_tasks.add_task(retriever.save_keyword_snapshot)
+        background_tasks.add_task(retriever.save_vector_index)
         
         return {"message": "知识库构建成功", "file": file_path}
     except Exception as e:
@@ -427,14 +667,27 @@ async def build_medical_knowledge(file_path: str = "data/medical.txt"):
     从 medical.txt（JSONL 病症数据）构建病症库。
     会先删除同名 collection 再按新 schema 创建并写入数据。
     """
-    try:
-        knowledge_base.build_medical_knowledge_base(file_path)
+    def build():
+        rows = knowledge_base.build_medical_knowledge_base(file_path)
         
-        # 刷新检索器使用的 collection 并重建 BM25
+        # 刷新检索器使用的 collection（VECTOR_BACKEND 非 milvus 时可不部署 Milvus），
+        # 加载构建流程写出的本地向量索引，并用刚入库的数据直接重建 BM25（无需再从 Milvus 拉取）
         from pymilvus import Collection
-        retriever.collection = Collection(settings.milvus_collection_name)
-        retriever.collection.load()
-        retriever._build_bm25_index()
+        try:
+            retriever.collection = Collection(settings.milvus_collection_name)
+            retriever.collection.load()
+        except Exception as e:
+            if settings.vector_backend == "milvus":
+                raise
+            print(f"⚠️  Milvus 不可用，仅使用本地向量索引: {e}")
+            retriever.collection = None
+        retriever.reload_vector_index()
+        retriever.rebuild_keyword_index(rows)
+    
+    try:
+        # 整个构建流程均为同步阻塞操作，放到线程中执行，避免阻塞事件循环
+        await asyncio.to_thread(build)
+        await invalidate_answer_caches()
         
         return {"message": "病症库构建成功", "file": file_path}
     except Exception as e:
@@ -442,15 +695,25 @@ async def build_medical_knowledge(file_path: str = "data/medical.txt"):
 
 
 @app.post("/api/knowledge/update")
-async def update_knowledge_base(request: IncrementalUpdate):
+async def update_knowledge_base(request: IncrementalUpdate, background_tasks: BackgroundTasks):
     """
     增量更新知识库
     """
-    try:
-        knowledge_base.incremental_update(request.documents, request.update_type)
+    def update():
+        inserted_docs = knowledge_base.incremental_update(request.documents, request.update_type)
         
-        # 重建BM25索引
-        retriever._build_bm25_index()
+        # 增量更新BM25索引与本地向量索引：只处理变更文档，快照在后台更新
+        ids = [doc.id for doc in request.documents if doc.id]
+        rows = knowledge_base.documents_to_rows(inserted_docs)
+        retriever.update_keyword_index(request.update_type, ids=ids, rows=rows)
+        retriever.update_vector_index(request.update_type, ids=ids, rows=rows)
+    
+    try:
+        # 向量化、Milvus 增删与 BM25 分词均为同步阻塞操作，放到线程中执行，避免阻塞事件循环
+        await asyncio.to_thread(update)
+        await invalidate_answer_caches()
+        background_tasks.add_task(retriever.save_keyword_snapshot)
+        background_tasks.add_task(retriever.save_vector_index)
         
         return {
             "message": "增量更新成功",
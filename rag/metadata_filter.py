@@ -0,0 +1,88 @@
+"""
+元数据过滤：按就诊科室（cure_department）/ 疾病分类（category_primary）限定检索范围
+- 向量路径：Milvus 过滤表达式（category_primary 为 partition key 时按分区裁剪，另建标量索引）；
+  科室默认不下推（旧版 Milvus 不支持非前缀的 like），由检索结果精确后过滤并在不足 top_k 时扩大 limit 重试；
+  本地向量索引按文档位图屏蔽范围外的向量
+- 关键词路径：BM25 按预计算的文档位图只对范围内的文档打分
+- 规则路径：词典命中后按同一规则过滤
+科室字段为「、」拼接的多值字符串，按拆分后的元素精确匹配；分类为单值，精确匹配。
+"""
+from typing import Any, Dict, Optional, Tuple
+
+from rule_matcher import split_field
+
+# 病症库多值字段的拼接分隔符（knowledge_base 入库时以「、」拼接）
+_FIELD_SEPARATOR = "、"
+
+
+def quote_literal(value: str) -> str:
+    """Milvus 表达式中的字符串字面量（转义引号与反斜杠）"""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def like_pattern(value: str) -> str:
+    """like 模式中的字面量（转义通配符 % / _ 与反斜杠），结果仍需经 quote_literal"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class MetadataFilter:
+    """检索范围过滤条件；各条件之间为「且」关系，未设置的条件不限制"""
+
+    # matches 用到的文档字段（BM25 / 本地向量索引的过滤位图只投影这些字段）
+    fields = ("category_primary", "cure_department")
+
+    def __init__(self, department: Optional[str] = None, category: Optional[str] = None):
+        self.department = (department or "").strip() or None
+        self.category = (category or "").strip() or None
+
+    @classmethod
+    def from_request(cls, request: Any) -> Optional["MetadataFilter"]:
+        """从请求对象（含 department / category 字段）构造；无任何条件时返回 None"""
+        metadata_filter = cls(getattr(request, "department", None), getattr(request, "category", None))
+        return metadata_filter if metadata_filter else None
+
+    def __bool__(self) -> bool:
+        return bool(self.department or self.category)
+
+    def __repr__(self) -> str:
+        return f"MetadataFilter(department={self.department!r}, category={self.category!r})"
+
+    @property
+    def key(self) -> Tuple[Optional[str], Optional[str]]:
+        """位图缓存 / 结果缓存使用的 key"""
+        return self.department, self.category
+
+    def to_dict(self) -> Dict[str, str]:
+        return {k: v for k, v in (("department", self.department), ("category", self.category)) if v}
+
+    def matches(self, doc: Dict[str, Any]) -> bool:
+        """文档（病症库 schema 字段）是否在过滤范围内"""
+        if self.category and (doc.get("category_primary") or "") != self.category:
+            return False
+        if self.department and self.department not in split_field(doc.get("cure_department")):
+            return False
+        return True
+
+    def milvus_expr(self, department_pushdown: bool = False) -> str:
+        """
+        Milvus 过滤表达式。category_primary 为 partition key 时等值条件只搜索对应分区。
+        科室为「、」拼接的多值字段：department_pushdown 时按元素精确匹配（整串相等 / 首 / 中 / 尾元素，
+        后缀与中缀 like 需 Milvus 2.3+），否则不下推，由调用方用 matches 后过滤。
+        """
+        clauses = []
+        if self.category:
+            clauses.append(f"category_primary == {quote_literal(self.category)}")
+        if self.department and department_pushdown:
+            sep = _FIELD_SEPARATOR
+            value = like_pattern(self.department)
+            clauses.append(
+                f"(cure_department == {quote_literal(self.department)}"
+                f" or cure_department like {quote_literal(value + sep + '%')}"
+                f" or cure_department like {quote_literal('%' + sep + value)}"
+                f" or cure_department like {quote_literal('%' + sep + value + sep + '%')})"
+            )
+        return " and ".join(clauses)
+
+    def needs_post_filter(self, department_pushdown: bool = False) -> bool:
+        """milvus_expr 未能完整表达的条件（未下推的科室）需在检索结果上后过滤"""
+        return bool(self.department) and not department_pushdown
@@ -0,0 +1,96 @@
+"""
+跨请求微批处理（asyncio）
+并发问诊时，每个请求各自发起一次 embedding HTTP 调用和一次向量搜索。MicroBatcher 把短时间窗口内
+（默认 5ms，或攒满 32 条）到达的单条请求合并为一次批量调用，再把结果按顺序分发回各个等待中的请求：
+峰值时吞吐更高、连接数更少，单请求最多多等一个窗口。
+参数不同、不能合并到同一次调用的请求（如向量搜索的 top_k / 过滤条件）按 key 分组分别成批。
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Set, Tuple
+
+
+class MicroBatcher:
+    """
+    batch_fn(key, items) 接收同一 key 下的一批输入，返回与 items 等长、顺序一致的结果列表。
+    submit(item, key) 挂起直到所在批次完成；批量调用抛出的异常会传给该批次内的每个请求。
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[Hashable, List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        name: str = "",
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.name = name
+        # key → 等待中的 [(输入, Future)]；key → 窗口到期时触发 flush 的定时句柄
+        self._pending: Dict[Hashable, List[Tuple[Any, asyncio.Future]]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        # 执行中的批次任务：事件循环只持有弱引用，需保留强引用直到完成，避免被垃圾回收
+        self._tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.items = 0
+        self.max_seen = 0
+        self.batch_ms_total = 0.0
+
+    async def submit(self, item: Any, key: Hashable = None) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((item, future))
+        if len(pending) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.max_wait, self._flush, key)
+        return await future
+
+    def _flush(self, key: Hashable):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, [])
+        if batch:
+            task = asyncio.ensure_future(self._run(key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Hashable, batch: List[Tuple[Any, asyncio.Future]]):
+        start = time.perf_counter()
+        try:
+            results = await self.batch_fn(key, [item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self.name} 批量调用返回 {len(results)} 条结果，期望 {len(batch)} 条")
+        except asyncio.CancelledError:
+            # 批次任务被取消（如服务关闭）：取消等待中的请求，不让其永久挂起
+            for _, future in batch:
+                if not future.done():
+                    future.cancel()
+            raise
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                # 调用方超时取消后 Future 已完成，跳过
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.batches += 1
+            self.items += len(batch)
+            self.max_seen = max(self.max_seen, len(batch))
+            self.batch_ms_total += (time.perf_counter() - start) * 1000
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_seen,
+            "avg_batch_ms": self.batch_ms_total / self.batches if self.batches else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+        }
@@ -0,0 +1,104 @@
+"""
+Milvus 向量索引参数
+索引类型、距离度量与建索引 / 搜索参数统一由 Settings 配置（MILVUS_INDEX_TYPE 等），
+未显式配置的参数按索引类型取默认值。知识库建 collection、检索器搜索与 tune_milvus_index.py 调参共用。
+"""
+import json
+from typing import Any, Dict, Optional
+
+from config import settings
+
+MILVUS_INDEX_TYPES = ("FLAT", "IVF_FLAT", "IVF_SQ8", "IVF_PQ", "HNSW")
+MILVUS_METRIC_TYPES = ("L2", "IP", "COSINE")
+
+# 各索引类型的默认建索引参数（nlist 与原有 IVF_FLAT 索引一致为 128；病症库 collection 沿用 256，见 build_index_params 的 defaults）
+DEFAULT_BUILD_PARAMS: Dict[str, Dict[str, Any]] = {
+    "FLAT": {},
+    "IVF_FLAT": {"nlist": 128},
+    "IVF_SQ8": {"nlist": 128},
+    # m 需整除向量维度（1536 / 48 = 32 维一个子空间）
+    "IVF_PQ": {"nlist": 128, "m": 48, "nbits": 8},
+    "HNSW": {"M": 16, "efConstruction": 200},
+}
+
+# 各索引类型的默认搜索参数
+DEFAULT_SEARCH_PARAMS: Dict[str, Dict[str, Any]] = {
+    "FLAT": {},
+    "IVF_FLAT": {"nprobe": 10},
+    "IVF_SQ8": {"nprobe": 10},
+    "IVF_PQ": {"nprobe": 10},
+    "HNSW": {"ef": 64},
+}
+
+
+def parse_params(text: Optional[str]) -> Dict[str, Any]:
+    """解析 JSON 形式的参数配置（如 '{"nlist": 1024}'），空串返回 {}"""
+    if not text or not text.strip():
+        return {}
+    params = json.loads(text)
+    if not isinstance(params, dict):
+        raise ValueError(f"Milvus 索引参数需为 JSON 对象: {text}")
+    return params
+
+
+def _check_index_type(index_type: str) -> str:
+    index_type = index_type.upper()
+    if index_type not in MILVUS_INDEX_TYPES:
+        raise ValueError(f"未知的 Milvus 索引类型: {index_type}，可选 {', '.join(MILVUS_INDEX_TYPES)}")
+    return index_type
+
+
+def _check_metric_type(metric_type: str) -> str:
+    metric_type = metric_type.upper()
+    if metric_type not in MILVUS_METRIC_TYPES:
+        raise ValueError(f"未知的 Milvus 距离度量: {metric_type}，可选 {', '.join(MILVUS_METRIC_TYPES)}")
+    return metric_type
+
+
+def build_index_params(
+    index_type: Optional[str] = None,
+    metric_type: Optional[str] = None,
+    params: Optional[Dict[str, Any]] = None,
+    defaults: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    create_index 使用的 index_params。
+    未传入的项取 Settings；params 覆盖该索引类型的默认参数（Settings 中的参数仅在索引类型也取自 Settings 时生效）。
+    defaults 为调用方的默认值（如某个 collection 的 nlist），只替换该索引类型已有的参数项，优先级低于 Settings 与 params。
+    """
+    use_settings = index_type is None
+    index_type = _check_index_type(index_type or settings.milvus_index_type)
+    metric_type = _check_metric_type(metric_type or settings.milvus_metric_type)
+    merged = dict(DEFAULT_BUILD_PARAMS[index_type])
+    merged.update({key: value for key, value in (defaults or {}).items() if key in merged})
+    if use_settings:
+        merged.update(parse_params(settings.milvus_index_params))
+    merged.update(params or {})
+    return {"index_type": index_type, "metric_type": metric_type, "params": merged}
+
+
+def build_search_params(
+    index_type: Optional[str] = None,
+    metric_type: Optional[str] = None,
+    params: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """collection.search 使用的 param（度量需与建索引时一致）"""
+    use_settings = index_type is None
+    index_type = _check_index_type(index_type or settings.milvus_index_type)
+    metric_type = _check_metric_type(metric_type or settings.milvus_metric_type)
+    merged = dict(DEFAULT_SEARCH_PARAMS[index_type])
+    if use_settings:
+        merged.update(parse_params(settings.milvus_search_params))
+    merged.update(params or {})
+    return {"metric_type": metric_type, "params": merged}
+
+
+def distance_to_similarity(distance: float, metric_type: Optional[str] = None) -> float:
+    """
+    Milvus 返回的 distance 转为「越大越相似」的相似度：
+    L2 距离越小越相似，映射为 1 / (1 + d)；IP / COSINE 本身即相似度，直接返回。
+    """
+    metric_type = (metric_type or settings.milvus_metric_type).upper()
+    if metric_type == "L2":
+        return 1 / (1 + distance)
+    return float(distance)
@@ -17,6 +17,8 @@ class ConsultRequest(BaseModel):
     session_id: Optional[str] = Field(default=None, description="会话ID，用于从 Redis 拉取/写入对话历史，不传则无多轮上下文")
     user_id: Optional[str] = Field(default=None, description="用户ID，用于缓存")
     history: Optional[List[Message]] = Field(default=None, description="已废弃：历史由服务端按 session_id 从 Redis 读取，前端无需传")
+    department: Optional[str] = Field(default=None, description="限定就诊科室（如「呼吸内科」），只在该科室的病症中检索")
+    category: Optional[str] = Field(default=None, description="限定疾病分类（病症库 category_primary），只在该分类中检索")
 
 
 class KnowledgeSource(BaseModel):
@@ -46,3 +48,17 @@ class IncrementalUpdate(BaseModel):
     """增量更新请求"""
     documents: List[Document] = Field(..., description="待更新的文档列表")
     update_type: str = Field(..., description="更新类型：add/update/delete")
+
+
+class BatchRetrieveRequest(BaseModel):
+    """批量检索请求（评估 / 离线任务）"""
+    queries: List[str] = Field(..., description="检索查询列表（直接用于检索，不做改写）")
+    top_k: Optional[int] = Field(default=None, description="每条查询返回条数，默认 TOP_K_RERANK")
+    department: Optional[str] = Field(default=None, description="限定就诊科室")
+    category: Optional[str] = Field(default=None, description="限定疾病分类（category_primary）")
+
+
+class BatchRetrieveResponse(BaseModel):
+    """批量检索响应"""
+    results: List[List[KnowledgeSource]] = Field(default=[], description="与 queries 一一对应的检索结果")
+    timings: Dict[str, Any] = Field(default={}, description="整批各阶段耗时（ms）")
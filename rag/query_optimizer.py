@@ -1,14 +1,23 @@
 """
 用户提问优化模块
 提供 Query Rewriting（LLM 改写）与关键词规范化，提升 RAG 检索效果。
+改写前先用 needs_rewrite 判断是否值得一次 LLM 往返（自适应门控），改写结果可按 (问题, 历史) 缓存。
 详见 docs/query_optimization.md
 """
-from typing import List, Optional
+import json
+import os
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
 from langchain_openai import ChatOpenAI
-from config import settings
+from config import settings, resolve_path
+from rewrite_cache import RewriteCache
+from rule_matcher import AhoCorasick
 
 
-# 医疗常见同义词/口语 → 规范表述（便于 BM25/规则 命中）
+# 医疗常见同义词/口语 → 规范表述（便于 BM25/规则 命中）；
+# 手工维护的高频条目，优先于 build_synonyms.py 从 medical.txt 挖掘生成的词表（MEDICAL_SYNONYMS_PATH）
 MEDICAL_SYNONYM_MAP = {
     "头疼": "头痛",
     "脑袋疼": "头痛",
@@ -35,52 +44,197 @@ MEDICAL_SYNONYM_MAP = {
 }
 
 
+class SynonymNormalizer:
+    """
+    口语 / 同义词 → 规范表述的单遍替换：词表编译进 Aho-Corasick 自动机，
+    一次扫描取从左到右互不重叠的最长匹配（「恶心想吐」整体替换，不会先被「想吐」截断），
+    耗时与查询长度线性相关，不随词表条数增长。
+    """
+
+    def __init__(self, mapping: Dict[str, str]):
+        self.automaton = AhoCorasick()
+        for colloquial, standard in mapping.items():
+            if colloquial and colloquial != standard:
+                self.automaton.add(colloquial, standard)
+        self.automaton.build()
+
+    def __len__(self) -> int:
+        return len(self.automaton)
+
+    def normalize(self, text: str) -> str:
+        parts = []
+        pos = 0
+        for start, end, idx in self.automaton.longest_matches(text):
+            parts.append(text[pos:start])
+            parts.append(self.automaton.values(idx)[0])
+            pos = end
+        parts.append(text[pos:])
+        return "".join(parts)
+
+
+def load_synonym_lexicon(path: str) -> Dict[str, str]:
+    """读取 build_synonyms.py 生成的词表（{"synonyms": {口语: 规范表述}}）；文件不存在时返回空表"""
+    if not path or not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        synonyms = data.get("synonyms", {}) if isinstance(data, dict) else {}
+        return {str(k): str(v) for k, v in synonyms.items()}
+    except Exception as e:
+        print(f"⚠️ 同义词表加载失败，仅使用内置词表: {e}")
+        return {}
+
+
+_normalizer: Optional[SynonymNormalizer] = None
+_normalizer_lock = threading.Lock()
+
+
+def get_synonym_normalizer() -> SynonymNormalizer:
+    """进程内共享的规范化自动机：生成词表 + 内置 MEDICAL_SYNONYM_MAP（内置条目优先），首次使用时编译"""
+    global _normalizer
+    if _normalizer is None:
+        with _normalizer_lock:
+            if _normalizer is None:
+                mapping = load_synonym_lexicon(resolve_path(settings.medical_synonyms_path))
+                generated = len(mapping)
+                mapping.update(MEDICAL_SYNONYM_MAP)
+                _normalizer = SynonymNormalizer(mapping)
+                if generated:
+                    print(f"✅ 同义词规范化词表：{len(_normalizer)} 条（其中生成 {generated} 条）")
+    return _normalizer
+
+
 def normalize_keywords(query: str) -> str:
     """
     关键词规范化：将口语/同义词替换为知识库中更常见的表述，提升 BM25/规则召回。
     """
     if not query or not query.strip():
         return query
-    text = query.strip()
-    for colloquial, standard in MEDICAL_SYNONYM_MAP.items():
-        if colloquial in text:
-            text = text.replace(colloquial, standard)
-    return text
+    return get_synonym_normalizer().normalize(query.strip())
 
 
-def rewrite_query_for_retrieval(
+def _strip_spaces_and_punctuation(text: str) -> str:
+    return "".join(ch for ch in text if not ch.isspace() and not unicodedata.category(ch).startswith("P"))
+
+
+def normalize_question(question: str) -> str:
+    """
+    问题的规范形式（用于缓存 key，不用于检索）：全角转半角（NFKC）、英文小写、去掉空白与标点、同义词规范化，
+    使「头疼怎么办？」「头痛 怎么办」等写法得到同一个 key。
+    """
+    text = _strip_spaces_and_punctuation(unicodedata.normalize("NFKC", question or "").lower())
+    # 同义词替换可能引入空格（如「恶心 呕吐」），替换后再清理一次
+    return _strip_spaces_and_punctuation(normalize_keywords(text) or "")
+
+
+_llm: Optional[ChatOpenAI] = None
+_llm_lock = threading.Lock()
+
+
+def _default_llm() -> ChatOpenAI:
+    """进程内共享的改写客户端（复用底层 HTTP 连接池），首次使用时创建"""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                _llm = ChatOpenAI(
+                    openai_api_key=settings.openai_api_key,
+                    openai_api_base=settings.openai_api_base,
+                    model=settings.openai_model,
+                    temperature=0.1,
+                )
+    return _llm
+
+
+# ---------- 自适应改写门控 ----------
+
+# 指代 / 承接上文的词：出现时需要结合历史补全
+DEICTIC_WORDS = (
+    "这个", "那个", "这种", "那种", "这些", "那些", "这样", "那样",
+    "上面", "上述", "前面", "刚才", "刚刚", "之前", "以上",
+    "它", "它们", "该药", "该病", "此药", "这药", "那药", "这病", "那病",
+)
+# 省略主语的追问开头（如「那孩子呢」「还需要注意什么」）
+FOLLOW_UP_PREFIXES = ("那", "还", "再", "也", "另外", "其他", "除了")
+
+# 门控结果计数：原因 → 次数
+rewrite_gate_counts: Counter = Counter()
+
+
+def needs_rewrite(question: str, history: Optional[List] = None) -> Tuple[bool, str]:
+    """
+    判断是否需要 LLM 改写，返回 (是否改写, 原因)。
+    - 有历史：含指代词、以承接词开头或问题很短（多为省略式追问）时改写
+    - 无历史：指代无从补全，只有较长的口语化描述才值得改写提炼
+    - 其余（短小、自包含的问题）直接走规范化，省去一次 LLM 往返
+    """
+    text = (question or "").strip()
+    if history:
+        if any(word in text for word in DEICTIC_WORDS):
+            return True, "deictic"
+        if text.startswith(FOLLOW_UP_PREFIXES):
+            return True, "follow_up"
+        if len(text) <= settings.query_rewrite_short_chars:
+            return True, "short_follow_up"
+    if len(text) >= settings.query_rewrite_long_chars:
+        return True, "long"
+    return False, "standalone"
+
+
+def should_rewrite(
     question: str,
     history: Optional[List] = None,
-    llm: Optional[ChatOpenAI] = None,
-) -> str:
+    *,
+    enable_rewrite: bool = True,
+    adaptive_rewrite: bool = True,
+) -> bool:
     """
-    使用 LLM 将用户问题改写成更利于检索的表述（保留医学关键信息、补全指代）。
-    若 LLM 调用失败或未配置，则返回原问题。
+    改写门控：决定本次是否调用 LLM 改写，并计入 rewrite_stats。
+    每个问题只调用一次；调用方已做出决定时把结果经 rewrite_decision 传给 optimize / aoptimize，避免重复判定与重复计数。
     """
-    if not question or not question.strip():
-        return question
+    if not enable_rewrite or not question or not question.strip():
+        return False
+    if not adaptive_rewrite:
+        rewrite_gate_counts["always"] += 1
+        return True
+    rewrite, reason = needs_rewrite(question.strip(), history)
+    rewrite_gate_counts[reason] += 1
+    return rewrite
+
+
+def rewrite_stats() -> dict:
+    """门控统计：各原因的次数与跳过改写的比例"""
+    total = sum(rewrite_gate_counts.values())
+    skipped = rewrite_gate_counts.get("standalone", 0)
+    return {
+        "reasons": dict(rewrite_gate_counts),
+        "skipped": skipped,
+        "skip_rate": skipped / total if total else 0.0,
+    }
 
-    if llm is None:
-        llm = ChatOpenAI(
-            openai_api_key=settings.openai_api_key,
-            openai_api_base=settings.openai_api_base,
-            model=settings.openai_model,
-            temperature=0.1,
-        )
 
+def _build_rewrite_prompt(question: str, history: Optional[List] = None) -> str:
+    """构建改写提示（同步 / 异步改写共用）"""
     history_context = ""
     if history and len(history) > 0:
-        recent = history[-6:]  # 最近几轮
+        summary_parts = []
         parts = []
-        for msg in recent:
+        for msg in history:
             role = getattr(msg, "role", None) or (msg.get("role") if isinstance(msg, dict) else None)
             content = getattr(msg, "content", None) or (msg.get("content") if isinstance(msg, dict) else "")
-            if role and content:
+            if role == "summary" and content:
+                # 服务端滚动摘要（见 chat_history），覆盖最近窗口之前的对话
+                summary_parts = [content]
+            elif role and content:
                 parts.append(f"{role}: {content}")
+        parts = parts[-6:]  # 最近几轮
+        if summary_parts:
+            history_context = "此前对话摘要：\n" + summary_parts[0] + "\n\n"
         if parts:
-            history_context = "最近对话：\n" + "\n".join(parts) + "\n\n"
+            history_context += "最近对话：\n" + "\n".join(parts) + "\n\n"
 
-    prompt = f"""你是一个医疗问诊检索助手。请将用户的提问改写成一句「仅包含医学相关关键信息的检索用问句」，用于在医疗知识库中检索。
+    return f"""你是一个医疗问诊检索助手。请将用户的提问改写成一句「仅包含医学相关关键信息的检索用问句」，用于在医疗知识库中检索。
 
 要求：
 1. 保留症状、部位、药物、疾病、检查等关键信息；
@@ -93,10 +247,67 @@ def rewrite_query_for_retrieval(
 
 改写后的检索用问句："""
 
+
+def rewrite_query_for_retrieval(
+    question: str,
+    history: Optional[List] = None,
+    llm: Optional[ChatOpenAI] = None,
+    cache: Optional[RewriteCache] = None,
+) -> str:
+    """
+    使用 LLM 将用户问题改写成更利于检索的表述（保留医学关键信息、补全指代）。
+    给定 cache 时先查 (规范化问题, 历史) 的改写缓存（同步接口只用进程内一级）。
+    若 LLM 调用失败或未配置，则返回原问题。
+    """
+    if not question or not question.strip():
+        return question
+
+    key = cache.key(normalize_question(question), history) if cache else None
+    if cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    if llm is None:
+        llm = _default_llm()
+
+    try:
+        response = llm.invoke(_build_rewrite_prompt(question, history))
+        rewritten = (response.content or "").strip()
+        if rewritten:
+            if cache:
+                cache.set(key, rewritten)
+            return rewritten
+    except Exception as e:
+        print(f"⚠️ Query 改写失败，使用原问题: {e}")
+    return question
+
+
+async def arewrite_query_for_retrieval(
+    question: str,
+    history: Optional[List] = None,
+    llm: Optional[ChatOpenAI] = None,
+    cache: Optional[RewriteCache] = None,
+) -> str:
+    """rewrite_query_for_retrieval 的异步版本（llm.ainvoke），供 FastAPI 处理函数 await，不阻塞事件循环；缓存含 Redis 一级。"""
+    if not question or not question.strip():
+        return question
+
+    key = cache.key(normalize_question(question), history) if cache else None
+    if cache:
+        cached = await cache.aget(key)
+        if cached is not None:
+            return cached
+
+    if llm is None:
+        llm = _default_llm()
+
     try:
-        response = llm.invoke(prompt)
+        response = await llm.ainvoke(_build_rewrite_prompt(question, history))
         rewritten = (response.content or "").strip()
         if rewritten:
+            if cache:
+                await cache.aset(key, rewritten)
             return rewritten
     except Exception as e:
         print(f"⚠️ Query 改写失败，使用原问题: {e}")
@@ -109,18 +320,49 @@ def optimize(
     *,
     enable_rewrite: bool = True,
     enable_normalize: bool = True,
+    adaptive_rewrite: bool = True,
+    rewrite_decision: Optional[bool] = None,
     llm: Optional[ChatOpenAI] = None,
+    cache: Optional[RewriteCache] = None,
 ) -> str:
     """
-    统一入口：先改写（可选），再规范化（可选），返回用于检索的 query。
-    回答与缓存仍应使用原始 question。
+    统一入口：先改写（可选，adaptive_rewrite 时只在 needs_rewrite 判定需要时调用 LLM），再规范化（可选），
+    返回用于检索的 query。回答与缓存仍应使用原始 question。
+    rewrite_decision 为调用方已由 should_rewrite 做出的决定，给定时不再判定（enable_rewrite / adaptive_rewrite 不起作用）。
     """
     if not question or not question.strip():
         return question
 
     q = question.strip()
-    if enable_rewrite:
-        q = rewrite_query_for_retrieval(q, history=history, llm=llm)
+    if rewrite_decision is None:
+        rewrite_decision = should_rewrite(q, history, enable_rewrite=enable_rewrite, adaptive_rewrite=adaptive_rewrite)
+    if rewrite_decision:
+        q = rewrite_query_for_retrieval(q, history=history, llm=llm, cache=cache)
+    if enable_normalize:
+        q = normalize_keywords(q)
+    return q
+
+
+async def aoptimize(
+    question: str,
+    history: Optional[List] = None,
+    *,
+    enable_rewrite: bool = True,
+    enable_normalize: bool = True,
+    adaptive_rewrite: bool = True,
+    rewrite_decision: Optional[bool] = None,
+    llm: Optional[ChatOpenAI] = None,
+    cache: Optional[RewriteCache] = None,
+) -> str:
+    """optimize 的异步版本。"""
+    if not question or not question.strip():
+        return question
+
+    q = question.strip()
+    if rewrite_decision is None:
+        rewrite_decision = should_rewrite(q, history, enable_rewrite=enable_rewrite, adaptive_rewrite=adaptive_rewrite)
+    if rewrite_decision:
+        q = await arewrite_query_for_retrieval(q, history=history, llm=llm, cache=cache)
     if enable_normalize:
         q = normalize_keywords(q)
     return q
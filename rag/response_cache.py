@@ -0,0 +1,147 @@
+"""
+问诊响应缓存：进程内 LRU（条数 / 字节上限）+ Redis 两级。
+- 热点回答在进程内命中：不走网络、不做 json.loads / pydantic 解析，直接返回 ConsultResponse 对象
+- Redis key 带版本号（consult:...:v{N}），知识库变更时 INCR 版本并 PUBLISH 到失效频道，
+  各 worker 订阅后切换版本并清空本进程一级；订阅断开期间旧条目最多再存活 RESPONSE_CACHE_LOCAL_TTL 秒
+- 使用 redis.asyncio 客户端（与对话历史共用连接池），读取可与其他命令合并进同一 pipeline（见 redis_key / accept）
+- Redis 不可用时退化为仅进程内缓存
+"""
+import asyncio
+import json
+from typing import Any, Dict, Optional
+
+from caching import HitCounter, LRUCache
+from models import ConsultResponse
+
+RESPONSE_CACHE_VERSION_KEY = "consult:version"
+RESPONSE_CACHE_INVALIDATE_CHANNEL = "consult:invalidate"
+
+
+def _response_size(response: ConsultResponse) -> int:
+    """进程内条目的字节数估算（回答 + 来源正文，UTF-8）"""
+    size = len(response.answer.encode("utf-8"))
+    size += sum(len(s.content.encode("utf-8")) for s in response.sources)
+    size += sum(len(s.encode("utf-8")) for s in response.suggestions)
+    return size + 256
+
+
+class ResponseCache:
+    """两级问诊响应缓存；进程内命中返回的对象为共享只读实例"""
+
+    def __init__(
+        self,
+        redis_client: Any = None,
+        ttl: int = 3600,
+        local_max_items: int = 1000,
+        local_max_bytes: Optional[int] = 32 * 1024 * 1024,
+        local_ttl: int = 300,
+    ):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.local = LRUCache(max_items=local_max_items, max_bytes=local_max_bytes, ttl=min(local_ttl, ttl), sizeof=_response_size)
+        self.redis_counter = HitCounter()
+        self.version = "0"
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+
+    # ---------- 版本与失效 ----------
+
+    async def start(self):
+        """读取当前版本并订阅失效频道（后台任务）"""
+        if self.redis is None:
+            return
+        try:
+            self.version = str(await self.redis.get(RESPONSE_CACHE_VERSION_KEY) or "0")
+            self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            await self._pubsub.subscribe(**{RESPONSE_CACHE_INVALIDATE_CHANNEL: self._on_invalidate})
+            self._listener = asyncio.create_task(self._listen())
+        except Exception as e:
+            print(f"⚠️  响应缓存失效订阅失败，进程内缓存仅按 TTL 过期: {e}")
+
+    async def _listen(self):
+        """消息由 subscribe 注册的回调处理；连接异常时稍后重试"""
+        while True:
+            try:
+                await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️  响应缓存失效订阅异常，1 秒后重试: {e}")
+                await asyncio.sleep(1.0)
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    def _on_invalidate(self, message: Dict[str, Any]):
+        data = message.get("data")
+        self.version = data.decode("utf-8") if isinstance(data, bytes) else str(data)
+        self.local.clear()
+        print(f"🧹 响应缓存已失效（版本 {self.version}）")
+
+    async def invalidate(self):
+        """知识库变更后调用：递增版本并通知所有 worker 清空进程内一级"""
+        self.local.clear()
+        if self.redis is None:
+            self.version = str(int(self.version) + 1)
+            return
+        try:
+            self.version = str(await self.redis.incr(RESPONSE_CACHE_VERSION_KEY))
+            await self.redis.publish(RESPONSE_CACHE_INVALIDATE_CHANNEL, self.version)
+        except Exception as e:
+            print(f"⚠️  响应缓存失效通知失败: {e}")
+
+    def redis_key(self, key: str) -> str:
+        """当前版本下的 Redis key（调用方可把 GET 合并进自己的 pipeline，再用 accept 处理结果）"""
+        return f"{key}:v{self.version}"
+
+    # ---------- 读写 ----------
+
+    def get_local(self, key: str) -> Optional[ConsultResponse]:
+        return self.local.get(self.redis_key(key))
+
+    def accept(self, key: str, cached: Any) -> Optional[ConsultResponse]:
+        """处理 Redis GET 的返回值：记录命中统计，解析并写入进程内一级"""
+        self.redis_counter.record(bool(cached))
+        if not cached:
+            return None
+        response = ConsultResponse(**json.loads(cached))
+        self.local.set(self.redis_key(key), response)
+        return response
+
+    async def get(self, key: str) -> Optional[ConsultResponse]:
+        response = self.get_local(key)
+        if response is not None or self.redis is None:
+            return response
+        try:
+            cached = await self.redis.get(self.redis_key(key))
+        except Exception as e:
+            self.redis_counter.error()
+            print(f"⚠️  缓存读取失败: {e}")
+            return None
+        return self.accept(key, cached)
+
+    async def set(self, key: str, response: ConsultResponse, ttl: Optional[int] = None):
+        redis_key = self.redis_key(key)
+        self.local.set(redis_key, response)
+        if self.redis is None:
+            return
+        try:
+            await self.redis.setex(redis_key, ttl or self.ttl, json.dumps(response.model_dump(), ensure_ascii=False))
+        except Exception as e:
+            print(f"⚠️  缓存写入失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "local": self.local.stats(),
+            "redis": {"enabled": self.redis is not None, **self.redis_counter.stats()},
+        }
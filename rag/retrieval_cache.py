@@ -0,0 +1,190 @@
+"""
+检索结果缓存：进程内 LRU + Redis 共享两级缓存，挡在 retrieve() 前面，不同用户问同一问题时共享结果。
+- key：检索相关配置指纹 + 知识库版本 + 规范化检索查询 + top_k + 过滤条件的稳定摘要
+- 值：重排后的 KnowledgeSource 列表（Redis 中为 JSON）
+- 知识库版本 = collection 代标识 + Redis 中的版本计数器；增量更新 / 重建时递增计数器，
+  各 worker 最多 RETRIEVAL_CACHE_VERSION_CHECK_INTERVAL 秒后读到新版本，旧 key 自然不再命中
+- 召回有路径超时 / 失败降级或结果为空时不写缓存
+- Redis 不可用时退化为仅进程内缓存
+"""
+import asyncio
+import json
+import time
+from typing import Any, List, Optional, Tuple
+
+from caching import LRUCache, normalize_query, stable_digest
+from config import settings
+from models import KnowledgeSource
+
+RETRIEVAL_CACHE_KEY_PREFIX = "retr:"
+RETRIEVAL_CACHE_VERSION_KEY = "retr:kb_version"
+
+# 影响检索结果的配置项，任一变化都会换一批 key
+RETRIEVAL_SETTINGS_FIELDS = (
+    "embedding_model",
+    "openai_model",
+    "vector_backend",
+    "milvus_index_type",
+    "milvus_metric_type",
+    "milvus_search_params",
+    "hnsw_ef_search",
+    "keyword_search_backend",
+    "top_k_retrieval",
+    "similarity_threshold",
+    "fusion_method",
+    "rrf_k",
+    "fusion_weight_vector",
+    "fusion_weight_keyword",
+    "fusion_weight_rule",
+    "rerank_method",
+    "learned_reranker_path",
+)
+
+
+def retrieval_settings_fingerprint() -> str:
+    return stable_digest(*(f"{name}={getattr(settings, name)}" for name in RETRIEVAL_SETTINGS_FIELDS))
+
+
+class RetrievalCache:
+    """两级检索结果缓存，统计各级命中/未命中次数"""
+
+    def __init__(
+        self,
+        redis_client: Any = None,
+        generation: Optional[str] = None,
+        max_items: int = 2000,
+        ttl: int = 3600,
+        version_check_interval: float = 1.0,
+    ):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.generation = generation
+        self.version_check_interval = version_check_interval
+        # 进程内保存 KnowledgeSource 元组，命中时无需反序列化
+        self.local = LRUCache(max_items=max_items, ttl=ttl)
+        self._settings = retrieval_settings_fingerprint()
+        self._version = "0"
+        self._version_checked_at: Optional[float] = None
+        self.redis_hits = 0
+        self.redis_misses = 0
+
+    # ---------- 知识库版本 ----------
+
+    def _version_stale(self) -> bool:
+        return self.redis is not None and (
+            self._version_checked_at is None
+            or time.monotonic() - self._version_checked_at >= self.version_check_interval
+        )
+
+    def _refresh_version(self):
+        """按间隔从 Redis 读取版本计数器（其他 worker 更新知识库后递增）"""
+        if not self._version_stale():
+            return
+        try:
+            raw = self.redis.get(RETRIEVAL_CACHE_VERSION_KEY)
+            self._version = raw.decode("utf-8") if isinstance(raw, bytes) else str(raw or "0")
+        except Exception as e:
+            print(f"⚠️  检索缓存版本读取失败: {e}")
+        self._version_checked_at = time.monotonic()
+
+    def invalidate(self, generation: Optional[str] = None):
+        """知识库变更后调用：递增共享版本计数器并清空本进程缓存"""
+        if generation is not None:
+            self.generation = generation
+        self.local.clear()
+        if self.redis is not None:
+            try:
+                self._version = str(self.redis.incr(RETRIEVAL_CACHE_VERSION_KEY))
+                self._version_checked_at = time.monotonic()
+                return
+            except Exception as e:
+                print(f"⚠️  检索缓存版本更新失败: {e}")
+        self._version = str(int(self._version) + 1) if self._version.isdigit() else "1"
+
+    # ---------- 读写 ----------
+
+    def key(self, query: str, top_k: int, metadata_filter: Any = None) -> str:
+        return RETRIEVAL_CACHE_KEY_PREFIX + stable_digest(
+            self._settings,
+            self.generation,
+            self._version,
+            normalize_query(query),
+            top_k,
+            metadata_filter.key if metadata_filter else None,
+        )
+
+    def _get_redis(self, key: str) -> Optional[Tuple[KnowledgeSource, ...]]:
+        try:
+            raw = self.redis.get(key)
+        except Exception as e:
+            print(f"⚠️  检索缓存读取失败: {e}")
+            return None
+        if raw is None:
+            self.redis_misses += 1
+            return None
+        self.redis_hits += 1
+        sources = tuple(KnowledgeSource(**item) for item in json.loads(raw))
+        self.local.set(key, sources)
+        return sources
+
+    def _set_redis(self, key: str, sources: List[KnowledgeSource]):
+        try:
+            self.redis.setex(key, self.ttl, json.dumps([s.model_dump() for s in sources], ensure_ascii=False))
+        except Exception as e:
+            print(f"⚠️  检索缓存写入失败: {e}")
+
+    @staticmethod
+    def _copy(sources: Tuple[KnowledgeSource, ...]) -> List[KnowledgeSource]:
+        # 调用方可能修改返回的列表 / 对象（如联网搜索补充来源），缓存中保留原件
+        return [s.model_copy(deep=True) for s in sources]
+
+    def lookup(self, query: str, top_k: int, metadata_filter: Any = None) -> Tuple[str, Optional[List[KnowledgeSource]], Optional[str]]:
+        """返回 (key, 命中的结果或 None, 命中层级 local / redis)"""
+        self._refresh_version()
+        key = self.key(query, top_k, metadata_filter)
+        sources = self.local.get(key)
+        if sources is not None:
+            return key, self._copy(sources), "local"
+        if self.redis is not None:
+            sources = self._get_redis(key)
+            if sources is not None:
+                return key, self._copy(sources), "redis"
+        return key, None, None
+
+    async def alookup(self, query: str, top_k: int, metadata_filter: Any = None) -> Tuple[str, Optional[List[KnowledgeSource]], Optional[str]]:
+        """lookup 的异步版本：进程内命中不切线程，Redis 读取放到线程中"""
+        if self._version_stale():
+            await asyncio.to_thread(self._refresh_version)
+        key = self.key(query, top_k, metadata_filter)
+        sources = self.local.get(key)
+        if sources is not None:
+            return key, self._copy(sources), "local"
+        if self.redis is not None:
+            sources = await asyncio.to_thread(self._get_redis, key)
+            if sources is not None:
+                return key, self._copy(sources), "redis"
+        return key, None, None
+
+    def store(self, key: str, sources: List[KnowledgeSource]):
+        self.local.set(key, tuple(s.model_copy(deep=True) for s in sources))
+        if self.redis is not None:
+            self._set_redis(key, sources)
+
+    async def astore(self, key: str, sources: List[KnowledgeSource]):
+        self.local.set(key, tuple(s.model_copy(deep=True) for s in sources))
+        if self.redis is not None:
+            await asyncio.to_thread(self._set_redis, key, sources)
+
+    def stats(self) -> dict:
+        redis_total = self.redis_hits + self.redis_misses
+        return {
+            "generation": self.generation,
+            "version": self._version,
+            "local": self.local.stats(),
+            "redis": {
+                "enabled": self.redis is not None,
+                "hits": self.redis_hits,
+                "misses": self.redis_misses,
+                "hit_rate": self.redis_hits / redis_total if redis_total else 0.0,
+            },
+        }
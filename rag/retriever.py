@@ -4,13 +4,26 @@
 """
 import jieba
 import re
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from multiprocessing import Pool, cpu_count
-from typing import List, Dict, Any, Tuple
-from rank_bm25 import BM25Okapi
+from typing import List, Dict, Any, Tuple, Optional
 from pymilvus import Collection, connections
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from config import settings
+from config import settings, resolve_path
 from models import KnowledgeSource
+from bm25_index import BM25Index, snapshot_lock
+from embedding_cache import EmbeddingCache
+from fusion import fuse
+from learned_reranker import LearnedReranker
+from rule_matcher import DictionaryRecall
+from knowledge_base import collection_generation
+from vector_index import vector_index_class, vector_index_params
+from milvus_index import build_search_params, distance_to_similarity
+from metadata_filter import MetadataFilter
+from micro_batcher import MicroBatcher
+from retrieval_cache import RetrievalCache
 
 
 def _jieba_tokenize_one(text: str) -> List[str]:
@@ -52,13 +65,129 @@ class MultiPathRetriever:
                 print(f"   python build_knowledge.py")
             self.collection = None
         
-        # BM25索引（用于关键词检索）
+        # 查询向量缓存与检索结果缓存共用的 Redis 客户端（二进制，decode_responses=False）
+        self._cache_redis = self._init_cache_redis() if settings.enable_embedding_cache or settings.enable_retrieval_cache else None
+        
+        # 查询向量缓存（两级：进程内 LRU + Redis）
+        self.embedding_cache = self._init_embedding_cache()
+        
+        # 多路召回并行执行的线程池（超时路径仍占用线程直至结束，线程数需留有余量）
+        self._executor = ThreadPoolExecutor(max_workers=settings.retrieval_max_workers, thread_name_prefix="recall")
+        
+        # 跨请求微批处理：并发请求的查询向量化合并为一次 embed_documents，向量搜索合并为一次多向量搜索
+        self._embed_batcher = None
+        self._vector_batcher = None
+        if settings.enable_micro_batching:
+            self._embed_batcher = MicroBatcher(
+                self._embed_micro_batch, settings.micro_batch_max_size, settings.micro_batch_wait_ms, name="embedding"
+            )
+            self._vector_batcher = MicroBatcher(
+                self._vector_search_micro_batch, settings.micro_batch_max_size, settings.micro_batch_wait_ms, name="vector_search"
+            )
+        
+        # 本地向量索引（VECTOR_BACKEND=flat / hnsw 时替代 Milvus 做向量检索）
+        self.vector_index = None
+        self._build_vector_index()
+        
+        # BM25索引（用于关键词检索）与规则召回词典（疾病名 / 症状 Aho-Corasick 自动机）
         self.bm25_index = None
-        self.bm25_docs = []
+        self.dictionary_recall = None
         self._build_bm25_index()
         
         # 医疗关键词规则库
         self.medical_rules = self._load_medical_rules()
+        
+        # 学习型重排模型（RERANK_METHOD=learned 时使用）
+        self.learned_reranker = LearnedReranker.load(resolve_path(settings.learned_reranker_path)) if settings.rerank_method == "learned" else None
+        
+        # 检索结果缓存（两级：进程内 LRU + Redis，key 含知识库版本）
+        self.retrieval_cache = self._init_retrieval_cache()
+    
+    def _init_cache_redis(self):
+        """缓存用 Redis 客户端；连接失败时返回 None，各缓存仅使用进程内一级"""
+        try:
+            import redis
+            # 向量以二进制存储，单独使用 decode_responses=False 的客户端
+            redis_client = redis.Redis(
+                host=settings.redis_host,
+                port=settings.redis_port,
+                db=settings.redis_db,
+                decode_responses=False
+            )
+            redis_client.ping()
+            return redis_client
+        except Exception as e:
+            print(f"⚠️  缓存 Redis 不可用，仅使用进程内缓存: {e}")
+            return None
+    
+    def _init_embedding_cache(self) -> Optional[EmbeddingCache]:
+        """创建查询向量缓存；Redis 连接失败时仅使用进程内缓存"""
+        if not settings.enable_embedding_cache:
+            return None
+        
+        return EmbeddingCache(
+            model=settings.embedding_model,
+            redis_client=self._cache_redis,
+            max_items=settings.embedding_cache_max_items,
+            max_bytes=settings.embedding_cache_max_mb * 1024 * 1024,
+            ttl=settings.embedding_cache_ttl,
+        )
+    
+    def _init_retrieval_cache(self) -> Optional[RetrievalCache]:
+        if not settings.enable_retrieval_cache:
+            return None
+        return RetrievalCache(
+            redis_client=self._cache_redis,
+            generation=self._knowledge_generation(),
+            max_items=settings.retrieval_cache_max_items,
+            ttl=settings.retrieval_cache_ttl,
+            version_check_interval=settings.retrieval_cache_version_check_interval,
+        )
+    
+    def _knowledge_generation(self) -> Optional[str]:
+        """当前知识库的代标识：Milvus collection 优先，否则取本地向量索引快照的代"""
+        if self.collection:
+            return self._collection_generation()
+        return self.vector_index.generation if self.vector_index is not None else None
+    
+    def invalidate_retrieval_cache(self):
+        """知识库构建 / 增量更新后调用，使所有 worker 的检索结果缓存失效"""
+        if self.retrieval_cache is not None:
+            self.retrieval_cache.invalidate(self._knowledge_generation())
+            print("🧹 检索结果缓存已失效")
+    
+    def embed_query(self, query: str) -> List[float]:
+        """查询向量化（优先走向量缓存）"""
+        if self.embedding_cache is None:
+            return self.embeddings.embed_query(query)
+        return self.embedding_cache.embed(query, self.embeddings.embed_query)
+    
+    async def aembed_query(self, query: str) -> List[float]:
+        """查询向量化（异步，优先走向量缓存；未命中时经微批处理与并发请求合并调用）"""
+        aembed_fn = self._embed_batcher.submit if self._embed_batcher is not None else self.embeddings.aembed_query
+        if self.embedding_cache is None:
+            return await aembed_fn(query)
+        return await self.embedding_cache.aembed(query, aembed_fn)
+    
+    async def _embed_micro_batch(self, key: Any, queries: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(queries)
+    
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """批量查询向量化：未命中缓存的查询合并为一次 embed_documents 请求"""
+        if self.embedding_cache is None:
+            return self.embeddings.embed_documents(queries)
+        return self.embedding_cache.embed_many(queries, self.embeddings.embed_documents)
+    
+    async def aembed_queries(self, queries: List[str]) -> List[List[float]]:
+        """批量查询向量化（异步）"""
+        if self.embedding_cache is None:
+            return await self.embeddings.aembed_documents(queries)
+        return await self.embedding_cache.aembed_many(queries, self.embeddings.aembed_documents)
+    
+    @property
+    def bm25_docs(self):
+        """BM25 索引对应的文档库（按索引内文档下标访问）"""
+        return self.bm25_index.docs if self.bm25_index is not None else []
     
     # 病症库 schema 的字段（medical.txt 结构）
     MEDICAL_OUTPUT_FIELDS = ["id", "content", "name", "category_primary", "symptoms", "cure_department", "cure_way", "get_way", "cured_prob"]
@@ -66,74 +195,246 @@ class MultiPathRetriever:
     # 从 Milvus 分批拉取时的每批条数
     MILVUS_QUERY_BATCH_SIZE = 2000
     
-    def _build_bm25_index(self):
-        """构建BM25索引用于关键词检索（使用病症库 schema 字段，分批从 Milvus 拉取）"""
+    # 科室后过滤时单次搜索的 limit 上限（Milvus topk 上限 16384）与最多搜索轮数
+    MILVUS_MAX_LIMIT = 16384
+    MILVUS_FILTER_MAX_ROUNDS = 3
+    
+    def _collection_generation(self) -> Optional[str]:
+        """
+        collection 的「代」标识：collection_id + 行数。
+        重建 collection 会换 id，插入/更新会增加行数（删除在 compaction 前不减少），据此判断 BM25 快照是否过期。
+        """
+        try:
+            return collection_generation(self.collection)
+        except Exception as e:
+            print(f"⚠️  获取 collection 版本失败，不使用 BM25 快照: {e}")
+            return None
+    
+    def _fetch_all_docs(self, output_fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """分批从 Milvus 拉取全部文档（默认病症库 schema 字段，不含 embedding）"""
+        output_fields = output_fields or self.MEDICAL_OUTPUT_FIELDS
+        results = []
+        # 优先使用 query_iterator 分批拉取，避免单次 query 数据量过大
+        if hasattr(self.collection, "query_iterator"):
+            it = self.collection.query_iterator(
+                batch_size=self.MILVUS_QUERY_BATCH_SIZE,
+                limit=-1,
+                expr="id != ''",
+                output_fields=output_fields,
+            )
+            while True:
+                batch = it.next()
+                if not batch:
+                    it.close()
+                    break
+                results.extend(batch)
+                if len(batch) < self.MILVUS_QUERY_BATCH_SIZE:
+                    break
+        else:
+            # 兼容无 query_iterator 时：分批 query，用 id not in 排除已取
+            fetched_ids = set()
+            while True:
+                if fetched_ids:
+                    exclude = ", ".join(f'"{x}"' for x in fetched_ids)
+                    expr = f"id not in [{exclude}]"
+                else:
+                    expr = "id != ''"
+                batch = self.collection.query(
+                    expr=expr,
+                    output_fields=output_fields,
+                    limit=self.MILVUS_QUERY_BATCH_SIZE,
+                )
+                if not batch:
+                    break
+                for doc in batch:
+                    fid = doc.get("id")
+                    if fid and fid not in fetched_ids:
+                        fetched_ids.add(fid)
+                        results.append(doc)
+                if len(batch) < self.MILVUS_QUERY_BATCH_SIZE:
+                    break
+                if len(results) >= 50000:  # 安全上限
+                    break
+        return results
+    
+    def _tokenize_docs(self, docs: List[Dict[str, Any]]) -> List[List[str]]:
+        """分词：多进程并行加速，文档少时直接用主进程避免进程开销"""
+        contents = [doc.get("content") or "" for doc in docs]
+        n_docs = len(contents)
+        n_workers = min(max(1, cpu_count() - 1), n_docs, 8)
+        if n_workers <= 1 or n_docs < 100:
+            return [_jieba_tokenize_one(t) for t in contents]
+        with Pool(n_workers) as pool:
+            return pool.map(_jieba_tokenize_one, contents, chunksize=max(1, n_docs // (n_workers * 4)))
+    
+    def _build_bm25_index(self, force: bool = False):
+        """
+        构建BM25索引用于关键词检索（使用病症库 schema 字段，分批从 Milvus 拉取）
+        启用快照时优先 mmap 加载与当前 collection 版本一致的快照；否则重建并写入快照供其他 worker 复用。
+        force=True 时忽略已有快照（知识库刚被修改时使用）。
+        """
         if not self.collection:
+            # 无 Milvus 的本地部署：直接用本地向量索引的文档库构建
+            if self.vector_index is not None:
+                self._build_bm25_from_rows(list(self.vector_index.iter_live_documents()), None)
             return
         
         try:
-            results = []
-            # 优先使用 query_iterator 分批拉取，避免单次 query 数据量过大
-            if hasattr(self.collection, "query_iterator"):
-                it = self.collection.query_iterator(
-                    batch_size=self.MILVUS_QUERY_BATCH_SIZE,
-                    limit=-1,
-                    expr="id != ''",
-                    output_fields=self.MEDICAL_OUTPUT_FIELDS,
-                )
-                while True:
-                    batch = it.next()
-                    if not batch:
-                        it.close()
-                        break
-                    results.extend(batch)
-                    if len(batch) < self.MILVUS_QUERY_BATCH_SIZE:
-                        break
-            else:
-                # 兼容无 query_iterator 时：分批 query，用 id not in 排除已取
-                fetched_ids = set()
-                while True:
-                    if fetched_ids:
-                        exclude = ", ".join(f'"{x}"' for x in fetched_ids)
-                        expr = f"id not in [{exclude}]"
-                    else:
-                        expr = "id != ''"
-                    batch = self.collection.query(
-                        expr=expr,
-                        output_fields=self.MEDICAL_OUTPUT_FIELDS,
-                        limit=self.MILVUS_QUERY_BATCH_SIZE,
-                    )
-                    if not batch:
-                        break
-                    for doc in batch:
-                        fid = doc.get("id")
-                        if fid and fid not in fetched_ids:
-                            fetched_ids.add(fid)
-                            results.append(doc)
-                    if len(batch) < self.MILVUS_QUERY_BATCH_SIZE:
-                        break
-                    if len(results) >= 50000:  # 安全上限
-                        break
+            generation = self._collection_generation() if settings.enable_bm25_snapshot else None
+            if generation is None:
+                self._rebuild_bm25_index(generation)
+                return
             
-            self.bm25_docs = results
-
-            # 分词：多进程并行加速，文档少时直接用主进程避免进程开销
-            contents = [doc.get("content") or "" for doc in results]
-            n_docs = len(contents)
-            n_workers = min(max(1, cpu_count() - 1), n_docs, 8)
-            if n_workers <= 1 or n_docs < 100:
-                tokenized_docs = [_jieba_tokenize_one(t) for t in contents]
-            else:
-                with Pool(n_workers) as pool:
-                    tokenized_docs = pool.map(_jieba_tokenize_one, contents, chunksize=max(1, n_docs // (n_workers * 4)))
-
-            # 构建BM25索引
-            if tokenized_docs:
-                self.bm25_index = BM25Okapi(tokenized_docs)
-                print(f"✅ BM25索引构建完成，包含 {len(tokenized_docs)} 个文档")
+            # 加锁：多个 worker 同时启动时只由一个构建，其余等待后直接加载快照
+            with snapshot_lock(settings.bm25_snapshot_dir):
+                if not force:
+                    start = time.perf_counter()
+                    index = BM25Index.load_snapshot(settings.bm25_snapshot_dir, generation)
+                    if index is not None:
+                        self.bm25_index = index
+                        print(f"✅ BM25索引从快照加载完成，包含 {len(index)} 个文档，耗时 {(time.perf_counter() - start) * 1000:.0f}ms")
+                        self._prepare_keyword_backend()
+                        return
+                self._rebuild_bm25_index(generation)
+                if self.bm25_index is not None:
+                    self.bm25_index.save_snapshot(settings.bm25_snapshot_dir, generation)
+                    print(f"💾 BM25快照已写入: {settings.bm25_snapshot_dir}")
         except Exception as e:
             print(f"⚠️  BM25索引构建失败: {e}")
     
+    def _rebuild_bm25_index(self, generation: Optional[str]):
+        """从 Milvus 拉取全部文档、分词并构建 BM25 索引"""
+        self._build_bm25_from_rows(self._fetch_all_docs(), generation)
+    
+    def _build_bm25_from_rows(self, rows: List[Dict[str, Any]], generation: Optional[str]):
+        docs = [self._to_keyword_doc(row) for row in rows]
+        tokenized_docs = self._tokenize_docs(docs)
+        
+        # 构建BM25索引
+        if tokenized_docs:
+            self.bm25_index = BM25Index.build(docs, tokenized_docs, generation=generation)
+            print(f"✅ BM25索引构建完成，包含 {len(tokenized_docs)} 个文档")
+            self._prepare_keyword_backend()
+    
+    def _to_keyword_doc(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """只保留病症库 schema 字段（去掉 embedding 等），作为 BM25 文档库条目"""
+        return {field: row.get(field) for field in self.MEDICAL_OUTPUT_FIELDS}
+    
+    def rebuild_keyword_index(self, rows: List[Dict[str, Any]]):
+        """
+        用已在内存中的全量文档重建 BM25（如刚从 medical.txt 构建完病症库），不再回 Milvus 拉取，并写快照
+        """
+        generation = self._collection_generation() if self.collection and settings.enable_bm25_snapshot else None
+        self.bm25_index = None
+        self._build_bm25_from_rows(rows, generation)
+        if generation is not None and self.bm25_index is not None:
+            with snapshot_lock(settings.bm25_snapshot_dir):
+                self.bm25_index.save_snapshot(settings.bm25_snapshot_dir, generation)
+    
+    def update_keyword_index(self, update_type: str, ids: List[str], rows: List[Dict[str, Any]]):
+        """
+        增量更新 BM25：只对变更文档分词并更新 df / 文档长度等统计，不重建全量索引
+        - delete：删除 ids
+        - update：删除 ids，再加入 rows
+        - add：加入 rows
+        """
+        start = time.perf_counter()
+        docs = [self._to_keyword_doc(row) for row in rows]
+        tokenized_docs = [_jieba_tokenize_one(doc.get("content") or "") for doc in docs]
+        if self.bm25_index is None:
+            if docs:
+                self.bm25_index = BM25Index.build(docs, tokenized_docs)
+        else:
+            if update_type in ("delete", "update") and ids:
+                self.bm25_index.delete_documents(ids)
+            if docs:
+                self.bm25_index.add_documents(docs, tokenized_docs)
+        print(f"✅ BM25索引增量更新完成（{update_type}，{len(docs)} 条新增），耗时 {(time.perf_counter() - start) * 1000:.1f}ms")
+        # 规则召回词典在后台重建，完成前沿用旧词典（已删除文档在取回时过滤）
+        self._executor.submit(self._build_dictionary_recall)
+    
+    def save_keyword_snapshot(self):
+        """增量更新后把 BM25 索引写回快照（合并增量段），供后续启动的 worker 直接加载"""
+        if not self.bm25_index or not self.collection or not settings.enable_bm25_snapshot:
+            return
+        try:
+            generation = self._collection_generation()
+            if generation is None:
+                return
+            with snapshot_lock(settings.bm25_snapshot_dir):
+                self.bm25_index.save_snapshot(settings.bm25_snapshot_dir, generation)
+            print(f"💾 BM25快照已更新: {settings.bm25_snapshot_dir}")
+        except Exception as e:
+            print(f"⚠️  BM25快照写入失败: {e}")
+    
+    def _prepare_keyword_backend(self):
+        """
+        索引就绪后：sparse 后端预构建稀疏矩阵，避免首个请求承担构建耗时；
+        并用同一文档库构建规则召回词典
+        """
+        if settings.keyword_search_backend == "sparse" and self.bm25_index:
+            self.bm25_index.sparse_scorer()
+            print("✅ BM25稀疏矩阵后端已就绪")
+        self._build_dictionary_recall()
+    
+    def _build_vector_index(self, force: bool = False):
+        """
+        VECTOR_BACKEND=flat / hnsw 时加载本地向量索引快照（向量矩阵 mmap）。
+        有 Milvus 时快照代标识需与 collection 一致，否则从 Milvus 拉取全部向量重建并写快照；
+        无 Milvus 时直接加载知识库构建流程写出的快照。
+        """
+        index_cls = vector_index_class(settings.vector_backend)
+        if index_cls is None:
+            return
+        
+        try:
+            generation = self._collection_generation() if self.collection else None
+            with snapshot_lock(settings.vector_index_dir):
+                if not force:
+                    start = time.perf_counter()
+                    index = index_cls.load(settings.vector_index_dir, generation, **vector_index_params())
+                    if index is not None:
+                        self.vector_index = index
+                        print(f"✅ 本地向量索引（{index.kind}）加载完成，包含 {len(index)} 条向量，耗时 {(time.perf_counter() - start) * 1000:.0f}ms")
+                        return
+                if not self.collection:
+                    print(f"⚠️  本地向量索引快照不存在，请先构建知识库：python build_medical.py")
+                    return
+                start = time.perf_counter()
+                rows = self._fetch_all_docs(self.MEDICAL_OUTPUT_FIELDS + ["embedding"])
+                index = index_cls.build(rows, settings.embedding_dim, generation=generation, **vector_index_params())
+                index.save(settings.vector_index_dir, generation)
+                self.vector_index = index
+                print(f"✅ 本地向量索引（{index.kind}）构建完成，包含 {len(index)} 条向量，耗时 {(time.perf_counter() - start) * 1000:.0f}ms")
+        except Exception as e:
+            print(f"⚠️  本地向量索引构建失败，向量检索使用 Milvus: {e}")
+            self.vector_index = None
+    
+    def reload_vector_index(self):
+        """知识库重建后重新加载本地向量索引快照（构建流程已写出）"""
+        self._build_vector_index()
+    
+    def update_vector_index(self, update_type: str, ids: List[str], rows: List[Dict[str, Any]]):
+        """增量更新本地向量索引：delete / update 先删除 ids，add / update 写入带 embedding 的 rows"""
+        if self.vector_index is None:
+            return
+        if update_type in ("delete", "update") and ids:
+            self.vector_index.delete(ids)
+        if rows:
+            self.vector_index.add_rows(rows)
+    
+    def save_vector_index(self):
+        """增量更新后把本地向量索引写回快照"""
+        if self.vector_index is None:
+            return
+        try:
+            generation = self._collection_generation() if self.collection else None
+            with snapshot_lock(settings.vector_index_dir):
+                self.vector_index.save(settings.vector_index_dir, generation)
+            print(f"💾 本地向量索引快照已更新: {settings.vector_index_dir}")
+        except Exception as e:
+            print(f"⚠️  本地向量索引快照写入失败: {e}")
+    
     def _load_medical_rules(self) -> Dict[str, List[str]]:
         """
         加载医疗规则库
@@ -147,67 +448,137 @@ class MultiPathRetriever:
             "紧急": ["急救", "中毒", "骨折", "出血", "休克", "昏迷"]
         }
     
-    def vector_search(self, query: str, top_k: int = 10) -> List[KnowledgeSource]:
+    def vector_search(self, query: str, top_k: int = 10, metadata_filter: Optional[MetadataFilter] = None) -> List[KnowledgeSource]:
         """
         路径1：语义向量检索
-        使用embedding进行相似度搜索
+        使用embedding进行相似度搜索（本地向量索引或 Milvus），metadata_filter 限定科室 / 分类范围
         """
-        if not self.collection:
+        if not self.collection and self.vector_index is None:
             return []
         
         try:
             # 向量化查询
-            query_embedding = self.embeddings.embed_query(query)
-            
-            # 向量搜索（病症库 schema）
-            search_params = {"metric_type": "L2", "params": {"nprobe": 10}}
-            results = self.collection.search(
-                data=[query_embedding],
-                anns_field="embedding",
-                param=search_params,
-                limit=top_k,
-                output_fields=self.MEDICAL_OUTPUT_FIELDS
-            )
-            
-            # 转换结果
-            sources = []
-            for hit in results[0]:
-                # Milvus L2距离，越小越相似，转换为相似度分数
-                similarity = 1 / (1 + hit.distance)
-                
-                if similarity >= settings.similarity_threshold:
-                    entity = hit.entity
-                    content = entity.get("content") or ""
-                    name = entity.get("name") or ""
-                    # 展示时带上疾病名称
-                    display = f"【{name}】\n{content}" if name else content
-                    source = KnowledgeSource(
-                        source="knowledge_base",
-                        content=display,
-                        score=float(similarity),
-                        metadata={
-                            "retrieval_type": "vector",
-                            "name": name,
-                            "category_primary": entity.get("category_primary"),
-                            "symptoms": entity.get("symptoms"),
-                            "cure_department": entity.get("cure_department"),
-                            "cure_way": entity.get("cure_way"),
-                            "get_way": entity.get("get_way"),
-                            "cured_prob": entity.get("cured_prob"),
-                        }
-                    )
-                    sources.append(source)
-            
+            query_embedding = self.embed_query(query)
+            sources = self._search_by_vector(query_embedding, top_k, metadata_filter)
             print(f"📊 向量检索返回 {len(sources)} 条结果")
             return sources
         except Exception as e:
             print(f"❌ 向量检索失败: {e}")
             return []
     
-    def keyword_search(self, query: str, top_k: int = 10) -> List[KnowledgeSource]:
+    async def avector_search(self, query: str, top_k: int = 10, metadata_filter: Optional[MetadataFilter] = None) -> List[KnowledgeSource]:
+        """路径1（异步）：embedding 走异步 HTTP，向量搜索放到线程池，不阻塞事件循环"""
+        if not self.collection and self.vector_index is None:
+            return []
+        
+        try:
+            query_embedding = await self.aembed_query(query)
+            if self._vector_batcher is not None:
+                # 同一 top_k / 过滤条件的并发查询才能合并为一次搜索
+                key = (top_k, metadata_filter.key if metadata_filter else None)
+                sources = await self._vector_batcher.submit(query_embedding, key)
+            else:
+                loop = asyncio.get_running_loop()
+                sources = await loop.run_in_executor(self._executor, self._search_by_vector, query_embedding, top_k, metadata_filter)
+            print(f"📊 向量检索返回 {len(sources)} 条结果")
+            return sources
+        except Exception as e:
+            print(f"❌ 向量检索失败: {e}")
+            return []
+    
+    def vector_search_batch(self, queries: List[str], top_k: int = 10, metadata_filter: Optional[MetadataFilter] = None) -> List[List[KnowledgeSource]]:
+        """
+        批量向量检索：全部查询一次 embed_documents 请求向量化，再以 N 个向量发起一次搜索
+        （Milvus 多向量 search / 本地索引一次矩阵乘）
+        """
+        if not queries or (not self.collection and self.vector_index is None):
+            return [[] for _ in queries]
+        
+        try:
+            return self._search_by_vector_batch(self.embed_queries(queries), top_k, metadata_filter)
+        except Exception as e:
+            print(f"❌ 批量向量检索失败: {e}")
+            return [[] for _ in queries]
+    
+    async def _vector_search_micro_batch(self, key: Tuple[int, Any], query_embeddings: List[List[float]]) -> List[List[KnowledgeSource]]:
+        top_k, filter_key = key
+        metadata_filter = MetadataFilter(*filter_key) if filter_key else None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._search_by_vector_batch, query_embeddings, top_k, metadata_filter)
+    
+    def micro_batch_stats(self) -> Dict[str, Any]:
+        """微批处理统计（批次数、平均批大小等）；未启用时为空"""
+        return {
+            name: batcher.stats()
+            for name, batcher in (("embedding", self._embed_batcher), ("vector_search", self._vector_batcher))
+            if batcher is not None
+        }
+    
+    def _search_by_vector(self, query_embedding: List[float], top_k: int, metadata_filter: Optional[MetadataFilter] = None) -> List[KnowledgeSource]:
+        return self._search_by_vector_batch([query_embedding], top_k, metadata_filter)[0]
+    
+    def _search_by_vector_batch(self, query_embeddings: List[List[float]], top_k: int, metadata_filter: Optional[MetadataFilter] = None) -> List[List[KnowledgeSource]]:
+        """按 VECTOR_BACKEND 选择本地向量索引（平方 L2 距离）或 Milvus（度量见 MILVUS_METRIC_TYPE）搜索"""
+        if self.vector_index is not None:
+            batch_hits = self.vector_index.search_batch(query_embeddings, top_k, metadata_filter)
+            metric_type = "L2"
+        else:
+            batch_hits = self._milvus_search(query_embeddings, top_k, metadata_filter)
+            metric_type = settings.milvus_metric_type
+        return [self._vector_hits_to_sources(hits, metric_type) for hits in batch_hits]
+    
+    def _milvus_search(self, query_embeddings: List[List[float]], top_k: int, metadata_filter: Optional[MetadataFilter] = None) -> List[List[Tuple[Dict[str, Any], float]]]:
+        """
+        用一组查询向量在 Milvus 中搜索（病症库 schema，一次 search 请求），每条查询返回 [(文档字段, 距离)]。
+        过滤条件转为 Milvus 表达式下推（分类走 partition key 分区裁剪）；未下推的科室条件在结果上精确后过滤：
+        先多取 MILVUS_FILTER_OVERFETCH 倍，过滤后不足 top_k 且 Milvus 仍有更多结果的查询扩大 limit 重试。
+        """
+        pushdown = settings.milvus_department_pushdown
+        expr = metadata_filter.milvus_expr(pushdown) if metadata_filter else None
+        post_filter = bool(metadata_filter) and metadata_filter.needs_post_filter(pushdown)
+        overfetch = max(settings.milvus_filter_overfetch, 2)
+        limit = min(top_k * overfetch, self.MILVUS_MAX_LIMIT) if post_filter else top_k
+        batch_hits: List[List[Tuple[Dict[str, Any], float]]] = [[] for _ in query_embeddings]
+        pending = list(range(len(query_embeddings)))
+        for _ in range(self.MILVUS_FILTER_MAX_ROUNDS):
+            results = self.collection.search(
+                data=[query_embeddings[i] for i in pending],
+                anns_field="embedding",
+                param=build_search_params(),
+                limit=limit,
+                expr=expr,
+                output_fields=self.MEDICAL_OUTPUT_FIELDS
+            )
+            retry = []
+            for i, query_hits in zip(pending, results):
+                hits = [
+                    ({field: hit.entity.get(field) for field in self.MEDICAL_OUTPUT_FIELDS}, hit.distance)
+                    for hit in query_hits
+                ]
+                exhausted = len(hits) < limit
+                if metadata_filter:
+                    hits = [(doc, distance) for doc, distance in hits if metadata_filter.matches(doc)]
+                batch_hits[i] = hits[:top_k]
+                if post_filter and len(hits) < top_k and not exhausted:
+                    retry.append(i)
+            if not retry or limit >= self.MILVUS_MAX_LIMIT:
+                break
+            pending, limit = retry, min(limit * overfetch, self.MILVUS_MAX_LIMIT)
+        return batch_hits
+    
+    def _vector_hits_to_sources(self, hits: List[Tuple[Dict[str, Any], float]], metric_type: str) -> List[KnowledgeSource]:
+        """(文档, 距离) 转换为相似度分数，按阈值过滤并转换为 KnowledgeSource"""
+        sources = []
+        for doc, distance in hits:
+            similarity = distance_to_similarity(distance, metric_type)
+            if similarity >= settings.similarity_threshold:
+                sources.append(self._doc_to_source(doc, similarity, "vector"))
+        return sources
+    
+    def keyword_search(self, query: str, top_k: int = 10, metadata_filter: Optional[MetadataFilter] = None) -> List[KnowledgeSource]:
         """
         路径2：关键词/倒排检索（BM25）
-        基于词频和逆文档频率的检索
+        基于词频和逆文档频率的检索；metadata_filter 给定时只对过滤位图内的文档打分
         """
         if not self.bm25_index or not self.bm25_docs:
             return []
@@ -216,47 +587,70 @@ class MultiPathRetriever:
             # 分词
             query_tokens = list(jieba.cut(query))
             
-            # BM25检索
-            scores = self.bm25_index.get_scores(query_tokens)
-            
-            # 获取top-k结果
-            top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
-            
-            sources = []
-            for idx in top_indices:
-                score = scores[idx]
-                if score > 0:  # BM25分数大于0
-                    doc = self.bm25_docs[idx]
-                    content = doc.get("content") or ""
-                    name = doc.get("name") or ""
-                    display = f"【{name}】\n{content}" if name else content
-                    source = KnowledgeSource(
-                        source="knowledge_base",
-                        content=display,
-                        score=float(score),
-                        metadata={
-                            "retrieval_type": "keyword",
-                            "name": name,
-                            "category_primary": doc.get("category_primary"),
-                            "symptoms": doc.get("symptoms"),
-                            "cure_department": doc.get("cure_department"),
-                            "cure_way": doc.get("cure_way"),
-                            "get_way": doc.get("get_way"),
-                            "cured_prob": doc.get("cured_prob"),
-                        }
-                    )
-                    sources.append(source)
+            # BM25检索：默认倒排表 + MaxScore 精确 Top-K；sparse 后端为稀疏矩阵 × 查询向量
+            if settings.keyword_search_backend == "sparse":
+                hits = self.bm25_index.sparse_scorer().search_batch([query_tokens], top_k, metadata_filter)[0]
+            else:
+                hits = self.bm25_index.search(query_tokens, top_k, metadata_filter)
             
+            sources = self._keyword_hits_to_sources(hits)
             print(f"📊 关键词检索返回 {len(sources)} 条结果")
             return sources
         except Exception as e:
             print(f"❌ 关键词检索失败: {e}")
             return []
     
-    def rule_based_search(self, query: str) -> Tuple[List[KnowledgeSource], str]:
+    def keyword_search_batch(self, queries: List[str], top_k: int = 10, metadata_filter: Optional[MetadataFilter] = None) -> List[List[KnowledgeSource]]:
+        """
+        批量关键词检索：所有查询组成一个稀疏查询矩阵，与 BM25 矩阵做一次矩阵乘
+        适用于评估与批量接口
+        """
+        if not self.bm25_index or not self.bm25_docs:
+            return [[] for _ in queries]
+        
+        try:
+            tokenized = [list(jieba.cut(q)) for q in queries]
+            hits = self.bm25_index.sparse_scorer().search_batch(tokenized, top_k, metadata_filter)
+            return [self._keyword_hits_to_sources(query_hits) for query_hits in hits]
+        except Exception as e:
+            print(f"❌ 批量关键词检索失败: {e}")
+            return [[] for _ in queries]
+    
+    def _keyword_hits_to_sources(self, hits: List[Tuple[Dict[str, Any], float]]) -> List[KnowledgeSource]:
+        """将 BM25 命中的 (文档, 分数) 转换为 KnowledgeSource"""
+        return [
+            self._doc_to_source(doc, score, "keyword")
+            for doc, score in hits
+            if score > 0  # BM25分数大于0
+        ]
+    
+    def _doc_to_source(self, doc: Dict[str, Any], score: float, retrieval_type: str) -> KnowledgeSource:
+        """文档库条目（病症库 schema）转换为 KnowledgeSource"""
+        content = doc.get("content") or ""
+        name = doc.get("name") or ""
+        display = f"【{name}】\n{content}" if name else content
+        return KnowledgeSource(
+            source="knowledge_base",
+            content=display,
+            score=float(score),
+            metadata={
+                "retrieval_type": retrieval_type,
+                "id": doc.get("id"),
+                "name": name,
+                "category_primary": doc.get("category_primary"),
+                "symptoms": doc.get("symptoms"),
+                "cure_department": doc.get("cure_department"),
+                "cure_way": doc.get("cure_way"),
+                "get_way": doc.get("get_way"),
+                "cured_prob": doc.get("cured_prob"),
+            }
+        )
+    
+    def rule_based_search(self, query: str, metadata_filter: Optional[MetadataFilter] = None) -> Tuple[List[KnowledgeSource], str]:
         """
         路径3：规则召回
-        基于医疗关键词规则触发特定检索
+        - 词典召回：Aho-Corasick 自动机单次扫描查询，命中的疾病名 / 症状直接映射到文档（按 metadata_filter 过滤）
+        - 关键词规则：识别查询类别（症状/疾病/药物/检查/紧急），紧急情况打印告警
         """
         matched_category = None
         matched_keywords = []
@@ -268,16 +662,79 @@ class MultiPathRetriever:
                     matched_category = category
                     matched_keywords.append(keyword)
         
-        if not matched_category:
-            return [], None
-        
         # 如果匹配到紧急情况，优先返回
         if matched_category == "紧急":
             print(f"⚠️  检测到紧急情况关键词: {matched_keywords}")
         
-        # 病症库 schema 无「症状/疾病/药物」等 category 字段，规则仅作关键词匹配，不单独查库
-        # 向量检索和关键词检索已会命中相关内容，这里直接返回空，避免按旧 schema 查库报错
-        return [], matched_category
+        dictionary_recall = self.dictionary_recall
+        if dictionary_recall is None or self.bm25_index is None:
+            return [], matched_category
+        
+        try:
+            # 有过滤条件时先取全部命中再过滤，避免范围内的文档被范围外的高分命中挤出 Top-K
+            matches = dictionary_recall.match(query, top_k=len(dictionary_recall) if metadata_filter else settings.top_k_retrieval)
+            docs = self.bm25_index.get_documents([doc_id for doc_id, _, _ in matches])
+            sources = []
+            for (doc_id, score, detail), doc in zip(matches, docs):
+                if doc is None:  # 已删除，自动机尚未重建
+                    continue
+                if metadata_filter and not metadata_filter.matches(doc):
+                    continue
+                if len(sources) >= settings.top_k_retrieval:
+                    break
+                source = self._doc_to_source(doc, score, "rule")
+                source.metadata["matched_names"] = detail["names"]
+                source.metadata["matched_symptoms"] = detail["symptoms"]
+                sources.append(source)
+            print(f"📊 规则召回返回 {len(sources)} 条结果")
+            return sources, matched_category
+        except Exception as e:
+            print(f"❌ 规则召回失败: {e}")
+            return [], matched_category
+    
+    def _build_dictionary_recall(self):
+        """用当前关键词文档库（疾病名 + 症状）构建 Aho-Corasick 自动机，构建完成后整体替换"""
+        if self.bm25_index is None:
+            return
+        try:
+            start = time.perf_counter()
+            dictionary_recall = DictionaryRecall.build(self.bm25_index.iter_live_documents())
+            self.dictionary_recall = dictionary_recall
+            print(f"✅ 规则召回词典构建完成，{len(dictionary_recall.automaton)} 个词条，耗时 {(time.perf_counter() - start) * 1000:.0f}ms")
+        except Exception as e:
+            print(f"⚠️  规则召回词典构建失败: {e}")
+    
+    def _rerank_prompt(self, query: str, sources: List[KnowledgeSource], top_k: int) -> str:
+        """构建重排提示"""
+        candidates = "\n\n".join([
+            f"[{i}] {source.content[:200]}..." 
+            for i, source in enumerate(sources)
+        ])
+        
+        return f"""你是一个医疗问诊助手。用户问题是：{query}
+
+以下是候选知识片段：
+{candidates}
+
+请根据相关性对这些知识片段排序，返回最相关的{top_k}个片段的序号，用逗号分隔。
+只返回序号，不要其他内容。例如：0,3,5"""
+    
+    def _parse_rerank_response(self, indices_str: str, sources: List[KnowledgeSource], top_k: int) -> List[KnowledgeSource]:
+        """解析 LLM 返回的序号并取出对应片段"""
+        indices = [int(idx.strip()) for idx in indices_str.split(',') if idx.strip().isdigit()]
+        indices = [idx for idx in indices if 0 <= idx < len(sources)][:top_k]
+        
+        # 重排后的结果
+        reranked = [sources[idx] for idx in indices]
+        
+        print(f"📊 重排后返回 {len(reranked)} 条结果")
+        return reranked
+    
+    def _rerank_fallback(self, sources: List[KnowledgeSource], top_k: int, error: Exception) -> List[KnowledgeSource]:
+        print(f"⚠️  重排失败，返回原始结果: {error}")
+        # 降级策略：按分数排序
+        sorted_sources = sorted(sources, key=lambda x: x.score or 0, reverse=True)
+        return sorted_sources[:top_k]
     
     def rerank(self, query: str, sources: List[KnowledgeSource], top_k: int = 3) -> List[KnowledgeSource]:
         """
@@ -288,77 +745,365 @@ class MultiPathRetriever:
             return sources
         
         try:
-            # 构建重排提示
-            candidates = "\n\n".join([
-                f"[{i}] {source.content[:200]}..." 
-                for i, source in enumerate(sources)
-            ])
-            
-            prompt = f"""你是一个医疗问诊助手。用户问题是：{query}
-
-以下是候选知识片段：
-{candidates}
-
-请根据相关性对这些知识片段排序，返回最相关的{top_k}个片段的序号，用逗号分隔。
-只返回序号，不要其他内容。例如：0,3,5"""
-            
-            response = self.llm.invoke(prompt)
-            indices_str = response.content.strip()
-            
-            # 解析序号
-            indices = [int(idx.strip()) for idx in indices_str.split(',') if idx.strip().isdigit()]
-            indices = [idx for idx in indices if 0 <= idx < len(sources)][:top_k]
-            
-            # 重排后的结果
-            reranked = [sources[idx] for idx in indices]
-            
-            print(f"📊 重排后返回 {len(reranked)} 条结果")
-            return reranked
+            response = self.llm.invoke(self._rerank_prompt(query, sources, top_k))
+            return self._parse_rerank_response(response.content.strip(), sources, top_k)
         except Exception as e:
-            print(f"⚠️  重排失败，返回原始结果: {e}")
-            # 降级策略：按分数排序
-            sorted_sources = sorted(sources, key=lambda x: x.score or 0, reverse=True)
-            return sorted_sources[:top_k]
+            return self._rerank_fallback(sources, top_k, e)
     
-    def retrieve(self, query: str, top_k: int = None) -> List[KnowledgeSource]:
+    async def arerank(self, query: str, sources: List[KnowledgeSource], top_k: int = 3) -> List[KnowledgeSource]:
+        """重排策略（异步）：LLM 调用走 ainvoke"""
+        if len(sources) <= top_k:
+            return sources
+        
+        try:
+            response = await self.llm.ainvoke(self._rerank_prompt(query, sources, top_k))
+            return self._parse_rerank_response(response.content.strip(), sources, top_k)
+        except Exception as e:
+            return self._rerank_fallback(sources, top_k, e)
+    
+    def _timed(self, fn) -> Tuple[Any, float]:
+        """执行一路召回并返回 (结果, 耗时ms)，在线程池中运行"""
+        start = time.perf_counter()
+        result = fn()
+        return result, (time.perf_counter() - start) * 1000
+    
+    async def _atimed(self, awaitable) -> Tuple[Any, float]:
+        """等待一路异步召回并返回 (结果, 耗时ms)"""
+        start = time.perf_counter()
+        result = await awaitable
+        return result, (time.perf_counter() - start) * 1000
+    
+    def _run_recall_paths(self, query: str, metadata_filter: Optional[MetadataFilter] = None) -> Tuple[Dict[str, List[KnowledgeSource]], Dict[str, Any]]:
+        """
+        并行执行三路召回（各路均按 metadata_filter 限定范围），所有路径共享一个截止时间（RETRIEVAL_PATH_TIMEOUT）。
+        超时或异常的路径按空结果处理（降级为其他路径的结果），不阻塞整个请求；
+        超时路径的线程会在后台自然结束，结果被丢弃。
+        """
+        paths = {
+            # 路径1：向量检索
+            "vector": lambda: self.vector_search(query, top_k=settings.top_k_retrieval, metadata_filter=metadata_filter),
+            # 路径2：关键词检索
+            "keyword": lambda: self.keyword_search(query, top_k=settings.top_k_retrieval, metadata_filter=metadata_filter),
+            # 路径3：规则检索
+            "rule": lambda: self.rule_based_search(query, metadata_filter)[0],
+        }
+        futures = {name: self._executor.submit(self._timed, fn) for name, fn in paths.items()}
+        deadline = time.perf_counter() + settings.retrieval_path_timeout
+        
+        results: Dict[str, List[KnowledgeSource]] = {}
+        timings: Dict[str, Any] = {}
+        degraded = []
+        for name, future in futures.items():
+            try:
+                results[name], timings[f"{name}_ms"] = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+            except FutureTimeoutError:
+                print(f"⚠️  {name} 召回超时（>{settings.retrieval_path_timeout}s），使用其他路径结果")
+                results[name] = []
+                timings[f"{name}_ms"] = settings.retrieval_path_timeout * 1000
+                degraded.append(name)
+            except Exception as e:
+                print(f"⚠️  {name} 召回失败，使用其他路径结果: {e}")
+                results[name] = []
+                degraded.append(name)
+        timings["degraded"] = degraded
+        return results, timings
+    
+    def retrieve(self, query: str, top_k: int = None, metadata_filter: Optional[MetadataFilter] = None) -> List[KnowledgeSource]:
         """
         多路召回主函数
-        整合向量检索、关键词检索和规则检索的结果
+        整合向量检索、关键词检索和规则检索的结果；metadata_filter 限定科室 / 分类范围
+        """
+        sources, _ = self.retrieve_with_timings(query, top_k, metadata_filter)
+        return sources
+    
+    def retrieve_with_timings(self, query: str, top_k: int = None, metadata_filter: Optional[MetadataFilter] = None) -> Tuple[List[KnowledgeSource], Dict[str, Any]]:
+        """
+        多路召回（三路并行）+ 去重/融合 + 重排，同时返回各阶段耗时：
+        {"vector_ms", "keyword_ms", "rule_ms", "fusion_ms", "rerank_ms", "total_ms", "degraded": [超时/失败的路径]}
         """
         if top_k is None:
             top_k = settings.top_k_rerank
         
-        print(f"🔍 开始多路召回检索，query: {query}")
+        print(f"🔍 开始多路召回检索，query: {query}" + (f"，过滤: {metadata_filter.to_dict()}" if metadata_filter else ""))
+        start = time.perf_counter()
         
-        all_sources = []
+        cache_key = None
+        if self.retrieval_cache is not None:
+            cache_key, cached, tier = self.retrieval_cache.lookup(query, top_k, metadata_filter)
+            if cached is not None:
+                return cached, self._cache_hit_timings(tier, start)
         
-        # 路径1：向量检索
-        vector_results = self.vector_search(query, top_k=settings.top_k_retrieval)
-        all_sources.extend(vector_results)
+        results, timings = self._run_recall_paths(query, metadata_filter)
+        candidates = self._merge_recall_results(results, timings)
         
-        # 路径2：关键词检索
-        keyword_results = self.keyword_search(query, top_k=settings.top_k_retrieval)
-        all_sources.extend(keyword_results)
+        # 重排
+        rerank_start = time.perf_counter()
+        final_sources = self._rerank_candidates(query, candidates, top_k)
+        timings["rerank_ms"] = (time.perf_counter() - rerank_start) * 1000
+        timings["total_ms"] = (time.perf_counter() - start) * 1000
         
-        # 路径3：规则检索
-        rule_results, matched_category = self.rule_based_search(query)
-        all_sources.extend(rule_results)
+        if cache_key and final_sources and not timings["degraded"]:
+            self.retrieval_cache.store(cache_key, final_sources)
         
-        # 去重（基于内容）
-        seen_contents = set()
-        unique_sources = []
-        for source in all_sources:
-            content_hash = hash(source.content)
-            if content_hash not in seen_contents:
-                seen_contents.add(content_hash)
-                unique_sources.append(source)
+        self._log_timings(timings)
+        return final_sources, timings
+    
+    async def aretrieve(self, query: str, top_k: int = None, metadata_filter: Optional[MetadataFilter] = None) -> List[KnowledgeSource]:
+        """多路召回主函数（异步版）"""
+        sources, _ = await self.aretrieve_with_timings(query, top_k, metadata_filter)
+        return sources
+    
+    async def aretrieve_with_timings(self, query: str, top_k: int = None, metadata_filter: Optional[MetadataFilter] = None) -> Tuple[List[KnowledgeSource], Dict[str, Any]]:
+        """
+        异步多路召回：向量路径 await 异步 embedding，Milvus / BM25 在线程池执行，LLM 重排走 ainvoke，
+        整个过程不阻塞事件循环。返回值与 retrieve_with_timings 一致。
+        """
+        if top_k is None:
+            top_k = settings.top_k_rerank
         
-        print(f"📊 多路召回共返回 {len(unique_sources)} 条去重后的结果")
+        print(f"🔍 开始多路召回检索（异步），query: {query}" + (f"，过滤: {metadata_filter.to_dict()}" if metadata_filter else ""))
+        start = time.perf_counter()
         
-        # 重排
-        if len(unique_sources) > top_k:
-            final_sources = self.rerank(query, unique_sources, top_k)
+        cache_key = None
+        if self.retrieval_cache is not None:
+            cache_key, cached, tier = await self.retrieval_cache.alookup(query, top_k, metadata_filter)
+            if cached is not None:
+                return cached, self._cache_hit_timings(tier, start)
+        
+        results, timings = await self._arun_recall_paths(query, metadata_filter)
+        candidates = self._merge_recall_results(results, timings)
+        
+        rerank_start = time.perf_counter()
+        final_sources = await self._arerank_candidates(query, candidates, top_k)
+        timings["rerank_ms"] = (time.perf_counter() - rerank_start) * 1000
+        timings["total_ms"] = (time.perf_counter() - start) * 1000
+        
+        if cache_key and final_sources and not timings["degraded"]:
+            await self.retrieval_cache.astore(cache_key, final_sources)
+        
+        self._log_timings(timings)
+        return final_sources, timings
+    
+    def _cache_hit_timings(self, tier: str, start: float) -> Dict[str, Any]:
+        timings = {"cache": tier, "total_ms": (time.perf_counter() - start) * 1000, "degraded": []}
+        print(f"💾 检索结果命中缓存（{tier}），耗时 {timings['total_ms']:.1f}ms")
+        return timings
+    
+    async def _arun_recall_paths(self, query: str, metadata_filter: Optional[MetadataFilter] = None) -> Tuple[Dict[str, List[KnowledgeSource]], Dict[str, Any]]:
+        """
+        _run_recall_paths 的异步版本：三路召回以协程并发执行，共享同一个截止时间，
+        超时或异常的路径同样降级为空结果。同步的 Milvus / BM25 调用放到召回线程池，不占用事件循环。
+        """
+        loop = asyncio.get_running_loop()
+        paths = {
+            # 路径1：向量检索（异步 embedding）
+            "vector": self.avector_search(query, top_k=settings.top_k_retrieval, metadata_filter=metadata_filter),
+            # 路径2：关键词检索
+            "keyword": loop.run_in_executor(self._executor, self.keyword_search, query, settings.top_k_retrieval, metadata_filter),
+            # 路径3：规则检索
+            "rule": loop.run_in_executor(self._executor, lambda: self.rule_based_search(query, metadata_filter)[0]),
+        }
+        tasks = {name: asyncio.ensure_future(self._atimed(aw)) for name, aw in paths.items()}
+        await asyncio.wait(tasks.values(), timeout=settings.retrieval_path_timeout)
+        
+        results: Dict[str, List[KnowledgeSource]] = {}
+        timings: Dict[str, Any] = {}
+        degraded = []
+        for name, task in tasks.items():
+            if not task.done():
+                task.cancel()
+                print(f"⚠️  {name} 召回超时（>{settings.retrieval_path_timeout}s），使用其他路径结果")
+                results[name] = []
+                timings[f"{name}_ms"] = settings.retrieval_path_timeout * 1000
+                degraded.append(name)
+            elif task.exception() is not None:
+                print(f"⚠️  {name} 召回失败，使用其他路径结果: {task.exception()}")
+                results[name] = []
+                degraded.append(name)
+            else:
+                results[name], timings[f"{name}_ms"] = task.result()
+        timings["degraded"] = degraded
+        return results, timings
+    
+    def retrieve_batch(self, queries: List[str], top_k: int = None, metadata_filter: Optional[MetadataFilter] = None) -> List[List[KnowledgeSource]]:
+        """批量多路召回：返回与 queries 一一对应的结果"""
+        results, _ = self.retrieve_batch_with_timings(queries, top_k, metadata_filter)
+        return results
+    
+    def recall_paths_batch(self, queries: List[str], metadata_filter: Optional[MetadataFilter] = None) -> List[Dict[str, List[KnowledgeSource]]]:
+        """批量三路召回，不融合不重排：返回每条查询的 {路径名: 结果}（离线评估对比各融合策略用）"""
+        results, _ = self._run_batch_recall_paths(queries, metadata_filter)
+        return results
+    
+    def recall_candidates_batch(self, queries: List[str], metadata_filter: Optional[MetadataFilter] = None) -> List[List[KnowledgeSource]]:
+        """批量召回并按 FUSION_METHOD 合并 / 融合，不重排：返回线上重排阶段看到的候选（训练重排模型用）"""
+        results, timings = self._run_batch_recall_paths(queries, metadata_filter)
+        return self._merge_batch_recall_results(results, timings)
+    
+    def retrieve_batch_with_timings(
+        self, queries: List[str], top_k: int = None, metadata_filter: Optional[MetadataFilter] = None
+    ) -> Tuple[List[List[KnowledgeSource]], Dict[str, Any]]:
+        """
+        批量多路召回，供评估与离线任务使用：
+        - 向量：全部查询一次 embed_documents + 一次 N 向量搜索
+        - 关键词：稀疏矩阵批量打分（一次矩阵乘）
+        - 规则：逐条自动机匹配（单条微秒级）
+        三路并行执行（批量任务不设单路超时）；融合 / 重排逐条进行，LLM 重排并发调用。
+        耗时为整批的合计：{"vector_ms", "keyword_ms", "rule_ms", "fusion_ms", "rerank_ms", "total_ms", "queries"}
+        """
+        if top_k is None:
+            top_k = settings.top_k_rerank
+        if not queries:
+            return [], {"queries": 0}
+        
+        print(f"🔍 开始批量多路召回检索，{len(queries)} 条查询")
+        start = time.perf_counter()
+        
+        results, timings = self._run_batch_recall_paths(queries, metadata_filter)
+        candidates = self._merge_batch_recall_results(results, timings)
+        
+        rerank_start = time.perf_counter()
+        if settings.rerank_method == "llm":
+            final_sources = list(self._executor.map(lambda args: self._rerank_candidates(*args, top_k), zip(queries, candidates)))
         else:
-            final_sources = unique_sources
+            final_sources = [self._rerank_candidates(query, query_candidates, top_k) for query, query_candidates in zip(queries, candidates)]
+        timings["rerank_ms"] = (time.perf_counter() - rerank_start) * 1000
+        timings["total_ms"] = (time.perf_counter() - start) * 1000
+        
+        self._log_timings(timings)
+        return final_sources, timings
+    
+    async def aretrieve_batch_with_timings(
+        self, queries: List[str], top_k: int = None, metadata_filter: Optional[MetadataFilter] = None
+    ) -> Tuple[List[List[KnowledgeSource]], Dict[str, Any]]:
+        """批量多路召回（异步版）：embedding 走异步 HTTP，搜索在线程池执行，LLM 重排并发 ainvoke"""
+        if top_k is None:
+            top_k = settings.top_k_rerank
+        if not queries:
+            return [], {"queries": 0}
+        
+        print(f"🔍 开始批量多路召回检索（异步），{len(queries)} 条查询")
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
         
-        return final_sources
+        async def vector_batch():
+            if not self.collection and self.vector_index is None:
+                return [[] for _ in queries]
+            try:
+                embeddings = await self.aembed_queries(queries)
+                return await loop.run_in_executor(self._executor, self._search_by_vector_batch, embeddings, settings.top_k_retrieval, metadata_filter)
+            except Exception as e:
+                print(f"❌ 批量向量检索失败: {e}")
+                return [[] for _ in queries]
+        
+        paths = {
+            "vector": vector_batch(),
+            "keyword": loop.run_in_executor(self._executor, self.keyword_search_batch, queries, settings.top_k_retrieval, metadata_filter),
+            "rule": loop.run_in_executor(self._executor, self._rule_search_batch, queries, metadata_filter),
+        }
+        timed = await asyncio.gather(*(self._atimed(aw) for aw in paths.values()))
+        by_path = {}
+        timings: Dict[str, Any] = {"queries": len(queries)}
+        for name, (path_results, elapsed) in zip(paths, timed):
+            by_path[name] = path_results
+            timings[f"{name}_ms"] = elapsed
+        results = [{name: by_path[name][i] for name in paths} for i in range(len(queries))]
+        candidates = self._merge_batch_recall_results(results, timings)
+        
+        rerank_start = time.perf_counter()
+        final_sources = list(await asyncio.gather(*(
+            self._arerank_candidates(query, query_candidates, top_k) for query, query_candidates in zip(queries, candidates)
+        )))
+        timings["rerank_ms"] = (time.perf_counter() - rerank_start) * 1000
+        timings["total_ms"] = (time.perf_counter() - start) * 1000
+        
+        self._log_timings(timings)
+        return final_sources, timings
+    
+    def _rule_search_batch(self, queries: List[str], metadata_filter: Optional[MetadataFilter] = None) -> List[List[KnowledgeSource]]:
+        return [self.rule_based_search(query, metadata_filter)[0] for query in queries]
+    
+    def _run_batch_recall_paths(
+        self, queries: List[str], metadata_filter: Optional[MetadataFilter] = None
+    ) -> Tuple[List[Dict[str, List[KnowledgeSource]]], Dict[str, Any]]:
+        """三路批量召回并行执行，返回 (每条查询的 {路径名: 结果}, 整批各路耗时)"""
+        paths = {
+            "vector": lambda: self.vector_search_batch(queries, settings.top_k_retrieval, metadata_filter),
+            "keyword": lambda: self.keyword_search_batch(queries, settings.top_k_retrieval, metadata_filter),
+            "rule": lambda: self._rule_search_batch(queries, metadata_filter),
+        }
+        futures = {name: self._executor.submit(self._timed, fn) for name, fn in paths.items()}
+        by_path = {}
+        timings: Dict[str, Any] = {"queries": len(queries)}
+        for name, future in futures.items():
+            by_path[name], timings[f"{name}_ms"] = future.result()
+        return [{name: by_path[name][i] for name in paths} for i in range(len(queries))], timings
+    
+    def _merge_batch_recall_results(self, results: List[Dict[str, List[KnowledgeSource]]], timings: Dict[str, Any]) -> List[List[KnowledgeSource]]:
+        """逐条合并 / 融合，fusion_ms 记为整批合计"""
+        candidates = []
+        fusion_ms = 0.0
+        for query_results in results:
+            query_timings: Dict[str, Any] = {}
+            candidates.append(self._merge_recall_results(query_results, query_timings))
+            fusion_ms += query_timings["fusion_ms"]
+        timings["fusion_ms"] = fusion_ms
+        return candidates
+    
+    def _rerank_candidates(self, query: str, candidates: List[KnowledgeSource], top_k: int) -> List[KnowledgeSource]:
+        """按 RERANK_METHOD 重排：llm（候选多于 top_k 时）/ learned / none"""
+        if settings.rerank_method == "llm" and len(candidates) > top_k:
+            return self.rerank(query, candidates[:self._rerank_candidate_limit()], top_k)
+        if settings.rerank_method == "learned" and self.learned_reranker is not None:
+            return self.learned_reranker.rerank(query, candidates, top_k)
+        return candidates[:top_k]
+    
+    async def _arerank_candidates(self, query: str, candidates: List[KnowledgeSource], top_k: int) -> List[KnowledgeSource]:
+        """_rerank_candidates 的异步版本（LLM 重排走 ainvoke）"""
+        if settings.rerank_method == "llm" and len(candidates) > top_k:
+            return await self.arerank(query, candidates[:self._rerank_candidate_limit()], top_k)
+        return self._rerank_candidates(query, candidates, top_k)
+    
+    def _merge_recall_results(self, results: Dict[str, List[KnowledgeSource]], timings: Dict[str, Any]) -> List[KnowledgeSource]:
+        """
+        合并各路召回结果：
+        - FUSION_METHOD=none：按 向量 → 关键词 → 规则 的顺序拼接并基于内容去重
+        - FUSION_METHOD=rrf / linear：按排名 / 归一化分数融合，结果按融合分降序
+        两种方式都在 metadata["fusion_path_scores"] 记录文档在各路的原始分数（学习型重排的特征）
+        """
+        fusion_start = time.perf_counter()
+        if settings.fusion_method in ("rrf", "linear"):
+            unique_sources = fuse(settings.fusion_method, results, weights=self._fusion_weights(), rrf_k=settings.rrf_k)
+        else:
+            # 去重（基于内容），保留首次出现的结果；被去掉的重复项的分数并入各路分数
+            path_scores: Dict[int, Dict[str, float]] = {}
+            first_seen: List[KnowledgeSource] = []
+            for path in ("vector", "keyword", "rule"):
+                for source in results[path]:
+                    content_hash = hash(source.content)
+                    if content_hash not in path_scores:
+                        path_scores[content_hash] = {}
+                        first_seen.append(source)
+                    path_scores[content_hash].setdefault(path, float(source.score or 0.0))
+            unique_sources = [
+                source.model_copy(update={"metadata": {**(source.metadata or {}), "fusion_path_scores": path_scores[hash(source.content)]}})
+                for source in first_seen
+            ]
+        timings["fusion_ms"] = (time.perf_counter() - fusion_start) * 1000
+        
+        print(f"📊 多路召回共返回 {len(unique_sources)} 条去重后的结果")
+        return unique_sources
+    
+    def _fusion_weights(self) -> Dict[str, float]:
+        return {
+            "vector": settings.fusion_weight_vector,
+            "keyword": settings.fusion_weight_keyword,
+            "rule": settings.fusion_weight_rule,
+        }
+    
+    def _rerank_candidate_limit(self) -> Optional[int]:
+        """融合后只把前 top_k_retrieval 条交给 LLM 重排，缩短提示；未融合时保持原有行为（全部候选）"""
+        return settings.top_k_retrieval if settings.fusion_method in ("rrf", "linear") else None
+    
+    def _log_timings(self, timings: Dict[str, Any]):
+        print("⏱️  检索耗时: " + ", ".join(f"{k}={v:.0f}" for k, v in timings.items() if k.endswith("_ms")))
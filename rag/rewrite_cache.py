@@ -0,0 +1,76 @@
+"""
+查询改写缓存：进程内 LRU + Redis 两级，缓存 (规范化问题, 对话历史摘要) → 改写结果。
+- 同一问题在同样的上下文下改写结果稳定，命中时省去一次 LLM 往返
+- key 含改写模型名，换模型后旧结果不再命中
+- Redis 使用 redis.asyncio 客户端（与响应缓存共用连接池）；同步接口（离线评估等）只使用进程内一级
+- Redis 不可用时退化为仅进程内缓存
+"""
+from typing import Any, List, Optional
+
+from caching import HitCounter, LRUCache, stable_digest
+
+REWRITE_CACHE_KEY_PREFIX = "rewrite:"
+
+
+def history_digest(history: Optional[List] = None) -> str:
+    """对话历史（含滚动摘要）的稳定摘要；无历史时为空串"""
+    if not history:
+        return ""
+    parts = []
+    for msg in history:
+        role = getattr(msg, "role", None) or (msg.get("role") if isinstance(msg, dict) else None)
+        content = getattr(msg, "content", None) or (msg.get("content") if isinstance(msg, dict) else "")
+        parts.append(f"{role}:{content}")
+    return stable_digest(*parts)
+
+
+class RewriteCache:
+    """两级改写缓存，值为改写后的检索问句"""
+
+    def __init__(self, redis_client: Any = None, model: str = "", max_items: int = 5000, ttl: int = 86400):
+        self.redis = redis_client
+        self.model = model
+        self.ttl = ttl
+        self.local = LRUCache(max_items=max_items, ttl=ttl)
+        self.redis_counter = HitCounter()
+
+    def key(self, normalized_question: str, history: Optional[List] = None) -> str:
+        return REWRITE_CACHE_KEY_PREFIX + stable_digest(self.model, normalized_question, history_digest(history))
+
+    def get(self, key: str) -> Optional[str]:
+        return self.local.get(key)
+
+    def set(self, key: str, rewritten: str):
+        self.local.set(key, rewritten)
+
+    async def aget(self, key: str) -> Optional[str]:
+        rewritten = self.local.get(key)
+        if rewritten is not None or self.redis is None:
+            return rewritten
+        try:
+            raw = await self.redis.get(key)
+        except Exception as e:
+            self.redis_counter.error()
+            print(f"⚠️  改写缓存读取失败: {e}")
+            return None
+        self.redis_counter.record(raw is not None)
+        if raw is None:
+            return None
+        rewritten = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+        self.local.set(key, rewritten)
+        return rewritten
+
+    async def aset(self, key: str, rewritten: str):
+        self.local.set(key, rewritten)
+        if self.redis is None:
+            return
+        try:
+            await self.redis.setex(key, self.ttl, rewritten)
+        except Exception as e:
+            print(f"⚠️  改写缓存写入失败: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "local": self.local.stats(),
+            "redis": {"enabled": self.redis is not None, **self.redis_counter.stats()},
+        }
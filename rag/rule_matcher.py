@@ -0,0 +1,203 @@
+"""
+规则召回模块：Aho-Corasick 词典匹配
+把知识库中所有疾病名（name）与症状（symptoms）编译进一个 Aho-Corasick 自动机，
+查询只需单次扫描即可找出全部命中的词条，并直接映射到文档 id（纯 Python 实现，无额外依赖）。
+"""
+import math
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 词条最短长度：单字症状/病名（如「痒」）误命中过多，不入自动机
+MIN_PATTERN_LEN = 2
+
+_FIELD_SEPARATORS = ("、", "/", ",", "，", " ")
+
+
+def split_field(value: Any) -> List[str]:
+    """将「、」等分隔的字段拆成列表（病症库中 symptoms / cure_department 为拼接后的字符串）"""
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    text = str(value)
+    for sep in _FIELD_SEPARATORS[1:]:
+        text = text.replace(sep, _FIELD_SEPARATORS[0])
+    return [part.strip() for part in text.split(_FIELD_SEPARATORS[0]) if part.strip()]
+
+
+class AhoCorasick:
+    """
+    多模式串匹配自动机。
+    add(pattern, value) 逐条加入模式串后调用 build()；find_all(text) 返回全部命中 (start, end, value)。
+    同一模式串多次 add 时 value 以列表累积。
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 节点 → 以该节点结尾的模式串下标（build 后沿失败链合并）
+        self._out: List[List[int]] = [[]]
+        self._patterns: List[str] = []
+        self._values: List[List[Any]] = []
+        self._pattern_idx: Dict[str, int] = {}
+        self._built = False
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def add(self, pattern: str, value: Any = None):
+        if not pattern:
+            return
+        idx = self._pattern_idx.get(pattern)
+        if idx is None:
+            idx = len(self._patterns)
+            self._pattern_idx[pattern] = idx
+            self._patterns.append(pattern)
+            self._values.append([])
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append(idx)
+            self._built = False
+        self._values[idx].append(value)
+
+    def build(self):
+        """BFS 计算失败指针，并把失败链上的输出合并到当前节点"""
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                if self._out[self._fail[nxt]]:
+                    self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterable[Tuple[int, int, int]]:
+        """逐个产出 (start, end, 模式串下标)，end 为开区间"""
+        if not self._built:
+            self.build()
+        goto, fail, out, patterns = self._goto, self._fail, self._out, self._patterns
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for idx in out[node]:
+                yield i + 1 - len(patterns[idx]), i + 1, idx
+
+    def find_all(self, text: str) -> List[Tuple[int, int, List[Any]]]:
+        return [(start, end, self._values[idx]) for start, end, idx in self.iter_matches(text)]
+
+    def longest_matches(self, text: str) -> List[Tuple[int, int, int]]:
+        """
+        从左到右取互不重叠的匹配 (start, end, 模式串下标)：同一起点取最长的模式串，
+        与前一个匹配重叠的跳过（leftmost-longest，用于替换式规范化）。
+        """
+        longest: List[Optional[Tuple[int, int]]] = [None] * len(text)
+        for start, end, idx in self.iter_matches(text):
+            if longest[start] is None or end > longest[start][0]:
+                longest[start] = (end, idx)
+        result = []
+        pos = 0
+        for start, match in enumerate(longest):
+            if match is None or start < pos:
+                continue
+            end, idx = match
+            result.append((start, end, idx))
+            pos = end
+        return result
+
+    def pattern(self, idx: int) -> str:
+        return self._patterns[idx]
+
+    def values(self, idx: int) -> List[Any]:
+        return self._values[idx]
+
+
+class DictionaryRecall:
+    """
+    基于 Aho-Corasick 的词典召回：疾病名命中 / 症状命中 → 文档 id。
+    排序分 = 疾病名命中加权 + Σ 命中症状的 idf（症状越罕见越有区分度）；
+    展示分（0~1）：疾病名命中为 1.0，否则为 0.8 × 该文档症状被查询覆盖的比例。
+    """
+
+    NAME_BONUS = 10.0
+
+    def __init__(self):
+        self.automaton = AhoCorasick()
+        # 文档 id → 症状条数（计算覆盖率）
+        self._symptom_count: Dict[str, int] = {}
+        # 症状词条 → idf
+        self._symptom_idf: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._symptom_count)
+
+    @classmethod
+    def build(cls, docs: Iterable[Dict[str, Any]]) -> "DictionaryRecall":
+        recall = cls()
+        symptom_df: Dict[str, int] = {}
+        for doc in docs:
+            doc_id = doc.get("id")
+            if not doc_id:
+                continue
+            name = (doc.get("name") or "").strip()
+            if len(name) >= MIN_PATTERN_LEN:
+                recall.automaton.add(name, ("name", doc_id))
+            symptoms = {s for s in split_field(doc.get("symptoms")) if len(s) >= MIN_PATTERN_LEN}
+            for symptom in symptoms:
+                recall.automaton.add(symptom, ("symptom", doc_id))
+                symptom_df[symptom] = symptom_df.get(symptom, 0) + 1
+            recall._symptom_count[doc_id] = len(symptoms)
+        n_docs = max(len(recall._symptom_count), 1)
+        recall._symptom_idf = {s: math.log(1 + n_docs / df) for s, df in symptom_df.items()}
+        recall.automaton.build()
+        return recall
+
+    def match(self, query: str, top_k: int = 10) -> List[Tuple[str, float, Dict[str, Any]]]:
+        """
+        返回 [(文档 id, 展示分, 命中详情)]，按排序分降序。
+        命中详情：{"names": [...], "symptoms": [...]}
+        """
+        rank_score: Dict[str, float] = {}
+        hits: Dict[str, Dict[str, List[str]]] = {}
+        seen = set()
+        for _, _, idx in self.automaton.iter_matches(query or ""):
+            if idx in seen:
+                continue
+            seen.add(idx)
+            pattern = self.automaton.pattern(idx)
+            for kind, doc_id in self.automaton.values(idx):
+                detail = hits.setdefault(doc_id, {"names": [], "symptoms": []})
+                if kind == "name":
+                    detail["names"].append(pattern)
+                    rank_score[doc_id] = rank_score.get(doc_id, 0.0) + self.NAME_BONUS
+                else:
+                    detail["symptoms"].append(pattern)
+                    rank_score[doc_id] = rank_score.get(doc_id, 0.0) + self._symptom_idf.get(pattern, 1.0)
+
+        ranked = sorted(rank_score, key=lambda doc_id: rank_score[doc_id], reverse=True)[:top_k]
+        results = []
+        for doc_id in ranked:
+            detail = hits[doc_id]
+            if detail["names"]:
+                score = 1.0
+            else:
+                score = 0.8 * len(detail["symptoms"]) / max(self._symptom_count.get(doc_id, 1), 1)
+            results.append((doc_id, min(score, 1.0), detail))
+        return results
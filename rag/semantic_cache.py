@@ -0,0 +1,114 @@
+"""
+语义答案缓存：近义改写的问题（如「发烧39度怎么办」/「高烧39度如何处理」）直接复用已生成的问诊回答，不调用 LLM。
+- 索引：进程内 float32 矩阵保存已回答问题的单位化 embedding，一次矩阵乘得到全部余弦相似度
+- 命中：相似度 ≥ SEMANTIC_CACHE_THRESHOLD 且过滤条件（科室 / 分类）一致的最相似条目
+- 淘汰：条数达到上限时淘汰最久未命中的条目；超过 TTL 的条目不再命中，槽位优先复用
+- 每次命中（含 shadow 模式下「本会命中」）打印相似度与匹配到的原问题，并保留最近的命中记录供调阈值
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from models import ConsultResponse
+
+SEMANTIC_CACHE_MODES = ("off", "shadow", "on")
+
+
+class SemanticCache:
+    """按问题 embedding 相似度查找已缓存的问诊回答"""
+
+    def __init__(self, threshold: float = 0.95, max_items: int = 5000, ttl: float = 86400, recent_hits: int = 100):
+        self.threshold = threshold
+        self.max_items = max(1, max_items)
+        self.ttl = ttl
+        # 向量矩阵在第一次写入时按 embedding 维度分配
+        self.vectors: Optional[np.ndarray] = None
+        self.expires_at = np.zeros(self.max_items, dtype=np.float64)
+        self.last_used = np.zeros(self.max_items, dtype=np.float64)
+        self.valid = np.zeros(self.max_items, dtype=bool)
+        # 槽位 → (问题, 过滤条件 key, ConsultResponse)
+        self.entries: List[Optional[Tuple[str, Any, ConsultResponse]]] = [None] * self.max_items
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.recent_hits: deque = deque(maxlen=recent_hits)
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, question: str, embedding: List[float], filter_key: Any = None) -> Optional[Tuple[ConsultResponse, float, str]]:
+        """返回 (缓存的回答副本, 相似度, 匹配到的原问题)；未命中返回 None"""
+        query = self._unit(embedding)
+        now = time.monotonic()
+        with self._lock:
+            if self.vectors is None or query.shape[0] != self.vectors.shape[1]:
+                self.misses += 1
+                return None
+            live = self.valid & (self.expires_at > now)
+            sims = self.vectors @ query
+            sims[~live] = -np.inf
+            # 相似度从高到低找第一个过滤条件一致的条目
+            candidates = np.flatnonzero(sims >= self.threshold)
+            for slot in candidates[np.argsort(-sims[candidates], kind="stable")]:
+                cached_question, cached_filter, response = self.entries[slot]
+                if cached_filter != filter_key:
+                    continue
+                similarity = float(sims[slot])
+                self.last_used[slot] = now
+                self.hits += 1
+                self.recent_hits.append({"question": question, "matched": cached_question, "similarity": similarity, "at": int(time.time())})
+                print(f"🧠 语义缓存命中 similarity={similarity:.4f}：「{question}」≈「{cached_question}」")
+                return response.model_copy(deep=True), similarity, cached_question
+            self.misses += 1
+            return None
+
+    def add(self, question: str, embedding: List[float], response: ConsultResponse, filter_key: Any = None):
+        vector = self._unit(embedding)
+        now = time.monotonic()
+        with self._lock:
+            if self.vectors is None or vector.shape[0] != self.vectors.shape[1]:
+                # 首次写入或 embedding 维度变化（更换模型）：重新分配
+                self.vectors = np.zeros((self.max_items, vector.shape[0]), dtype=np.float32)
+                self.valid[:] = False
+                self.entries = [None] * self.max_items
+            free = np.flatnonzero(~self.valid | (self.expires_at <= now))
+            if len(free):
+                slot = int(free[0])
+            else:
+                slot = int(np.argmin(self.last_used))
+                self.evictions += 1
+            self.vectors[slot] = vector
+            self.entries[slot] = (question, filter_key, response.model_copy(deep=True))
+            self.expires_at[slot] = now + self.ttl
+            self.last_used[slot] = now
+            self.valid[slot] = True
+
+    def clear(self):
+        """知识库变更后清空（已缓存的回答基于旧知识）"""
+        with self._lock:
+            self.valid[:] = False
+            self.entries = [None] * self.max_items
+
+    def __len__(self) -> int:
+        return int((self.valid & (self.expires_at > time.monotonic())).sum())
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        similarities = [hit["similarity"] for hit in self.recent_hits]
+        return {
+            "items": len(self),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+            "recent_min_similarity": min(similarities) if similarities else None,
+            "recent_hits": list(self.recent_hits)[-20:],
+        }
@@ -0,0 +1,107 @@
+"""
+推测式检索：LLM 改写进行的同时，先用规范化后的原问题开始检索，改写的延迟不再叠加在检索之前。
+改写返回后：
+- kept：改写与原问题基本一致（规范化后字符二元组 Jaccard ≥ keep_similarity），直接采用推测结果
+- merged：否则用改写后的问句检索，与推测结果按加权 RRF（fusion.reciprocal_rank_fusion，k 同 RRF_K）合并（改写结果权重更高），推测结果只做补充
+各结果的次数见 speculative_stats()
+"""
+import asyncio
+import time
+from collections import Counter
+from typing import Any, Awaitable, Dict, List, Set, Tuple
+
+from fusion import DEFAULT_RRF_K, doc_key, reciprocal_rank_fusion
+from models import KnowledgeSource
+from query_optimizer import normalize_question
+
+speculative_counts: Counter = Counter()
+
+
+def _bigrams(text: str) -> Set[str]:
+    text = normalize_question(text)
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def query_similarity(a: str, b: str) -> float:
+    """两个检索问句的相似度：规范化后字符二元组的 Jaccard 系数（0~1）"""
+    grams_a, grams_b = _bigrams(a), _bigrams(b)
+    if not grams_a and not grams_b:
+        return 1.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+def merge_results(
+    primary: List[KnowledgeSource],
+    secondary: List[KnowledgeSource],
+    top_k: int,
+    secondary_weight: float = 0.5,
+    rrf_k: int = DEFAULT_RRF_K,
+) -> List[KnowledgeSource]:
+    """按加权 RRF 合并两组重排后的结果并去重，保留原对象（不改写其 score / metadata，检索阶段的融合信息不被覆盖）"""
+    first_seen: Dict[tuple, KnowledgeSource] = {}
+    for source in primary + secondary:
+        first_seen.setdefault(doc_key(source), source)
+    fused = reciprocal_rank_fusion(
+        {"rewritten": primary, "speculative": secondary},
+        weights={"rewritten": 1.0, "speculative": secondary_weight},
+        k=rrf_k,
+    )
+    return [first_seen[doc_key(source)] for source in fused[:top_k]]
+
+
+async def aretrieve_speculative(
+    retriever: Any,
+    raw_query: str,
+    rewrite: Awaitable[str],
+    top_k: int,
+    metadata_filter: Any = None,
+    keep_similarity: float = 0.8,
+    merge_weight: float = 0.5,
+    rrf_k: int = DEFAULT_RRF_K,
+) -> Tuple[str, List[KnowledgeSource], Dict[str, Any]]:
+    """
+    raw_query 的检索与 rewrite（返回改写后问句的协程）并发执行。
+    返回 (用于后续兜底的检索问句, 结果, 耗时统计)；耗时统计为所采用检索的 timings，附加 speculative 字段。
+    """
+    start = time.perf_counter()
+    speculative = asyncio.create_task(
+        retriever.aretrieve_with_timings(raw_query, top_k, metadata_filter=metadata_filter)
+    )
+    try:
+        retrieval_query = await rewrite
+        rewrite_ms = (time.perf_counter() - start) * 1000
+        similarity = query_similarity(raw_query, retrieval_query)
+        if similarity >= keep_similarity:
+            sources, timings = await speculative
+            outcome = "kept"
+        else:
+            (spec_sources, _), (sources, timings) = await asyncio.gather(
+                speculative,
+                retriever.aretrieve_with_timings(retrieval_query, top_k, metadata_filter=metadata_filter),
+            )
+            sources = merge_results(sources, spec_sources, top_k, merge_weight, rrf_k)
+            outcome = "merged"
+    finally:
+        if not speculative.done():
+            speculative.cancel()
+    speculative_counts[outcome] += 1
+    timings = dict(timings)
+    timings["speculative"] = {
+        "outcome": outcome,
+        "similarity": similarity,
+        "rewrite_ms": rewrite_ms,
+        "total_ms": (time.perf_counter() - start) * 1000,
+    }
+    print(f"🔮 推测式检索 {outcome}（相似度 {similarity:.2f}，改写 {rewrite_ms:.0f}ms）：「{raw_query}」→「{retrieval_query}」")
+    return retrieval_query, sources, timings
+
+
+def speculative_stats() -> Dict[str, Any]:
+    total = sum(speculative_counts.values())
+    return {
+        "kept": speculative_counts.get("kept", 0),
+        "merged": speculative_counts.get("merged", 0),
+        "keep_rate": speculative_counts.get("kept", 0) / total if total else 0.0,
+    }
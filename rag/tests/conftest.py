@@ -0,0 +1,69 @@
+"""测试从 rag/ 目录以扁平模块名导入（与服务启动方式一致）；提供内存版 Redis 替身"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeRedis:
+    """缓存层用到的同步 Redis 命令子集（dict 存储，忽略 TTL）"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value.encode("utf-8") if isinstance(value, str) else value
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.ops = []
+
+    def setex(self, key, ttl, value):
+        self.ops.append((key, ttl, value))
+
+    def execute(self):
+        for op in self.ops:
+            self.redis.setex(*op)
+
+
+class FakeAsyncRedis(FakeRedis):
+    """redis.asyncio 客户端的同名协程版本"""
+
+    async def get(self, key):
+        return FakeRedis.get(self, key)
+
+    async def setex(self, key, ttl, value):
+        FakeRedis.setex(self, key, ttl, value)
+
+    async def incr(self, key):
+        return FakeRedis.incr(self, key)
+
+    async def publish(self, channel, message):
+        return 0
+
+
+@pytest.fixture
+def fake_redis():
+    return FakeRedis()
+
+
+@pytest.fixture
+def fake_async_redis():
+    return FakeAsyncRedis()
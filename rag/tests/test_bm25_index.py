@@ -0,0 +1,270 @@
+"""BM25Index 行为测试：快照重载、MaxScore / 稀疏矩阵与全量打分一致、增量段 / 墓碑 / 合并、按原文档 id 删除切分块"""
+import random
+
+import numpy as np
+import pytest
+
+from bm25_index import BM25Index, DocIdMap, parent_doc_id
+
+
+def _doc(doc_id, content):
+    return {"id": doc_id, "content": content}
+
+
+def _chunked(parent, contents):
+    return [_doc(f"{parent}_chunk_{i}", text) for i, text in enumerate(contents)]
+
+
+def _build(docs):
+    return BM25Index.build(docs, [d["content"].split() for d in docs])
+
+
+def _hit_ids(index, query, k=10):
+    return {doc["id"] for doc, _ in index.search(query.split(), k)}
+
+
+VOCAB = [f"t{i}" for i in range(40)]
+
+
+def _random_corpus(n_docs, seed=0):
+    """词频服从偏斜分布的随机语料，返回 (文档, 分词结果)"""
+    rng = random.Random(seed)
+    weights = [1.0 / (i + 1) for i in range(len(VOCAB))]
+    tokenized = [rng.choices(VOCAB, weights, k=rng.randint(3, 30)) for _ in range(n_docs)]
+    docs = [{"id": f"d{i}", "content": " ".join(tokens)} for i, tokens in enumerate(tokenized)]
+    return docs, tokenized
+
+
+def _random_queries(n_queries, seed=1):
+    rng = random.Random(seed)
+    return [rng.sample(VOCAB, rng.randint(1, 5)) for _ in range(n_queries)]
+
+
+def _ranked(index, query, k):
+    return [(doc["id"], round(score, 9)) for doc, score in index.search(query, k)]
+
+
+def _exhaustive_top_k(scores, k, allowed=None):
+    """全量打分后排序：分数降序、同分按文档下标升序，只保留命中查询词（分数 > 0）的文档"""
+    candidates = np.flatnonzero(scores > 0)
+    if allowed is not None:
+        candidates = candidates[allowed[candidates]]
+    order = np.lexsort((candidates, -scores[candidates]))[:k]
+    return candidates[order], scores[candidates[order]]
+
+
+def _assert_same_top_k(actual, expected):
+    np.testing.assert_array_equal(actual[0], expected[0])
+    np.testing.assert_allclose(actual[1], expected[1], rtol=1e-9)
+
+
+def test_parent_doc_id():
+    assert parent_doc_id("abc_chunk_3") == "abc"
+    assert parent_doc_id("a_chunk_b_chunk_0") == "a_chunk_b"
+    assert parent_doc_id("abc") == "abc"
+    assert parent_doc_id("abc_chunk_x") == "abc_chunk_x"
+
+
+def test_doc_id_map_expand():
+    ids = DocIdMap(["p_chunk_0", "p_chunk_1", "q", "p2_chunk_0"])
+    assert ids.expand(["p"]) == ["p_chunk_0", "p_chunk_1"]
+    assert ids.expand(["q", "missing"]) == ["q"]
+    ids.pop("p_chunk_0")
+    assert ids.expand(["p"]) == ["p_chunk_1"]
+
+
+def test_delete_parent_removes_all_chunks():
+    docs = _chunked("doc1", ["头痛 发热", "头痛 咳嗽", "头痛 乏力"]) + _chunked("doc2", ["头痛 腹泻"])
+    index = _build(docs)
+    assert index.delete_documents(["doc1"]) == 3
+    assert _hit_ids(index, "头痛") == {"doc2_chunk_0"}
+    assert index.get_documents(["doc1_chunk_0"]) == [None]
+
+
+def test_update_with_fewer_chunks_drops_stale_chunks():
+    index = _build(_chunked("doc1", ["头痛 发热", "头痛 咳嗽", "头痛 乏力"]))
+    # main.update_knowledge_base：先按原文档 id 删除，再写入新切分块
+    index.delete_documents(["doc1"])
+    new_docs = _chunked("doc1", ["头痛 恶心"])
+    index.add_documents(new_docs, [d["content"].split() for d in new_docs])
+    assert _hit_ids(index, "头痛") == {"doc1_chunk_0"}
+    assert _hit_ids(index, "咳嗽") == set()
+
+
+def test_delete_survives_compaction():
+    index = _build(_chunked("doc1", ["头痛 发热", "头痛 咳嗽"]) + [_doc("doc2", "头痛 腹泻")])
+    index.compact()
+    index.delete_documents(["doc1"])
+    index.compact()
+    assert _hit_ids(index, "头痛") == {"doc2"}
+
+
+def test_snapshot_reload_matches_in_memory_index(tmp_path):
+    docs, tokenized = _random_corpus(200)
+    index = BM25Index.build(docs, tokenized, generation="g1")
+    index.save_snapshot(str(tmp_path), "g1")
+    loaded = BM25Index.load_snapshot(str(tmp_path), "g1")
+    assert loaded is not None and len(loaded) == len(index)
+    assert loaded.get_documents(["d7"]) == [docs[7]]
+    for query in _random_queries(20):
+        assert _ranked(loaded, query, 10) == _ranked(index, query, 10)
+        np.testing.assert_allclose(loaded.get_scores(query), index.get_scores(query))
+
+
+def test_snapshot_generation_mismatch_returns_none(tmp_path):
+    docs, tokenized = _random_corpus(10)
+    BM25Index.build(docs, tokenized).save_snapshot(str(tmp_path), "g1")
+    assert BM25Index.load_snapshot(str(tmp_path), "g2") is None
+    assert BM25Index.load_snapshot(str(tmp_path / "missing")) is None
+
+
+def test_snapshot_of_updated_index_keeps_live_documents_only(tmp_path):
+    docs, tokenized = _random_corpus(50)
+    index = BM25Index.build(docs, tokenized)
+    index.delete_documents(["d0", "d1"])
+    index.add_documents([{"id": "new", "content": "t0 t39"}], [["t0", "t39"]])
+    index.save_snapshot(str(tmp_path), "g2")
+    loaded = BM25Index.load_snapshot(str(tmp_path), "g2")
+    assert len(loaded) == 49
+    assert loaded.get_documents(["d0", "new"]) == [None, {"id": "new", "content": "t0 t39"}]
+    assert _ranked(loaded, ["t39", "t0"], 5) == _ranked(index, ["t39", "t0"], 5)
+
+    # 重载后的索引（mmap 只读数组）仍可增量更新
+    loaded.add_documents([{"id": "after", "content": "t39"}], [["t39"]])
+    assert "after" in _hit_ids(loaded, "t39")
+
+
+def test_get_scores_matches_rank_bm25():
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    docs, tokenized = _random_corpus(300)
+    index = BM25Index.build(docs, tokenized)
+    reference = rank_bm25.BM25Okapi(tokenized)
+    for query in _random_queries(30):
+        np.testing.assert_allclose(index.get_scores(query), reference.get_scores(query), rtol=1e-9)
+
+
+@pytest.mark.parametrize("k", [1, 5, 20, 500])
+def test_max_score_top_k_matches_exhaustive(k):
+    docs, tokenized = _random_corpus(300)
+    index = BM25Index.build(docs, tokenized)
+    # 含重复查询词与词表外的词
+    queries = _random_queries(40) + [["t0", "t0", "t3"], ["unknown"], ["t1", "unknown"]]
+    for query in queries:
+        _assert_same_top_k(index.top_k(query, k), _exhaustive_top_k(index.get_scores(query), k))
+
+
+class _EvenIdFilter:
+    """测试用过滤条件：只保留 id 为偶数的文档"""
+
+    key = "even"
+    fields = ("id",)
+
+    def matches(self, doc):
+        return int(doc["id"][1:]) % 2 == 0
+
+
+def test_max_score_top_k_with_filter_matches_exhaustive():
+    docs, tokenized = _random_corpus(300)
+    index = BM25Index.build(docs, tokenized)
+    allowed = np.array([int(doc["id"][1:]) % 2 == 0 for doc in docs])
+    for query in _random_queries(30):
+        expected = _exhaustive_top_k(index.get_scores(query), 10, allowed)
+        _assert_same_top_k(index.top_k(query, 10, _EvenIdFilter()), expected)
+
+
+def test_sparse_scorer_matches_index():
+    pytest.importorskip("scipy")
+    docs, tokenized = _random_corpus(300)
+    index = BM25Index.build(docs, tokenized)
+    scorer = index.sparse_scorer()
+    queries = _random_queries(30)
+    batch_scores = scorer.get_scores_batch(queries)
+    batch_top = scorer.top_k_batch(queries, 10)
+    filtered_top = scorer.top_k_batch(queries, 10, _EvenIdFilter())
+    allowed = np.array([int(doc["id"][1:]) % 2 == 0 for doc in docs])
+    for j, query in enumerate(queries):
+        scores = index.get_scores(query)
+        np.testing.assert_allclose(batch_scores[:, j], scores, rtol=1e-9)
+        _assert_same_top_k(batch_top[j], _exhaustive_top_k(scores, 10))
+        _assert_same_top_k(filtered_top[j], _exhaustive_top_k(scores, 10, allowed))
+
+
+def test_sparse_scorer_is_rebuilt_after_update():
+    pytest.importorskip("scipy")
+    docs, tokenized = _random_corpus(50)
+    index = BM25Index.build(docs, tokenized)
+    before = index.sparse_scorer()
+    index.add_documents([{"id": "new", "content": "t39 t39"}], [["t39", "t39"]])
+    scorer = index.sparse_scorer()
+    assert scorer is not before
+    assert scorer.search_batch([["t39"]], 1)[0][0][0]["id"] == "new"
+
+
+def _scores_by_id(index, query):
+    return {doc["id"]: score for doc, score in index.search(query, 1000)}
+
+
+def _apply_random_updates(index, docs, tokenized, seed=3):
+    """随机新增 / 覆盖 / 删除，返回更新后的存活文档 {id: 分词}"""
+    rng = random.Random(seed)
+    live = {doc["id"]: tokens for doc, tokens in zip(docs, tokenized)}
+    extra_docs, extra_tokens = _random_corpus(60, seed=seed)
+    for i, (doc, tokens) in enumerate(zip(extra_docs, extra_tokens)):
+        op = rng.random()
+        if op < 0.4:
+            doc = {"id": f"new{i}", "content": doc["content"]}
+        elif op < 0.7:
+            doc = {"id": rng.choice(sorted(live)), "content": doc["content"]}
+        else:
+            victim = rng.choice(sorted(live))
+            index.delete_documents([victim])
+            del live[victim]
+            continue
+        index.add_documents([doc], [tokens])
+        live[doc["id"]] = tokens
+    return live
+
+
+@pytest.mark.parametrize("compact_ratio", [1e9, 0.2, 0.0])
+def test_incremental_updates_match_rebuilt_index(monkeypatch, compact_ratio):
+    # 不合并（纯增量段 + 墓碑）/ 默认阈值 / 每次更新后都合并
+    monkeypatch.setattr(BM25Index, "COMPACT_RATIO", compact_ratio)
+    docs, tokenized = _random_corpus(100)
+    index = BM25Index.build(docs, tokenized)
+    live = _apply_random_updates(index, docs, tokenized)
+    if compact_ratio == 1e9:
+        assert index.is_dirty
+    rebuilt = BM25Index.build([{"id": doc_id} for doc_id in live], list(live.values()))
+    assert len(index) == len(rebuilt) == len(live)
+    assert index.avgdl == pytest.approx(rebuilt.avgdl)
+    for query in _random_queries(20):
+        actual, expected = _scores_by_id(index, query), _scores_by_id(rebuilt, query)
+        assert actual.keys() == expected.keys()
+        for doc_id, score in expected.items():
+            assert actual[doc_id] == pytest.approx(score, rel=1e-9)
+
+    index.compact()
+    assert not index.is_dirty
+    for query in _random_queries(5):
+        assert _scores_by_id(index, query).keys() == _scores_by_id(rebuilt, query).keys()
+
+
+def test_deleted_documents_are_tombstoned_until_compaction(monkeypatch):
+    monkeypatch.setattr(BM25Index, "COMPACT_RATIO", 1e9)
+    docs, tokenized = _random_corpus(20)
+    index = BM25Index.build(docs, tokenized)
+    assert index.delete_documents(["d3", "d3", "missing"]) == 1
+    assert index.is_dirty and len(index) == 19
+    assert index.get_scores(tokenized[3])[3] == 0.0
+    assert index.get_documents(["d3"]) == [None]
+    assert "d3" not in {doc["id"] for doc in index.iter_live_documents()}
+    index.compact()
+    assert not index.is_dirty and len(index.doc_ids) == 19
+
+
+def test_upsert_replaces_existing_document():
+    index = _build([_doc("a", "头痛 发热"), _doc("b", "咳嗽")])
+    index.add_documents([_doc("a", "腹泻")], [["腹泻"]])
+    assert len(index) == 2
+    assert _hit_ids(index, "头痛") == set()
+    assert _hit_ids(index, "腹泻") == {"a"}
@@ -0,0 +1,81 @@
+"""caching.LRUCache / stable_digest / normalize_query 与查询向量缓存"""
+import caching
+from caching import LRUCache, normalize_query, stable_digest
+from embedding_cache import EmbeddingCache
+
+
+def test_stable_digest_is_deterministic_and_unambiguous():
+    assert stable_digest("a", 1) == stable_digest("a", 1)
+    assert stable_digest("ab", "c") != stable_digest("a", "bc")
+
+
+def test_normalize_query_collapses_whitespace():
+    assert normalize_query("  头痛   怎么办\t\n") == "头痛 怎么办"
+    assert normalize_query(None) == ""
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_items=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_byte_limit_and_oversized_values():
+    cache = LRUCache(max_items=10, max_bytes=10, sizeof=len)
+    cache.set("a", b"12345")
+    cache.set("b", b"12345")
+    cache.set("c", b"1")
+    assert cache.get("a") is None and len(cache) == 2
+    cache.set("huge", b"x" * 11)
+    assert cache.get("huge") is None
+    assert cache.stats()["bytes"] == 6
+
+
+def test_lru_ttl_expires_lazily(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(caching.time, "monotonic", lambda: now[0])
+    cache = LRUCache(ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=60)
+    now[0] += 30
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.stats()["misses"] == 1 and cache.stats()["hits"] == 1
+
+
+def test_embedding_cache_two_tiers(fake_redis):
+    calls = []
+
+    def embed(text):
+        calls.append(text)
+        return [0.5, 0.25]
+
+    cache = EmbeddingCache("m1", redis_client=fake_redis)
+    assert cache.embed(" 头痛  怎么办 ", embed) == [0.5, 0.25]
+    assert cache.embed("头痛 怎么办", embed) == [0.5, 0.25]
+    assert calls == [" 头痛  怎么办 "]
+
+    # 新进程（空的进程内一级）从 Redis 命中；换模型后不命中
+    other = EmbeddingCache("m1", redis_client=fake_redis)
+    assert other.get("头痛 怎么办") == [0.5, 0.25]
+    assert other.stats()["redis"]["hits"] == 1
+    assert EmbeddingCache("m2", redis_client=fake_redis).get("头痛 怎么办") is None
+
+
+def test_embedding_cache_embed_many_dedupes_misses(fake_redis):
+    batches = []
+
+    def embed_batch(texts):
+        batches.append(list(texts))
+        return [[float(len(t))] for t in texts]
+
+    cache = EmbeddingCache("m1", redis_client=fake_redis)
+    cache.set("a", [9.0])
+    assert cache.embed_many(["a", "bb", " bb", "ccc"], embed_batch) == [[9.0], [2.0], [2.0], [3.0]]
+    assert batches == [["bb", "ccc"]]
+    assert EmbeddingCache("m1", redis_client=fake_redis).get_many(["bb", "ccc"]) == [[2.0], [3.0]]
@@ -0,0 +1,14 @@
+"""config.resolve_path：相对路径按项目根目录解析"""
+import os
+
+from config import PROJECT_ROOT, resolve_path
+
+
+def test_relative_path_resolves_against_project_root(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert resolve_path("data/reranker_weights.json") == os.path.join(PROJECT_ROOT, "data", "reranker_weights.json")
+    assert os.path.isfile(os.path.join(PROJECT_ROOT, "config.py"))
+
+
+def test_absolute_path_is_unchanged(tmp_path):
+    assert resolve_path(str(tmp_path / "w.json")) == str(tmp_path / "w.json")
@@ -0,0 +1,66 @@
+"""fusion：加权 RRF / 线性融合的分数、去重与元数据"""
+import pytest
+
+from fusion import DEFAULT_RRF_K, fuse, linear_fusion, reciprocal_rank_fusion
+from models import KnowledgeSource
+
+
+def _src(doc_id, score, path="vector"):
+    return KnowledgeSource(source=path, content=f"内容{doc_id}", score=score, metadata={"id": doc_id} if doc_id else {})
+
+
+def _ids(sources):
+    return [s.metadata.get("id") or s.content for s in sources]
+
+
+def test_rrf_scores_and_order():
+    results = {
+        "vector": [_src("a", 0.9), _src("b", 0.8)],
+        "keyword": [_src("b", 12.0, "keyword"), _src("c", 3.0, "keyword")],
+        "rule": [],
+    }
+    fused = reciprocal_rank_fusion(results, k=60)
+    assert _ids(fused) == ["b", "a", "c"]
+    b = fused[0].metadata
+    assert b["fusion_score"] == pytest.approx(1 / 62 + 1 / 61)
+    assert b["fusion_ranks"] == {"vector": 2, "keyword": 1}
+    assert b["fusion_path_scores"] == {"vector": 0.8, "keyword": 12.0}
+    # 保留首次出现（向量路）的对象，原始 score 不被覆盖
+    assert fused[0].score == 0.8 and fused[0].source == "vector"
+
+
+def test_rrf_weights_and_duplicates_within_path():
+    results = {"vector": [_src("a", 0.9), _src("a", 0.5), _src("b", 0.4)], "keyword": [_src("b", 1.0, "keyword")]}
+    fused = reciprocal_rank_fusion(results, weights={"vector": 1.0, "keyword": 0.0}, k=DEFAULT_RRF_K)
+    assert _ids(fused) == ["a", "b"]
+    # 同一路内重复只按首次排名计分；权重为 0 的路径不贡献分数
+    assert fused[0].metadata["fusion_score"] == pytest.approx(1 / 61)
+    assert fused[1].metadata["fusion_score"] == pytest.approx(1 / 63)
+
+
+def test_sources_without_id_merge_by_content():
+    results = {"vector": [_src(None, 0.9)], "keyword": [KnowledgeSource(source="keyword", content="内容None", score=3.0)]}
+    assert len(reciprocal_rank_fusion(results)) == 1
+
+
+def test_linear_min_max_normalization():
+    results = {
+        "vector": [_src("a", 0.9), _src("b", 0.5), _src("c", 0.1)],
+        "keyword": [_src("c", 20.0, "keyword"), _src("a", 10.0, "keyword")],
+    }
+    fused = linear_fusion(results, weights={"vector": 1.0, "keyword": 2.0})
+    scores = {s.metadata["id"]: s.metadata["fusion_score"] for s in fused}
+    assert scores == pytest.approx({"a": 1.0 + 0.0, "b": 0.5, "c": 0.0 + 2.0})
+    assert _ids(fused) == ["c", "a", "b"]
+
+
+def test_linear_constant_scores_count_as_one():
+    fused = linear_fusion({"rule": [_src("a", 0.8, "rule"), _src("b", 0.8, "rule")], "vector": []})
+    assert [s.metadata["fusion_score"] for s in fused] == [1.0, 1.0]
+
+
+def test_fuse_dispatch():
+    results = {"vector": [_src("a", 0.9)]}
+    assert _ids(fuse("rrf", results)) == _ids(fuse("linear", results)) == ["a"]
+    with pytest.raises(ValueError):
+        fuse("none", results)
@@ -0,0 +1,10 @@
+"""KnowledgeBase：按原文档 id 删除切分块的 Milvus 表达式"""
+from knowledge_base import KnowledgeBase
+
+
+def test_milvus_delete_expr_escapes_like_wildcards():
+    expr = KnowledgeBase._delete_expr(['a_1', '5%"x'])
+    assert expr.startswith('id in ["a_1", "5%\\"x"]')
+    # 「_」「%」按字面匹配：删除 a_1 不会连带 ab1_chunk_0 等
+    assert 'id like "a\\\\_1\\\\_chunk\\\\_%"' in expr
+    assert 'id like "5\\\\%\\"x\\\\_chunk\\\\_%"' in expr
@@ -0,0 +1,58 @@
+"""学习型重排特征：默认 FUSION_METHOD=none 时同样取得各路分数"""
+import math
+
+import pytest
+
+from config import settings
+from learned_reranker import extract_features
+from models import KnowledgeSource
+from retriever import MultiPathRetriever
+
+
+def _src(doc_id, score, path):
+    return KnowledgeSource(
+        source="knowledge_base",
+        content=f"内容{doc_id}",
+        score=score,
+        metadata={"id": doc_id, "name": doc_id, "retrieval_type": path},
+    )
+
+
+@pytest.mark.parametrize("fusion_method", ["none", "rrf", "linear"])
+def test_candidates_carry_all_path_scores(monkeypatch, fusion_method):
+    monkeypatch.setattr(settings, "fusion_method", fusion_method)
+    results = {
+        "vector": [_src("a", 0.9, "vector"), _src("b", 0.7, "vector")],
+        "keyword": [_src("a", 12.0, "keyword"), _src("c", 3.0, "keyword")],
+        "rule": [],
+    }
+    retriever = MultiPathRetriever.__new__(MultiPathRetriever)
+    candidates = {s.metadata["id"]: s for s in retriever._merge_recall_results(results, {})}
+    assert set(candidates) == {"a", "b", "c"}
+
+    features = extract_features("头痛", [], candidates["a"])
+    # 同时被向量路与关键词路召回的文档两项特征都有值
+    assert features[0] == 0.9 and features[1] == pytest.approx(math.log1p(12.0))
+    assert extract_features("头痛", [], candidates["c"])[:2] == [0.0, pytest.approx(math.log1p(3.0))]
+
+
+def test_none_merge_keeps_first_seen_source_and_order(monkeypatch):
+    monkeypatch.setattr(settings, "fusion_method", "none")
+    results = {"vector": [_src("a", 0.9, "vector")], "keyword": [_src("a", 12.0, "keyword")], "rule": [_src("r", 1.0, "rule")]}
+    retriever = MultiPathRetriever.__new__(MultiPathRetriever)
+    merged = retriever._merge_recall_results(results, {})
+    assert [(s.metadata["id"], s.score) for s in merged] == [("a", 0.9), ("r", 1.0)]
+    assert results["vector"][0].metadata.get("fusion_path_scores") is None
+
+
+def test_recall_candidates_batch_merges_without_rerank(monkeypatch):
+    monkeypatch.setattr(settings, "fusion_method", "none")
+    retriever = MultiPathRetriever.__new__(MultiPathRetriever)
+    batch = [
+        {"vector": [_src("a", 0.9, "vector")], "keyword": [_src("b", 2.0, "keyword")], "rule": []},
+        {"vector": [], "keyword": [], "rule": [_src("r", 1.0, "rule")]},
+    ]
+    monkeypatch.setattr(retriever, "_run_batch_recall_paths", lambda queries, metadata_filter=None: (batch, {"queries": len(queries)}))
+    monkeypatch.setattr(retriever, "_rerank_candidates", lambda *args: pytest.fail("不应重排"))
+    candidates = retriever.recall_candidates_batch(["头痛", "发热"])
+    assert [[s.metadata["id"] for s in query_candidates] for query_candidates in candidates] == [["a", "b"], ["r"]]
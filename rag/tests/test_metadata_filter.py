@@ -0,0 +1,68 @@
+"""MetadataFilter：Milvus 表达式转义 / 按元素匹配，以及科室后过滤的扩大 limit 重试"""
+from types import SimpleNamespace
+
+from config import settings
+from metadata_filter import MetadataFilter
+from retriever import MultiPathRetriever
+
+
+def test_department_not_pushed_down_by_default():
+    f = MetadataFilter(department="呼吸内科", category="内科")
+    assert f.milvus_expr() == 'category_primary == "内科"'
+    assert f.needs_post_filter()
+    assert not f.needs_post_filter(department_pushdown=True)
+
+
+def test_pushdown_matches_whole_elements_and_escapes_wildcards():
+    expr = MetadataFilter(department='5%_"科').milvus_expr(department_pushdown=True)
+    assert 'cure_department == "5%_\\"科"' in expr
+    assert 'like "5\\\\%\\\\_\\"科、%"' in expr
+    assert 'like "%、5\\\\%\\\\_\\"科"' in expr
+
+
+def test_matches_requires_exact_element():
+    f = MetadataFilter(department="内科")
+    assert f.matches({"cure_department": "外科、内科"})
+    assert not f.matches({"cure_department": "神经内科"})
+
+
+class _FakeCollection:
+    """按 limit 返回前 N 条的假 Milvus collection"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.limits = []
+
+    def search(self, data, anns_field, param, limit, expr, output_fields):
+        self.limits.append(limit)
+        hits = [SimpleNamespace(entity=doc, distance=float(i)) for i, doc in enumerate(self.docs[:limit])]
+        return [hits for _ in data]
+
+
+def _retriever(docs):
+    retriever = MultiPathRetriever.__new__(MultiPathRetriever)
+    retriever.collection = _FakeCollection(docs)
+    return retriever
+
+
+def _doc(i, department):
+    return {"id": f"d{i}", "content": str(i), "cure_department": department}
+
+
+def test_post_filter_retries_with_larger_limit_until_top_k(monkeypatch):
+    monkeypatch.setattr(settings, "milvus_department_pushdown", False)
+    monkeypatch.setattr(settings, "milvus_filter_overfetch", 4)
+    docs = [_doc(i, "外科") for i in range(30)] + [_doc(i, "内科") for i in range(30, 40)]
+    retriever = _retriever(docs)
+    hits = retriever._milvus_search([[0.0], [1.0]], 3, MetadataFilter(department="内科"))
+    assert [[doc["id"] for doc, _ in query_hits] for query_hits in hits] == [["d30", "d31", "d32"]] * 2
+    assert retriever.collection.limits == [12, 48]
+
+
+def test_post_filter_stops_when_results_exhausted(monkeypatch):
+    monkeypatch.setattr(settings, "milvus_department_pushdown", False)
+    monkeypatch.setattr(settings, "milvus_filter_overfetch", 4)
+    retriever = _retriever([_doc(0, "内科"), _doc(1, "外科")])
+    hits = retriever._milvus_search([[0.0]], 3, MetadataFilter(department="内科"))
+    assert [doc["id"] for doc, _ in hits[0]] == ["d0"]
+    assert retriever.collection.limits == [12]
@@ -0,0 +1,75 @@
+"""MicroBatcher 行为测试：合并、按 key 分组、异常分发"""
+import asyncio
+import gc
+
+import pytest
+
+from micro_batcher import MicroBatcher
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_submits_are_batched_in_order():
+    calls = []
+
+    async def batch_fn(key, items):
+        calls.append((key, list(items)))
+        return [item * 10 for item in items]
+
+    async def main():
+        batcher = MicroBatcher(batch_fn, max_batch_size=8, max_wait_ms=5)
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+        return batcher, results
+
+    batcher, results = _run(main())
+    assert results == [0, 10, 20, 30, 40]
+    assert calls == [(None, [0, 1, 2, 3, 4])]
+    assert batcher.stats()["batches"] == 1
+    assert not batcher._tasks
+
+
+def test_full_batch_flushes_and_keys_are_grouped():
+    calls = []
+
+    async def batch_fn(key, items):
+        calls.append((key, list(items)))
+        return [(key, item) for item in items]
+
+    async def main():
+        batcher = MicroBatcher(batch_fn, max_batch_size=2, max_wait_ms=1000)
+        return await asyncio.wait_for(
+            asyncio.gather(batcher.submit(1, "a"), batcher.submit(2, "b"), batcher.submit(3, "a"), batcher.submit(4, "b")),
+            timeout=1,
+        )
+
+    assert _run(main()) == [("a", 1), ("b", 2), ("a", 3), ("b", 4)]
+    assert sorted(calls) == [("a", [1, 3]), ("b", [2, 4])]
+
+
+def test_batch_failure_is_raised_in_every_request():
+    async def batch_fn(key, items):
+        gc.collect()
+        raise ValueError("boom")
+
+    async def main():
+        batcher = MicroBatcher(batch_fn, max_wait_ms=1)
+        return await asyncio.wait_for(
+            asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True), timeout=1
+        )
+
+    results = _run(main())
+    assert len(results) == 3 and all(isinstance(r, ValueError) for r in results)
+
+
+def test_wrong_result_count_fails_the_batch():
+    async def batch_fn(key, items):
+        return items[:-1]
+
+    async def main():
+        batcher = MicroBatcher(batch_fn, max_wait_ms=1)
+        await asyncio.wait_for(asyncio.gather(batcher.submit(1), batcher.submit(2)), timeout=1)
+
+    with pytest.raises(RuntimeError):
+        _run(main())
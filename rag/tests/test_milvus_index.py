@@ -0,0 +1,13 @@
+"""milvus_index 建索引参数：默认值与覆盖优先级"""
+from milvus_index import build_index_params
+
+
+def test_ivf_default_nlist_is_128():
+    assert build_index_params("IVF_FLAT")["params"] == {"nlist": 128}
+
+
+def test_collection_defaults_rank_below_explicit_params():
+    assert build_index_params("IVF_FLAT", defaults={"nlist": 256})["params"] == {"nlist": 256}
+    assert build_index_params("IVF_FLAT", params={"nlist": 64}, defaults={"nlist": 256})["params"] == {"nlist": 64}
+    # 不属于该索引类型的默认项不会混入
+    assert build_index_params("HNSW", defaults={"nlist": 256})["params"] == {"M": 16, "efConstruction": 200}
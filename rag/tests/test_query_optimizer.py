@@ -0,0 +1,75 @@
+"""query_optimizer 改写门控（每个问题只判定、计数一次）与改写缓存"""
+import asyncio
+
+import query_optimizer
+from query_optimizer import aoptimize, rewrite_gate_counts, rewrite_stats, should_rewrite
+from rewrite_cache import RewriteCache
+
+
+def test_should_rewrite_records_standalone_skip(monkeypatch):
+    monkeypatch.setattr(query_optimizer, "rewrite_gate_counts", rewrite_gate_counts.__class__())
+    assert should_rewrite("头痛怎么办") is False
+    assert rewrite_stats()["skipped"] == 1
+    assert rewrite_stats()["skip_rate"] == 1.0
+
+
+def test_should_rewrite_disabled_is_not_counted(monkeypatch):
+    monkeypatch.setattr(query_optimizer, "rewrite_gate_counts", rewrite_gate_counts.__class__())
+    assert should_rewrite("头痛怎么办", enable_rewrite=False) is False
+    assert rewrite_stats()["reasons"] == {}
+
+
+def test_aoptimize_uses_given_decision(monkeypatch):
+    calls = []
+    monkeypatch.setattr(query_optimizer, "needs_rewrite", lambda *a: calls.append(a) or (True, "long"))
+
+    async def fake_rewrite(q, **kwargs):
+        return "改写:" + q
+
+    monkeypatch.setattr(query_optimizer, "arewrite_query_for_retrieval", fake_rewrite)
+    raw = asyncio.run(aoptimize("头痛", rewrite_decision=False, enable_normalize=False))
+    rewritten = asyncio.run(aoptimize("头痛", rewrite_decision=True, enable_normalize=False))
+    assert (raw, rewritten) == ("头痛", "改写:头痛")
+    assert calls == []
+
+
+def test_rewrite_cache_hits_and_keys():
+    cache = RewriteCache(model="m1")
+    key = cache.key("头痛怎么办")
+    assert key != cache.key("头痛怎么办", [{"role": "user", "content": "我发烧了"}])
+    assert key != RewriteCache(model="m2").key("头痛怎么办")
+    cache.set(key, "头痛 治疗")
+    assert cache.get(key) == "头痛 治疗"
+
+
+def test_rewrite_cache_redis_tier(fake_async_redis):
+    writer, reader = RewriteCache(fake_async_redis, model="m1"), RewriteCache(fake_async_redis, model="m1")
+    key = writer.key("头痛怎么办")
+
+    async def main():
+        await writer.aset(key, "头痛 治疗")
+        return await reader.aget(key), await reader.aget(writer.key("没写过"))
+
+    assert asyncio.run(main()) == ("头痛 治疗", None)
+    assert reader.get(key) == "头痛 治疗"
+    assert reader.stats()["redis"]["hits"] == 1
+
+
+def test_aoptimize_uses_rewrite_cache(monkeypatch):
+    calls = []
+
+    class FakeLLM:
+        async def ainvoke(self, messages):
+            calls.append(messages)
+            return type("Msg", (), {"content": "头痛 治疗方法"})()
+
+    cache = RewriteCache(model="m1")
+    question = "我这两天一直头痛得厉害，晚上也睡不好，白天工作完全没法集中注意力，应该怎么办才好呢"
+
+    async def main():
+        first = await aoptimize(question, llm=FakeLLM(), cache=cache, adaptive_rewrite=False, enable_normalize=False)
+        second = await aoptimize(question, llm=FakeLLM(), cache=cache, adaptive_rewrite=False, enable_normalize=False)
+        return first, second
+
+    assert asyncio.run(main()) == ("头痛 治疗方法", "头痛 治疗方法")
+    assert len(calls) == 1
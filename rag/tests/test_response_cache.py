@@ -0,0 +1,64 @@
+"""问诊响应缓存：进程内一级 + Redis 二级、版本失效"""
+import asyncio
+
+from models import ConsultResponse
+from response_cache import ResponseCache
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_local_tier_without_redis():
+    cache = ResponseCache()
+
+    async def main():
+        assert await cache.get("k") is None
+        await cache.set("k", ConsultResponse(answer="多休息"))
+        hit = await cache.get("k")
+        await cache.invalidate()
+        return hit, await cache.get("k")
+
+    hit, after_invalidate = _run(main())
+    assert hit.answer == "多休息"
+    assert after_invalidate is None
+
+
+def test_redis_tier_fills_local_tier(fake_async_redis):
+    writer, reader = ResponseCache(fake_async_redis), ResponseCache(fake_async_redis)
+
+    async def main():
+        await writer.set("k", ConsultResponse(answer="多喝水"))
+        first = await reader.get("k")
+        second = await reader.get("k")
+        return first, second
+
+    first, second = _run(main())
+    assert first.answer == second.answer == "多喝水"
+    assert reader.stats()["redis"]["hits"] == 1
+    assert reader.stats()["local"]["hits"] == 1
+
+
+def test_invalidation_switches_version(fake_async_redis):
+    writer, reader = ResponseCache(fake_async_redis), ResponseCache(fake_async_redis)
+
+    async def main():
+        await writer.set("k", ConsultResponse(answer="旧回答"))
+        assert (await reader.get("k")).answer == "旧回答"
+        await writer.invalidate()
+        # 订阅回调：其他 worker 收到新版本后清空进程内一级
+        reader._on_invalidate({"data": writer.version.encode("utf-8")})
+        return await reader.get("k")
+
+    assert _run(main()) is None
+    assert reader.redis_key("k").endswith(":v1")
+
+
+def test_oversized_response_skips_local_tier():
+    cache = ResponseCache(local_max_bytes=300)
+
+    async def main():
+        await cache.set("k", ConsultResponse(answer="长" * 100))
+        return await cache.get("k")
+
+    assert _run(main()) is None
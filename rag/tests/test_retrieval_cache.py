@@ -0,0 +1,50 @@
+"""检索结果缓存：两级命中、副本隔离、版本失效"""
+from metadata_filter import MetadataFilter
+from models import KnowledgeSource
+from retrieval_cache import RetrievalCache
+
+
+def _sources():
+    return [KnowledgeSource(source="knowledge_base", content="头痛", score=0.9, metadata={"id": "d1"})]
+
+
+def test_local_hit_returns_isolated_copy():
+    cache = RetrievalCache(generation="g1")
+    key, hit, tier = cache.lookup("头痛  怎么办", 3)
+    assert hit is None and tier is None
+    cache.store(key, _sources())
+    _, hit, tier = cache.lookup(" 头痛 怎么办", 3)
+    assert tier == "local" and hit[0].content == "头痛"
+    hit[0].metadata["id"] = "changed"
+    assert cache.lookup("头痛 怎么办", 3)[1][0].metadata["id"] == "d1"
+
+
+def test_key_depends_on_top_k_filter_and_generation():
+    cache = RetrievalCache(generation="g1")
+    key = cache.key("头痛", 3)
+    assert key != cache.key("头痛", 5)
+    assert key != cache.key("头痛", 3, MetadataFilter(department="内科"))
+    assert key != RetrievalCache(generation="g2").key("头痛", 3)
+
+
+def test_redis_tier_shared_and_invalidated_by_version(fake_redis):
+    writer = RetrievalCache(redis_client=fake_redis, generation="g1")
+    key, _, _ = writer.lookup("头痛", 3)
+    writer.store(key, _sources())
+
+    reader = RetrievalCache(redis_client=fake_redis, generation="g1", version_check_interval=0)
+    _, hit, tier = reader.lookup("头痛", 3)
+    assert tier == "redis" and hit[0].metadata["id"] == "d1"
+    assert reader.lookup("头痛", 3)[2] == "local"
+
+    # 其他 worker 更新知识库：版本递增后旧 key 不再命中
+    writer.invalidate()
+    assert reader.lookup("头痛", 3)[1] is None
+
+
+def test_invalidate_without_redis_bumps_local_version():
+    cache = RetrievalCache(generation="g1")
+    key, _, _ = cache.lookup("头痛", 3)
+    cache.store(key, _sources())
+    cache.invalidate()
+    assert cache.lookup("头痛", 3)[1] is None
@@ -0,0 +1,89 @@
+"""rule_matcher：Aho-Corasick 全量匹配、leftmost-longest 匹配与词典召回"""
+import random
+
+from rule_matcher import AhoCorasick, DictionaryRecall, split_field
+
+
+def _automaton(patterns):
+    automaton = AhoCorasick()
+    for i, pattern in enumerate(patterns):
+        automaton.add(pattern, i)
+    automaton.build()
+    return automaton
+
+
+def _brute_force(patterns, text):
+    return sorted(
+        (start, start + len(p), p)
+        for p in set(patterns)
+        for start in range(len(text) - len(p) + 1)
+        if text.startswith(p, start)
+    )
+
+
+def test_find_all_matches_brute_force():
+    rng = random.Random(0)
+    alphabet = "abc"
+    for _ in range(50):
+        patterns = ["".join(rng.choices(alphabet, k=rng.randint(1, 4))) for _ in range(8)]
+        text = "".join(rng.choices(alphabet, k=30))
+        automaton = _automaton(patterns)
+        found = sorted((s, e, automaton.pattern(idx)) for s, e, idx in automaton.iter_matches(text))
+        assert found == _brute_force(patterns, text)
+
+
+def _brute_force_leftmost_longest(patterns, text):
+    result, pos = [], 0
+    while pos < len(text):
+        match = max((p for p in set(patterns) if text.startswith(p, pos)), key=len, default=None)
+        if match is None:
+            pos += 1
+            continue
+        result.append((pos, pos + len(match), match))
+        pos += len(match)
+    return result
+
+
+def test_longest_matches_is_leftmost_longest():
+    rng = random.Random(1)
+    for _ in range(100):
+        patterns = ["".join(rng.choices("abc", k=rng.randint(1, 4))) for _ in range(6)]
+        text = "".join(rng.choices("abc", k=25))
+        automaton = _automaton(patterns)
+        found = [(s, e, automaton.pattern(idx)) for s, e, idx in automaton.longest_matches(text)]
+        assert found == _brute_force_leftmost_longest(patterns, text)
+
+
+def test_longest_matches_prefers_earlier_start_over_longer_overlap():
+    automaton = _automaton(["想吐", "恶心想吐", "心想吐了吗"])
+    assert [automaton.pattern(i) for _, _, i in automaton.longest_matches("恶心想吐了吗")] == ["恶心想吐"]
+    assert automaton.longest_matches("") == []
+
+
+def test_duplicate_pattern_accumulates_values():
+    automaton = AhoCorasick()
+    automaton.add("头痛", "d1")
+    automaton.add("头痛", "d2")
+    assert len(automaton) == 1
+    assert automaton.find_all("偏头痛") == [(1, 3, ["d1", "d2"])]
+
+
+def test_split_field():
+    assert split_field("内科、呼吸内科/儿科, 急诊") == ["内科", "呼吸内科", "儿科", "急诊"]
+    assert split_field(["内科", " "]) == ["内科"]
+    assert split_field(None) == []
+
+
+def test_dictionary_recall_ranks_name_hits_first():
+    recall = DictionaryRecall.build([
+        {"id": "flu", "name": "流行性感冒", "symptoms": "发热、咳嗽、头痛"},
+        {"id": "cold", "name": "感冒", "symptoms": "咳嗽、流涕"},
+        {"id": "migraine", "name": "偏头痛", "symptoms": "头痛、恶心"},
+    ])
+    results = recall.match("感冒了，发热咳嗽")
+    assert results[0][0] == "cold" and results[0][1] == 1.0
+    assert results[0][2]["names"] == ["感冒"]
+    flu = dict((doc_id, (score, detail)) for doc_id, score, detail in results)["flu"]
+    assert sorted(flu[1]["symptoms"]) == ["发热", "咳嗽"]
+    assert flu[0] == 0.8 * 2 / 3
+    assert recall.match("没有命中的问题") == []
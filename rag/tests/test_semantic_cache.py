@@ -0,0 +1,61 @@
+"""语义答案缓存：阈值、过滤条件隔离、TTL 与淘汰"""
+import semantic_cache
+from models import ConsultResponse
+from semantic_cache import SemanticCache
+
+
+def _response(answer):
+    return ConsultResponse(answer=answer)
+
+
+def test_hit_above_threshold_with_same_filter():
+    cache = SemanticCache(threshold=0.95)
+    cache.add("发烧39度怎么办", [1.0, 0.0], _response("多喝水"))
+    hit = cache.lookup("高烧39度如何处理", [0.99, 0.05])
+    assert hit is not None
+    response, similarity, matched = hit
+    assert response.answer == "多喝水" and matched == "发烧39度怎么办" and similarity > 0.95
+    assert cache.lookup("头痛", [0.0, 1.0]) is None
+    assert cache.lookup("高烧39度如何处理", [0.99, 0.05], filter_key=("内科", None)) is None
+
+
+def test_returned_response_is_a_copy():
+    cache = SemanticCache()
+    cache.add("q", [1.0, 0.0], _response("原回答"))
+    cache.lookup("q", [1.0, 0.0])[0].answer = "被修改"
+    assert cache.lookup("q", [1.0, 0.0])[0].answer == "原回答"
+
+
+def test_expired_entries_miss_and_free_their_slot(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(semantic_cache.time, "monotonic", lambda: now[0])
+    cache = SemanticCache(max_items=1, ttl=10)
+    cache.add("a", [1.0, 0.0], _response("A"))
+    now[0] += 11
+    assert cache.lookup("a", [1.0, 0.0]) is None and len(cache) == 0
+    cache.add("b", [0.0, 1.0], _response("B"))
+    assert cache.stats()["evictions"] == 0
+
+
+def test_full_cache_evicts_least_recently_used(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(semantic_cache.time, "monotonic", lambda: now[0])
+    cache = SemanticCache(max_items=2)
+    cache.add("a", [1.0, 0.0, 0.0], _response("A"))
+    now[0] += 1
+    cache.add("b", [0.0, 1.0, 0.0], _response("B"))
+    now[0] += 1
+    assert cache.lookup("a", [1.0, 0.0, 0.0]) is not None
+    now[0] += 1
+    cache.add("c", [0.0, 0.0, 1.0], _response("C"))
+    assert cache.lookup("b", [0.0, 1.0, 0.0]) is None
+    assert cache.lookup("a", [1.0, 0.0, 0.0]) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_clear_and_dimension_change():
+    cache = SemanticCache()
+    cache.add("a", [1.0, 0.0], _response("A"))
+    assert cache.lookup("a", [1.0, 0.0, 0.0]) is None
+    cache.clear()
+    assert cache.lookup("a", [1.0, 0.0]) is None
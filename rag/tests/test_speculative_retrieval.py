@@ -0,0 +1,47 @@
+"""推测式检索：复用 fusion 的加权 RRF 合并，kept / merged 两种结果"""
+import asyncio
+
+from models import KnowledgeSource
+from speculative_retrieval import aretrieve_speculative, merge_results, query_similarity
+
+
+def _src(doc_id, score=0.5):
+    return KnowledgeSource(source="knowledge_base", content=f"内容{doc_id}", score=score, metadata={"id": doc_id, "fusion_score": 0.1})
+
+
+def _ids(sources):
+    return [s.metadata["id"] for s in sources]
+
+
+def test_merge_prefers_rewritten_results_and_keeps_original_objects():
+    primary, secondary = [_src("a"), _src("b")], [_src("c"), _src("a")]
+    merged = merge_results(primary, secondary, top_k=3, secondary_weight=0.5)
+    assert _ids(merged) == ["a", "b", "c"]
+    assert merged[0] is primary[0] and merged[0].metadata["fusion_score"] == 0.1
+
+
+def test_merge_rrf_k_changes_ranking():
+    primary, secondary = [_src("a"), _src("b")], [_src("b")]
+    # k 较小时排名差距影响更大：b 在两路都出现也追不上 a
+    assert _ids(merge_results(primary, secondary, 2, secondary_weight=0.2, rrf_k=1)) == ["a", "b"]
+    assert _ids(merge_results(primary, secondary, 2, secondary_weight=0.2, rrf_k=60)) == ["b", "a"]
+
+
+class _FakeRetriever:
+    async def aretrieve_with_timings(self, query, top_k, metadata_filter=None):
+        return [_src(query)], {"total_ms": 1.0}
+
+
+def test_speculative_kept_and_merged():
+    async def rewrite(value):
+        return value
+
+    async def main():
+        kept = await aretrieve_speculative(_FakeRetriever(), "头痛怎么办", rewrite("头痛怎么办"), 3)
+        merged = await aretrieve_speculative(_FakeRetriever(), "头痛怎么办", rewrite("偏头痛 治疗"), 3)
+        return kept, merged
+
+    (q1, kept, t1), (q2, merged, t2) = asyncio.run(main())
+    assert t1["speculative"]["outcome"] == "kept" and _ids(kept) == ["头痛怎么办"]
+    assert t2["speculative"]["outcome"] == "merged" and _ids(merged) == ["偏头痛 治疗", "头痛怎么办"]
+    assert query_similarity("头痛", "头痛") == 1.0
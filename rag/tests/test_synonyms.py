@@ -0,0 +1,25 @@
+"""同义词规范化（单遍最长匹配）与 build_synonyms 词表挖掘"""
+from build_synonyms import colloquial_variants, mine_synonyms
+from query_optimizer import SynonymNormalizer
+
+
+def test_normalizer_replaces_longest_match_in_one_pass():
+    normalizer = SynonymNormalizer({"想吐": "恶心", "恶心想吐": "恶心 呕吐", "头疼": "头痛", "痛": "痛"})
+    assert len(normalizer) == 3
+    assert normalizer.normalize("头疼还恶心想吐") == "头痛还恶心 呕吐"
+    # 替换结果不会被再次匹配（「恶心」不是词表中的口语词条，也不会链式替换）
+    assert normalizer.normalize("想吐") == "恶心"
+
+
+def test_colloquial_variants():
+    variants = colloquial_variants("腹泻伴发热")
+    assert {"拉肚子伴发热", "腹泻伴发烧", "拉稀伴发烧"} <= variants
+    assert "腹泻伴发热" not in variants
+
+
+def test_mine_synonyms_skips_canonical_terms_and_maps_aliases():
+    synonyms = mine_synonyms(["头痛", "头痛", "头疼", "小儿腹泻", "肺结核（肺痨）"])
+    assert synonyms["小儿拉肚子"] == "小儿腹泻"
+    assert synonyms["肺痨"] == "肺结核"
+    # 「头疼」本身是规范词条，不会被改写成「头痛」
+    assert "头疼" not in synonyms
@@ -0,0 +1,75 @@
+"""本地向量索引行为测试：按原文档 id 删除切分块"""
+import numpy as np
+import pytest
+
+from vector_index import FlatVectorIndex, HNSWVectorIndex
+
+DIM = 8
+
+
+def _rows(ids, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{"id": doc_id, "content": doc_id, "embedding": rng.random(DIM).tolist()} for doc_id in ids]
+
+
+def _all_ids(index, query):
+    return {doc["id"] for doc, _ in index.search(query, 100)}
+
+
+@pytest.fixture(params=["flat", "hnsw"])
+def index_cls(request):
+    if request.param == "hnsw":
+        pytest.importorskip("hnswlib")
+        return HNSWVectorIndex
+    return FlatVectorIndex
+
+
+def test_delete_parent_removes_all_chunks(index_cls):
+    rows = _rows(["doc1_chunk_0", "doc1_chunk_1", "doc1_chunk_2", "doc2_chunk_0", "doc3"])
+    index = index_cls.build(rows, DIM)
+    assert index.delete(["doc1"]) == 3
+    hits = _all_ids(index, rows[0]["embedding"])
+    assert not any(doc_id.startswith("doc1_") for doc_id in hits)
+    assert hits == {"doc2_chunk_0", "doc3"}
+
+
+def test_update_with_fewer_chunks_drops_stale_chunks(index_cls):
+    index = index_cls.build(_rows(["doc1_chunk_0", "doc1_chunk_1", "doc1_chunk_2", "doc2"]), DIM)
+    index.delete(["doc1"])
+    index.add_rows(_rows(["doc1_chunk_0"], seed=1))
+    assert _all_ids(index, [0.5] * DIM) == {"doc1_chunk_0", "doc2"}
+
+
+def test_hnsw_search_after_mark_deleted_matches_exact():
+    pytest.importorskip("hnswlib")
+    rows = _rows([f"doc{i}" for i in range(40)], seed=2)
+    hnsw = HNSWVectorIndex.build(rows, DIM)
+    flat = FlatVectorIndex.build(rows, DIM)
+    deleted = [f"doc{i}" for i in range(0, 40, 2)]
+    hnsw.delete(deleted)
+    flat.delete(deleted)
+    query = rows[1]["embedding"]
+    # k 等于 / 超过存活条数：图搜索凑不满时回退为对存活槽位的精确计算
+    for k in (20, 50):
+        hits = hnsw.search(query, k)
+        assert len(hits) == 20
+        assert [doc["id"] for doc, _ in hits] == [doc["id"] for doc, _ in flat.search(query, k)]
+    assert hnsw._search_positions(np.asarray([query], dtype=np.float32), 50, hnsw.live)[0][0].size == 20
+
+
+def test_hnsw_search_when_everything_deleted():
+    pytest.importorskip("hnswlib")
+    index = HNSWVectorIndex.build(_rows(["doc1", "doc2"]), DIM)
+    index.delete(["doc1", "doc2"])
+    assert index.search([0.5] * DIM, 5) == []
+
+
+def test_hnsw_snapshot_with_tombstones_keeps_build_params(tmp_path):
+    pytest.importorskip("hnswlib")
+    rows = _rows([f"doc{i}" for i in range(20)])
+    index = HNSWVectorIndex.build(rows, DIM, m=8, ef_construction=50)
+    index.delete(["doc0"])
+    index.save(str(tmp_path), "g1")
+    loaded = HNSWVectorIndex.load(str(tmp_path), "g1")
+    assert (loaded.graph.M, loaded.graph.ef_construction) == (8, 50)
+    assert len(_all_ids(loaded, rows[1]["embedding"])) == 19
@@ -0,0 +1,83 @@
+"""
+离线训练学习型重排模型（逻辑回归），输出 JSON 权重供 RERANK_METHOD=learned 使用。
+训练数据与 evaluation.py 同格式（data/eval_questions.json）：question 必填，
+relevant_names（相关疾病名列表）可选，缺省时以「疾病名出现在问题或 ground_truth 中」作为弱标注。
+每条问题跑一次多路召回，按线上同样的 FUSION_METHOD 合并，候选逐条提取特征并打标签（训练与服务的候选分布一致）。
+用法：
+  cd rag && python train_reranker.py
+  python train_reranker.py --data data/eval_questions.json --output data/reranker_weights.json
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from config import settings, resolve_path
+from retriever import MultiPathRetriever
+from query_optimizer import optimize as optimize_query
+from learned_reranker import LearnedReranker, FEATURE_NAMES, extract_features, query_terms, is_relevant
+from evaluation import load_eval_data
+
+
+def collect_training_samples(eval_data: list, retriever: MultiPathRetriever) -> tuple:
+    """返回 (特征矩阵, 标签)；全部问题整批召回一次"""
+    features, labels = [], []
+    items = [item for item in eval_data if (item.get("question") or "").strip()]
+    retrieval_queries = [
+        optimize_query(
+            item["question"].strip(),
+            enable_rewrite=settings.enable_query_rewrite,
+            enable_normalize=settings.enable_query_normalize,
+            adaptive_rewrite=settings.query_rewrite_adaptive,
+        )
+        for item in items
+    ]
+    # 与检索服务共用合并逻辑：重排模型在线上看到的就是这些候选
+    batch_candidates = retriever.recall_candidates_batch(retrieval_queries)
+    for item, retrieval_query, candidates in zip(items, retrieval_queries, batch_candidates):
+        terms = query_terms(retrieval_query)
+        for source in candidates:
+            features.append(extract_features(retrieval_query, terms, source))
+            labels.append(1.0 if is_relevant(item, source) else 0.0)
+    return np.array(features, dtype=np.float64).reshape(-1, len(FEATURE_NAMES)), np.array(labels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="训练学习型重排模型")
+    parser.add_argument("--data", default="data/eval_questions.json", help="训练问题 JSON 路径")
+    parser.add_argument("--output", default=settings.learned_reranker_path, help="权重输出 JSON 路径")
+    parser.add_argument("--epochs", type=int, default=500)
+    parser.add_argument("--learning-rate", type=float, default=0.1)
+    parser.add_argument("--l2", type=float, default=1e-3)
+    args = parser.parse_args()
+
+    data_path = resolve_path(args.data)
+    output_path = resolve_path(args.output)
+
+    eval_data = load_eval_data(data_path)
+    print(f"共 {len(eval_data)} 条问题，开始召回并提取特征（FUSION_METHOD={settings.fusion_method}）...")
+    retriever = MultiPathRetriever()
+    features, labels = collect_training_samples(eval_data, retriever)
+    n_pos = int(labels.sum())
+    print(f"样本数: {len(labels)}（正样本 {n_pos}）")
+    if n_pos == 0 or n_pos == len(labels):
+        print("❌ 正负样本缺一，无法训练；请补充 relevant_names 标注或更多问题")
+        return
+
+    reranker = LearnedReranker.fit(features, labels, epochs=args.epochs, learning_rate=args.learning_rate, l2=args.l2)
+    pred = reranker.predict(features)
+    accuracy = float(((pred >= 0.5) == (labels > 0)).mean())
+    print(f"训练集准确率: {accuracy:.2%}")
+    print("特征权重（标准化后）：")
+    for name, weight in zip(FEATURE_NAMES, reranker.weights):
+        print(f"  {name}: {weight:+.3f}")
+
+    reranker.save(output_path)
+    print(f"✅ 权重已写入: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
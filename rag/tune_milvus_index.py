@@ -0,0 +1,263 @@
+"""
+Milvus 向量索引调参：在同一份向量上遍历索引类型 / 建索引参数 / 搜索参数，报告
+recall@k（以 NumPy 精确检索为基准）、单条查询 p50 / p99 延迟、建索引耗时与索引内存（QuerySegmentInfo.mem_size），
+用数据选择 MILVUS_INDEX_TYPE / MILVUS_INDEX_PARAMS / MILVUS_SEARCH_PARAMS 的工作点。
+向量来源（--source）：
+- collection：当前 MILVUS_COLLECTION_NAME 中已入库的 embedding（默认）
+- snapshot：本地向量索引快照（VECTOR_INDEX_DIR）
+- synthetic：高斯聚类合成向量（无需知识库，--num-vectors / --dim 控制规模）
+查询默认取库内随机向量加小幅噪声；传 --questions 时改用评估问题的真实 embedding（需 OpenAI Key）。
+每个索引配置写入临时 collection（{MILVUS_COLLECTION_NAME}_tune），测完即删除，不影响线上 collection。
+用法：
+  cd rag && python tune_milvus_index.py
+  python tune_milvus_index.py --index-types IVF_FLAT,HNSW --top-k 10 --target-recall 0.95
+  python tune_milvus_index.py --source synthetic --num-vectors 50000 --dim 768
+  python tune_milvus_index.py --uri ./milvus_tune.db   # Milvus Lite（pymilvus>=2.4 + milvus-lite，支持的索引类型有限）
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from pymilvus import connections, Collection, FieldSchema, CollectionSchema, DataType, utility
+
+from config import settings
+from milvus_index import MILVUS_INDEX_TYPES, build_index_params, build_search_params
+
+INSERT_BATCH_SIZE = 2000
+WARMUP_QUERIES = 5
+
+
+def sweep_grid(index_type: str, dim: int, top_k: int) -> list:
+    """返回 [(建索引参数, [搜索参数, ...])]：建索引参数变化需重建索引，搜索参数只影响查询"""
+    nprobes = (1, 4, 8, 16, 32, 64, 128)
+    efs = [ef for ef in (16, 32, 64, 128, 256, 512) if ef >= top_k]
+    if index_type == "FLAT":
+        return [({}, [{}])]
+    if index_type in ("IVF_FLAT", "IVF_SQ8"):
+        return [
+            ({"nlist": nlist}, [{"nprobe": p} for p in nprobes if p <= nlist])
+            for nlist in (128, 256, 1024)
+        ]
+    if index_type == "IVF_PQ":
+        # m 需整除维度；子空间越多精度越高、内存越大
+        m_values = [m for m in (16, 32, 48, 64) if dim % m == 0] or [1]
+        return [
+            ({"nlist": 256, "m": m, "nbits": 8}, [{"nprobe": p} for p in nprobes if p <= 256])
+            for m in m_values
+        ]
+    if index_type == "HNSW":
+        return [({"M": m, "efConstruction": 200}, [{"ef": ef} for ef in efs]) for m in (8, 16, 32)]
+    raise ValueError(f"未知的 Milvus 索引类型: {index_type}")
+
+
+def load_vectors(args) -> np.ndarray:
+    if args.source == "synthetic":
+        rng = np.random.default_rng(args.seed)
+        centers = rng.standard_normal((max(args.num_vectors // 100, 1), args.dim)).astype(np.float32)
+        assign = rng.integers(0, len(centers), size=args.num_vectors)
+        vectors = centers[assign] + 0.3 * rng.standard_normal((args.num_vectors, args.dim)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    if args.source == "snapshot":
+        from vector_index import FlatVectorIndex
+        index = FlatVectorIndex.load(settings.vector_index_dir)
+        if index is None:
+            raise RuntimeError(f"本地向量索引快照不存在或不是 flat 类型: {settings.vector_index_dir}")
+        return np.asarray(index.live_vectors(), dtype=np.float32)
+
+    collection = Collection(settings.milvus_collection_name)
+    collection.load()
+    vectors = []
+    it = collection.query_iterator(batch_size=1000, limit=-1, expr="id != ''", output_fields=["embedding"])
+    while True:
+        batch = it.next()
+        if not batch:
+            it.close()
+            break
+        vectors.extend(row["embedding"] for row in batch)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def load_queries(args, vectors: np.ndarray) -> np.ndarray:
+    if args.questions:
+        from langchain_openai import OpenAIEmbeddings
+        from evaluation import load_eval_data
+        questions = [item["question"] for item in load_eval_data(args.questions) if item.get("question")]
+        embeddings = OpenAIEmbeddings(
+            openai_api_key=settings.openai_api_key,
+            openai_api_base=settings.openai_api_base,
+            model=settings.embedding_model,
+        )
+        return np.asarray(embeddings.embed_documents(questions[: args.num_queries]), dtype=np.float32)
+    rng = np.random.default_rng(args.seed + 1)
+    picked = vectors[rng.choice(len(vectors), size=min(args.num_queries, len(vectors)), replace=False)]
+    noise = rng.standard_normal(picked.shape).astype(np.float32) * picked.std() * args.query_noise
+    return picked + noise
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int, metric_type: str) -> np.ndarray:
+    """NumPy 精确检索的 Top-K 行号（与 Milvus 同一度量），作为 recall 基准"""
+    if metric_type == "COSINE":
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    if metric_type == "L2":
+        scores = -((queries ** 2).sum(axis=1, keepdims=True) - 2 * queries @ vectors.T + (vectors ** 2).sum(axis=1))
+    else:
+        scores = queries @ vectors.T
+    k = min(k, vectors.shape[0])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+
+def create_tune_collection(name: str, vectors: np.ndarray) -> Collection:
+    if utility.has_collection(name):
+        utility.drop_collection(name)
+    fields = [
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=vectors.shape[1]),
+    ]
+    collection = Collection(name=name, schema=CollectionSchema(fields=fields, description="索引调参临时 collection"))
+    for start in range(0, len(vectors), INSERT_BATCH_SIZE):
+        batch = vectors[start : start + INSERT_BATCH_SIZE]
+        collection.insert([list(range(start, start + len(batch))), batch.tolist()])
+    collection.flush()
+    return collection
+
+
+def index_memory_mb(name: str):
+    """已加载 segment 的内存占用（MB）；服务端不返回时为 None"""
+    try:
+        segments = utility.get_query_segment_info(name)
+        total = sum(getattr(seg, "mem_size", 0) for seg in segments)
+        return total / 1024 / 1024 if total else None
+    except Exception:
+        return None
+
+
+def bench_search(collection: Collection, queries: np.ndarray, exact: np.ndarray, k: int, param: dict) -> dict:
+    """逐条查询计时（模拟线上单请求），并按精确结果计算 recall@k"""
+    for q in queries[:WARMUP_QUERIES]:
+        collection.search(data=[q.tolist()], anns_field="embedding", param=param, limit=k)
+    latencies, recalls = [], []
+    for q, truth in zip(queries, exact):
+        start = time.perf_counter()
+        results = collection.search(data=[q.tolist()], anns_field="embedding", param=param, limit=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(set(results[0].ids) & set(truth.tolist())) / len(truth))
+    return {
+        "recall": float(np.mean(recalls)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def tune_index_type(index_type: str, vectors: np.ndarray, queries: np.ndarray, exact: np.ndarray, args) -> list:
+    rows = []
+    name = f"{settings.milvus_collection_name}_tune"
+    for build_params, search_grid in sweep_grid(index_type, vectors.shape[1], args.top_k):
+        print(f"\n===== {index_type} {json.dumps(build_params)} =====")
+        collection = create_tune_collection(name, vectors)
+        try:
+            index_params = build_index_params(index_type, args.metric, build_params)
+            start = time.perf_counter()
+            collection.create_index(field_name="embedding", index_params=index_params)
+            utility.wait_for_index_building_complete(name)
+            build_s = time.perf_counter() - start
+            collection.load()
+            memory_mb = index_memory_mb(name)
+            for search_params in search_grid:
+                param = build_search_params(index_type, args.metric, search_params)
+                row = {
+                    "index_type": index_type,
+                    "metric_type": args.metric,
+                    "index_params": build_params,
+                    "search_params": search_params,
+                    "build_s": build_s,
+                    "memory_mb": memory_mb,
+                    **bench_search(collection, queries, exact, args.top_k, param),
+                }
+                rows.append(row)
+                memory = f"{memory_mb:.1f}MB" if memory_mb is not None else "-"
+                print(
+                    f"  {json.dumps(search_params):<18} recall@{args.top_k}={row['recall']:.3f}  "
+                    f"p50={row['p50_ms']:.2f}ms  p99={row['p99_ms']:.2f}ms  build={build_s:.1f}s  mem={memory}"
+                )
+        except Exception as e:
+            print(f"❌ {index_type} {json.dumps(build_params)} 测试失败: {e}")
+        finally:
+            utility.drop_collection(name)
+    return rows
+
+
+def recommend(rows: list, target_recall: float):
+    """满足目标召回率的配置中 p99 最低者；都不满足时取召回率最高者"""
+    if not rows:
+        return None
+    qualified = [row for row in rows if row["recall"] >= target_recall]
+    if qualified:
+        return min(qualified, key=lambda row: (row["p99_ms"], row["memory_mb"] or 0))
+    return max(rows, key=lambda row: row["recall"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Milvus 向量索引参数扫描（recall@k / 延迟 / 内存）")
+    parser.add_argument("--source", choices=("collection", "snapshot", "synthetic"), default="collection")
+    parser.add_argument("--num-vectors", type=int, default=10000, help="synthetic 向量条数")
+    parser.add_argument("--dim", type=int, default=settings.embedding_dim, help="synthetic 向量维度")
+    parser.add_argument("--questions", default="", help="评估问题 JSON（如 data/eval_questions.json），用其 embedding 作查询")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--query-noise", type=float, default=0.1, help="库内向量作查询时叠加的噪声（相对标准差）")
+    parser.add_argument("--index-types", default=",".join(MILVUS_INDEX_TYPES), help="逗号分隔的索引类型")
+    parser.add_argument("--metric", default=settings.milvus_metric_type)
+    parser.add_argument("--top-k", type=int, default=settings.top_k_retrieval)
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--uri", default="", help="Milvus Lite 数据文件或服务 URI；为空时使用 MILVUS_HOST / MILVUS_PORT")
+    parser.add_argument("--output", default="results/milvus_index_tuning.json")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    args.metric = args.metric.upper()
+
+    if args.uri:
+        connections.connect(alias="default", uri=args.uri)
+    else:
+        connections.connect(alias="default", host=settings.milvus_host, port=settings.milvus_port)
+
+    vectors = load_vectors(args)
+    if len(vectors) == 0:
+        print("❌ 没有可用的向量，请先构建知识库或使用 --source synthetic")
+        return
+    queries = load_queries(args, vectors)
+    print(f"向量: {vectors.shape[0]} × {vectors.shape[1]}，查询: {len(queries)} 条，度量: {args.metric}，k={args.top_k}")
+    start = time.perf_counter()
+    exact = exact_top_k(vectors, queries, args.top_k, args.metric)
+    print(f"精确基准计算完成，耗时 {time.perf_counter() - start:.1f}s")
+
+    rows = []
+    for index_type in [t.strip().upper() for t in args.index_types.split(",") if t.strip()]:
+        rows.extend(tune_index_type(index_type, vectors, queries, exact, args))
+
+    base = Path(__file__).resolve().parent
+    output_path = Path(args.output) if Path(args.output).is_absolute() else base / args.output
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump({"num_vectors": int(vectors.shape[0]), "dim": int(vectors.shape[1]), "top_k": args.top_k, "results": rows}, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ 结果已写入: {output_path}")
+
+    best = recommend(rows, args.target_recall)
+    if best:
+        qualified = best["recall"] >= args.target_recall
+        print(f"\n推荐配置（{'recall@%d ≥ %s 中 p99 最低' % (args.top_k, args.target_recall) if qualified else '均未达到目标召回率，取召回率最高者'}）：")
+        print(f"  recall={best['recall']:.3f}  p50={best['p50_ms']:.2f}ms  p99={best['p99_ms']:.2f}ms")
+        print(f"  MILVUS_INDEX_TYPE={best['index_type']}")
+        print(f"  MILVUS_METRIC_TYPE={best['metric_type']}")
+        print(f"  MILVUS_INDEX_PARAMS={json.dumps(best['index_params'])}")
+        print(f"  MILVUS_SEARCH_PARAMS={json.dumps(best['search_params'])}")
+
+
+if __name__ == "__main__":
+    main()
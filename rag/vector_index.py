@@ -0,0 +1,371 @@
+"""
+进程内向量索引：Milvus 之外的低延迟向量检索后端（VECTOR_BACKEND=flat / hnsw）
+- FlatVectorIndex：float32 向量矩阵（快照中 mmap 加载），一次 BLAS 矩阵乘完成精确 L2 检索，适合万级向量
+- HNSWVectorIndex：hnswlib 的 HNSW 图索引（可选依赖），适合更大规模的近似检索
+两者距离均为平方 L2（与 Milvus 的 L2 度量一致），文档库与 BM25 快照相同（docs.jsonl + 偏移 mmap）。
+增量更新：新增向量写入内存增量段，删除打墓碑；快照写入前合并。
+"""
+import os
+import json
+import time
+import hashlib
+import shutil
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+from bm25_index import AppendableDocs, DocIdMap, DocMaskCache, write_doc_store, load_doc_store
+
+# 快照格式版本：布局变化时递增，旧快照会被忽略并重建
+VECTOR_INDEX_FORMAT_VERSION = 1
+VECTOR_INDEX_POINTER_FILE = "CURRENT"
+
+VECTOR_BACKENDS = ("milvus", "flat", "hnsw")
+
+
+class LocalVectorIndex:
+    """
+    本地向量索引基类：维护文档库、文档 id、墓碑与快照读写，子类实现具体的近邻搜索。
+    向量按插入顺序占用槽位（与文档库下标一致）。
+    """
+
+    kind = ""
+
+    def __init__(self, dim: int, docs: Any, doc_ids: List[Optional[str]], generation: Optional[str] = None):
+        self.dim = dim
+        self.docs = docs if isinstance(docs, (list, AppendableDocs)) else AppendableDocs(docs)
+        self.doc_ids: List[Optional[str]] = list(doc_ids)
+        self._id_map = DocIdMap(self.doc_ids)
+        self.live = np.ones(len(self.doc_ids), dtype=bool)
+        self.generation = generation
+        self._lock = threading.RLock()
+        # 元数据过滤位图（按槽位），新增向量时补算
+        self._masks = DocMaskCache()
+
+    def __len__(self) -> int:
+        return int(self.live.sum())
+
+    # ---------- 构建与增量更新 ----------
+
+    @classmethod
+    def build(cls, rows: List[Dict[str, Any]], dim: int, generation: Optional[str] = None, **params) -> "LocalVectorIndex":
+        """rows 为带 embedding 的病症库行；文档库中不保存 embedding"""
+        rows = [row for row in rows if row.get("embedding") is not None]
+        vectors = np.asarray([row["embedding"] for row in rows], dtype=np.float32).reshape(len(rows), dim)
+        docs = [{k: v for k, v in row.items() if k != "embedding"} for row in rows]
+        return cls.from_vectors(vectors, docs, [doc.get("id") for doc in docs], generation=generation, **params)
+
+    @classmethod
+    def from_vectors(cls, vectors: np.ndarray, docs: Any, doc_ids: List[Optional[str]], generation: Optional[str] = None, **params):
+        raise NotImplementedError
+
+    def add_rows(self, rows: List[Dict[str, Any]]):
+        """按 id upsert：已存在的 id 先打墓碑，再追加新向量"""
+        rows = [row for row in rows if row.get("embedding") is not None]
+        if not rows:
+            return
+        with self._lock:
+            self.delete([row.get("id") for row in rows if row.get("id")])
+            vectors = np.asarray([row["embedding"] for row in rows], dtype=np.float32).reshape(len(rows), self.dim)
+            start = len(self.doc_ids)
+            for i, row in enumerate(rows):
+                doc = {k: v for k, v in row.items() if k != "embedding"}
+                self.docs.append(doc)
+                self.doc_ids.append(doc.get("id"))
+                if doc.get("id"):
+                    self._id_map.set(doc["id"], start + i)
+            self.live = np.concatenate([self.live, np.ones(len(rows), dtype=bool)])
+            self._masks.extend(self.docs, start)
+            self._append_vectors(vectors, start)
+
+    def delete(self, doc_ids: List[str]) -> int:
+        """按文档 id 打墓碑，原文档 id 连同其全部切分块一起删除，返回实际删除条数"""
+        with self._lock:
+            deleted = 0
+            for doc_id in self._id_map.expand(doc_ids):
+                idx = self._id_map.pop(doc_id)
+                if idx is not None and self.live[idx]:
+                    self.live[idx] = False
+                    self._mark_deleted(idx)
+                    deleted += 1
+            return deleted
+
+    def _append_vectors(self, vectors: np.ndarray, start: int):
+        raise NotImplementedError
+
+    def _mark_deleted(self, idx: int):
+        pass
+
+    def iter_live_documents(self) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            docs = self.docs
+            live_idx = np.flatnonzero(self.live).tolist()
+        for idx in live_idx:
+            yield docs[idx]
+
+    # ---------- 检索 ----------
+
+    def _search_positions(self, queries: np.ndarray, k: int, allowed: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """返回每条查询的 (槽位下标, 平方 L2 距离)，按距离升序，只含 allowed 为 True 的槽位"""
+        raise NotImplementedError
+
+    def search_batch(self, queries: List[List[float]], k: int, doc_filter: Any = None) -> List[List[Tuple[Dict[str, Any], float]]]:
+        """
+        批量近邻检索：每条查询返回 [(文档, 平方 L2 距离), ...]。
+        doc_filter（元数据过滤条件）给定时只在过滤位图内的向量中检索。
+        """
+        q = np.asarray(queries, dtype=np.float32).reshape(len(queries), self.dim)
+        with self._lock:
+            allowed = self._masks.get(doc_filter, self.docs) & self.live if doc_filter else self.live
+            hits = self._search_positions(q, min(k, int(allowed.sum())), allowed)
+            return [[(self.docs[int(i)], float(d)) for i, d in zip(pos, dist)] for pos, dist in hits]
+
+    def search(self, query: List[float], k: int, doc_filter: Any = None) -> List[Tuple[Dict[str, Any], float]]:
+        return self.search_batch([query], k, doc_filter)[0]
+
+    # ---------- 快照 ----------
+
+    def live_vectors(self) -> np.ndarray:
+        raise NotImplementedError
+
+    def save(self, root: str, generation: Optional[str] = None) -> str:
+        """写入版本化快照目录并原子更新 CURRENT 指针（只保存未删除的向量与文档）"""
+        generation = generation if generation is not None else self.generation
+        with self._lock:
+            live_idx = np.flatnonzero(self.live)
+            vectors = self.live_vectors()
+            docs = [self.docs[int(i)] for i in live_idx]
+            doc_ids = [self.doc_ids[int(i)] for i in live_idx]
+
+        os.makedirs(root, exist_ok=True)
+        name = f"{self.kind}-v{VECTOR_INDEX_FORMAT_VERSION}-{hashlib.sha1(str(generation).encode('utf-8')).hexdigest()[:16]}"
+        target = os.path.join(root, name)
+        tmp = f"{target}.tmp-{os.getpid()}"
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+
+        np.save(os.path.join(tmp, "vectors.npy"), np.ascontiguousarray(vectors, dtype=np.float32))
+        with open(os.path.join(tmp, "doc_ids.json"), "w", encoding="utf-8") as f:
+            json.dump(doc_ids, f, ensure_ascii=False)
+        write_doc_store(tmp, docs)
+        self._save_backend(tmp, vectors)
+        meta = {
+            "kind": self.kind,
+            "format_version": VECTOR_INDEX_FORMAT_VERSION,
+            "generation": generation,
+            "dim": self.dim,
+            "n_vectors": len(doc_ids),
+            "created_at": int(time.time()),
+        }
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.replace(tmp, target)
+        pointer_tmp = os.path.join(root, f"{VECTOR_INDEX_POINTER_FILE}.tmp-{os.getpid()}")
+        with open(pointer_tmp, "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(pointer_tmp, os.path.join(root, VECTOR_INDEX_POINTER_FILE))
+
+        for entry in os.listdir(root):
+            path = os.path.join(root, entry)
+            if entry != name and os.path.isdir(path) and "-v" in entry and ".tmp-" not in entry:
+                shutil.rmtree(path, ignore_errors=True)
+        return target
+
+    def _save_backend(self, path: str, vectors: np.ndarray):
+        pass
+
+    @classmethod
+    def load(cls, root: str, generation: Optional[str] = None, **params) -> Optional["LocalVectorIndex"]:
+        """
+        加载 CURRENT 指向的快照；不存在、类型/格式不符，或 generation 给定且不一致时返回 None。
+        向量矩阵以 mmap 方式打开。
+        """
+        try:
+            with open(os.path.join(root, VECTOR_INDEX_POINTER_FILE), "r", encoding="utf-8") as f:
+                path = os.path.join(root, f.read().strip())
+            with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(os.path.join(path, "doc_ids.json"), "r", encoding="utf-8") as f:
+                doc_ids = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("kind") != cls.kind or meta.get("format_version") != VECTOR_INDEX_FORMAT_VERSION:
+            return None
+        if generation is not None and meta.get("generation") != generation:
+            return None
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        return cls._load_backend(path, vectors, load_doc_store(path), doc_ids, meta.get("generation"), **params)
+
+    @classmethod
+    def _load_backend(cls, path: str, vectors: np.ndarray, docs: Any, doc_ids: List[Optional[str]], generation: Optional[str], **params):
+        return cls.from_vectors(vectors, docs, doc_ids, generation=generation, **params)
+
+
+class FlatVectorIndex(LocalVectorIndex):
+    """
+    精确检索：||x - q||² = ||x||² - 2 x·q + ||q||²，
+    一次 (N × D) @ (D × Q) 的 BLAS 矩阵乘得到全部内积，再 argpartition 取 Top-K。
+    """
+
+    kind = "flat"
+
+    def __init__(self, vectors: np.ndarray, docs: Any, doc_ids: List[Optional[str]], generation: Optional[str] = None):
+        super().__init__(vectors.shape[1], docs, doc_ids, generation)
+        # 基础段可能是 mmap 的只读矩阵；增量段在内存中
+        self.base = vectors
+        self.base_norms = np.einsum("ij,ij->i", vectors, vectors, dtype=np.float32)
+        self.delta = np.empty((0, self.dim), dtype=np.float32)
+        self.delta_norms = np.empty(0, dtype=np.float32)
+
+    @classmethod
+    def from_vectors(cls, vectors, docs, doc_ids, generation=None, **params):
+        return cls(vectors, docs, doc_ids, generation)
+
+    def _append_vectors(self, vectors: np.ndarray, start: int):
+        self.delta = np.vstack([self.delta, vectors])
+        self.delta_norms = np.concatenate([self.delta_norms, np.einsum("ij,ij->i", vectors, vectors)])
+
+    def _search_positions(self, queries: np.ndarray, k: int, allowed: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+        n = len(self.doc_ids)
+        if k <= 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in queries]
+        dots = self.base @ queries.T
+        norms = self.base_norms
+        if len(self.delta):
+            dots = np.vstack([dots, self.delta @ queries.T])
+            norms = np.concatenate([norms, self.delta_norms])
+        dist = norms[:n, None] - 2 * dots + np.einsum("ij,ij->i", queries, queries)[None, :]
+        dist[~allowed] = np.inf
+        results = []
+        for j in range(dist.shape[1]):
+            col = dist[:, j]
+            top = np.argpartition(col, k - 1)[:k]
+            top = top[np.argsort(col[top], kind="stable")]
+            results.append((top, np.maximum(col[top], 0.0)))
+        return results
+
+    def live_vectors(self) -> np.ndarray:
+        all_vectors = np.vstack([self.base, self.delta]) if len(self.delta) else np.asarray(self.base)
+        return all_vectors[self.live]
+
+
+class HNSWVectorIndex(LocalVectorIndex):
+    """
+    HNSW 近似检索（需安装 hnswlib）。槽位下标即 hnswlib 的 label，删除使用 mark_deleted。
+    M / ef_construction 决定建图质量与内存，ef_search 决定查询召回与延迟。
+    """
+
+    kind = "hnsw"
+
+    def __init__(self, graph: Any, vectors: np.ndarray, docs: Any, doc_ids: List[Optional[str]], generation: Optional[str] = None, ef_search: int = 64):
+        super().__init__(vectors.shape[1], docs, doc_ids, generation)
+        self.graph = graph
+        self.graph.set_ef(ef_search)
+        self.ef_search = ef_search
+        # 建图参数取自图本身（新建与从快照加载一致），快照重建图时沿用
+        self.m = graph.M
+        self.ef_construction = graph.ef_construction
+        self._vectors = [vectors]
+
+    @staticmethod
+    def _hnswlib():
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise ImportError("VECTOR_BACKEND=hnsw 需要安装 hnswlib：pip install hnswlib") from e
+        return hnswlib
+
+    @classmethod
+    def from_vectors(cls, vectors, docs, doc_ids, generation=None, m: int = 16, ef_construction: int = 200, ef_search: int = 64, **params):
+        hnswlib = cls._hnswlib()
+        graph = hnswlib.Index(space="l2", dim=vectors.shape[1])
+        graph.init_index(max_elements=max(len(vectors), 1), M=m, ef_construction=ef_construction)
+        if len(vectors):
+            graph.add_items(np.asarray(vectors, dtype=np.float32), np.arange(len(vectors)))
+        return cls(graph, vectors, docs, doc_ids, generation, ef_search=ef_search)
+
+    def _append_vectors(self, vectors: np.ndarray, start: int):
+        needed = start + len(vectors)
+        if needed > self.graph.get_max_elements():
+            self.graph.resize_index(max(needed, self.graph.get_max_elements() * 2))
+        self.graph.add_items(vectors, np.arange(start, needed))
+        self._vectors.append(vectors)
+
+    def _mark_deleted(self, idx: int):
+        self.graph.mark_deleted(idx)
+
+    # 过滤范围内的向量不超过该条数时直接精确计算（选择性高的过滤条件下图搜索反而更慢且可能凑不满 k）
+    EXACT_FILTER_MAX = 2000
+
+    def _search_positions(self, queries: np.ndarray, k: int, allowed: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+        subset = np.flatnonzero(allowed)
+        k = min(k, len(subset))
+        if k <= 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in queries]
+        if allowed is self.live or len(subset) > self.EXACT_FILTER_MAX:
+            # 未过滤时 mark_deleted 的节点由 hnswlib 自行跳过
+            query_filter = None if allowed is self.live else (lambda label: bool(allowed[label]))
+            try:
+                labels, distances = self.graph.knn_query(queries, k=k, filter=query_filter)
+                return [(labels[j].astype(np.int64), distances[j]) for j in range(len(queries))]
+            except RuntimeError:
+                pass  # 删除 / 过滤后图上凑不满 k 个近邻，改为对可用槽位精确计算
+        return self._exact_search(queries, k, subset)
+
+    def _exact_search(self, queries: np.ndarray, k: int, subset: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+        vectors = np.vstack([np.asarray(v) for v in self._vectors])[subset] if len(self._vectors) > 1 else np.asarray(self._vectors[0])[subset]
+        dist = (
+            np.einsum("ij,ij->i", vectors, vectors)[:, None]
+            - 2 * vectors @ queries.T
+            + np.einsum("ij,ij->i", queries, queries)[None, :]
+        )
+        results = []
+        for j in range(dist.shape[1]):
+            col = dist[:, j]
+            top = np.argpartition(col, k - 1)[:k]
+            top = top[np.argsort(col[top], kind="stable")]
+            results.append((subset[top], np.maximum(col[top], 0.0)))
+        return results
+
+    def live_vectors(self) -> np.ndarray:
+        return np.vstack([np.asarray(v) for v in self._vectors])[self.live]
+
+    def _save_backend(self, path: str, vectors: np.ndarray):
+        # 快照只含未删除向量，槽位重新编号，因此按快照内容重建图后保存
+        graph = self.graph
+        if not self.live.all():
+            # 沿用当前索引的 M / ef_construction，重载后的图与在线图建图参数一致
+            graph = HNSWVectorIndex.from_vectors(
+                vectors, [], [None] * len(vectors), m=self.m, ef_construction=self.ef_construction, ef_search=self.ef_search
+            ).graph
+        graph.save_index(os.path.join(path, "hnsw.bin"))
+
+    @classmethod
+    def _load_backend(cls, path, vectors, docs, doc_ids, generation, m: int = 16, ef_construction: int = 200, ef_search: int = 64, **params):
+        hnswlib = cls._hnswlib()
+        graph = hnswlib.Index(space="l2", dim=vectors.shape[1])
+        graph_path = os.path.join(path, "hnsw.bin")
+        if not os.path.exists(graph_path):
+            return cls.from_vectors(vectors, docs, doc_ids, generation, m=m, ef_construction=ef_construction, ef_search=ef_search)
+        graph.load_index(graph_path, max_elements=max(len(vectors), 1))
+        return cls(graph, vectors, docs, doc_ids, generation, ef_search=ef_search)
+
+
+def vector_index_params() -> Dict[str, Any]:
+    """本地向量索引的构建 / 检索参数（来自 Settings）"""
+    return {
+        "m": settings.hnsw_m,
+        "ef_construction": settings.hnsw_ef_construction,
+        "ef_search": settings.hnsw_ef_search,
+    }
+
+
+def vector_index_class(backend: str):
+    """VECTOR_BACKEND → 本地索引类（milvus 返回 None）"""
+    return {"flat": FlatVectorIndex, "hnsw": HNSWVectorIndex}.get(backend)